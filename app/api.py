@@ -0,0 +1,374 @@
+"""
+JSON API mounted on the Flask server of the Dash app, under API_PREFIX.
+
+    GET  /api/v1/
+        This documentation.
+    GET  /api/v1/elections
+        The stored elections: {country: [dates]}.
+    POST /api/v1/elections/<country>/<date>/apportion
+        Apportion a stored election. Body: {"system": SYSTEM, "by_region": bool, "groups": GROUPS},
+        where the optional GROUPS merges the regions of the highest level of
+        the election into custom districts (see groupings.District_Grouping),
+        either as {district: [region, ...]} or as a text with one district per
+        line, "District: region, region" (see groupings.parse_groups). With
+        GROUPS, the system is applied to the districts, regardless of its level.
+    POST /api/v1/apportion
+        Apportion posted votes. Body: {"system": SYSTEM, "regions": [REGION, ...]},
+        where REGION is {"name": str, "n_seats": int, "votes": {party: votes}}.
+    POST /api/v1/batch
+        Body: {"scenarios": [SCENARIO, ...]}, where every SCENARIO is the body of
+        one of the apportion endpoints plus, for stored elections, "country" and
+        "date". The results are streamed back as NDJSON, one line per scenario
+        in the order of the request: {"index": i, ...result} or {"index": i, "error": str}.
+        If the job endpoints exist, batches of more than API_BATCH_JOB_SCENARIOS
+        scenarios run as a job of kind "scenarios" instead: the response is
+        {"id": str} with status 202, and the same lines are its file results.ndjson.
+
+    POST /api/v1/jobs
+        Start a background job (see jobs.JOB_KINDS). Body: {"kind": str, "params": {...}},
+        where the election of an "ensemble" can be given as "country" and "date".
+        Returns {"id": str} with status 202.
+    GET  /api/v1/jobs/<id>
+        The status of a job: {"state", "done", "total", "message", "error", ...}.
+    DELETE /api/v1/jobs/<id>
+        Cancel a job. Returns its status.
+    GET  /api/v1/jobs/<id>/result
+        The result of a finished job, with its "files".
+    GET  /api/v1/jobs/<id>/files/<name>
+        A file written by a finished job.
+
+SYSTEM is {"name": str, "level": int, "threshold": str, "threshold_country": bool}
+(plus "compensatory_level" for two-tier and biproportional systems).
+Results are {"seats": {party: seats}} and, with "by_region", {"regions": {region: {party: seats}}}.
+
+The apportionments run in a pool of API_PROCESSES processes, so that heavy
+requests don't hold the GIL of the threads serving the dashboard. However, the
+request thread still waits for its results, so every request holds a thread
+(GUNICORN_THREADS) of a worker until it finishes: size the threads and workers
+for the concurrent API requests, and use the job endpoints for the analyses
+that can take longer than GUNICORN_TIMEOUT. Jobs run in the pool of their
+jobs.Job_Manager, and the job endpoints (and the batches run as jobs) only
+exist if one is given to create_api.
+"""
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import json
+import os
+import sys
+
+from flask import Blueprint, Response, jsonify, request, send_file, stream_with_context
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+import batch  # noqa: E402
+import electoral_systems  # noqa: E402
+import groupings  # noqa: E402
+from jobs import POOL_CONTEXT  # noqa: E402
+from regions import Electoral_Region  # noqa: E402
+
+API_PREFIX = '/api/v1'
+API_PROCESSES = int(os.environ.get('API_PROCESSES', min(4, os.cpu_count() or 1)))
+MAX_SCENARIOS = int(os.environ.get('API_MAX_SCENARIOS', 10000))
+# Longer batches run as background jobs, if there is a jobs.Job_Manager
+BATCH_JOB_SCENARIOS = int(os.environ.get('API_BATCH_JOB_SCENARIOS', 100))
+
+
+class API_Error(ValueError):
+    """
+    Error caused by an invalid request, returned with status 400.
+    """
+    pass
+
+
+def parse_system(spec):
+    """
+    Build an electoral_systems.System from its JSON description.
+    """
+    if not isinstance(spec, dict) or 'name' not in spec:
+        raise API_Error("'system' must be an object with at least a 'name'.")
+    try:
+        return electoral_systems.System(
+            spec['name'],
+            int(spec.get('level', 0)),
+            str(spec.get('threshold', 0)),
+            bool(spec.get('threshold_country', False)),
+            compensatory_level=int(spec.get('compensatory_level', 0)),
+        )
+    except (TypeError, ValueError) as e:
+        raise API_Error(str(e))
+
+
+def _get_seats(result, by_region):
+    seats = Counter()
+    for region_seats in result.values():
+        seats.update(region_seats)
+    response = {'seats': {p: int(s) for p, s in seats.items() if s}}
+    if by_region:
+        response['regions'] = {name: {p: int(s) for p, s in region_seats.items() if s} for name, region_seats in result.items()}
+    return response
+
+
+def parse_grouping(election, groups):
+    """
+    Build the groupings.District_Grouping of an election from its JSON
+    description: either {district: [region, ...]} or a text with one district
+    per line (see groupings.parse_groups).
+    """
+    try:
+        if isinstance(groups, str):
+            groups = groupings.parse_groups(groups)
+        if isinstance(groups, dict) and all(isinstance(members, list) for members in groups.values()):
+            return groupings.District_Grouping(election, {str(d): [str(r) for r in members] for d, members in groups.items()})
+    except ValueError as e:
+        raise API_Error(str(e))
+    raise API_Error("'groups' must be an object {district: [region, ...]} or a text with one district per line.")
+
+
+def apportion_election(election_name, system_spec, by_region=False, groups=None):
+    """
+    Apportion the election of the given class name (see batch.get_election)
+    with the system described by system_spec, in the districts described by
+    groups if they are given (see parse_grouping).
+    """
+    system = parse_system(system_spec)
+    # Only the names of elections, never any other attribute of the module
+    if election_name not in batch.get_election_names():
+        raise API_Error("Election '{}' does not exist.".format(election_name))
+    election = batch.get_election(election_name)
+    if groups:
+        return _get_seats(parse_grouping(election, groups).compute_result(system).result, by_region)
+    if system.level not in election.regions:
+        raise API_Error("The election has no regions of level {}.".format(system.level))
+    country_region = next(iter(election.regions[0].values()))
+    return _get_seats(country_region.compute_result(system).result, by_region)
+
+
+def apportion_votes(system_spec, regions, by_region=False):
+    """
+    Apportion posted votes: regions is a list of {"name", "n_seats", "votes"}
+    objects, every one of them apportioned independently with the system
+    described by system_spec (whose level is ignored). With a country-level
+    threshold, it applies to the sum of the votes of all the regions.
+    """
+    system = parse_system(system_spec)
+    if system.name not in electoral_systems.SYSTEM_NAMES:
+        raise API_Error("Only the systems {} can apportion posted votes.".format(', '.join(electoral_systems.SYSTEM_NAMES)))
+    if not isinstance(regions, list) or not regions:
+        raise API_Error("'regions' must be a non-empty list.")
+
+    electoral_regions = []
+    for i, region in enumerate(regions):
+        try:
+            votes = {str(p): int(v) for p, v in region['votes'].items()}
+            n_seats = int(region['n_seats'])
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise API_Error("Region {} must have 'n_seats' and a 'votes' object.".format(i))
+        if n_seats < 1:
+            raise API_Error("Region {} must have at least 1 seat.".format(i))
+        if any(v < 0 for v in votes.values()) or not sum(votes.values()):
+            raise API_Error("Region {} must have some votes, and no negative votes.".format(i))
+        electoral_regions.append(Electoral_Region(None, str(region.get('name', i)), 0, 0, n_seats, votes, 0, 0))
+
+    valid_parties = None
+    if system.threshold_country:
+        total_votes = Counter()
+        for region in electoral_regions:
+            total_votes.update(region.votes)
+        if system.threshold == 'n/2s':
+            vote_threshold = sum(total_votes.values()) / sum(r.n_seats for r in electoral_regions)
+        else:
+            vote_threshold = sum(total_votes.values()) * int(system.threshold) / 100
+        valid_parties = [p for p, v in total_votes.items() if v >= vote_threshold]
+
+    result = {r.name: r.compute_election_result(system, valid_parties) for r in electoral_regions}
+    return _get_seats(result, by_region)
+
+
+def compute_scenario(scenario):
+    """
+    Compute one scenario of a request: either a stored election (with the
+    key 'election', a class name) or posted votes (with the key 'regions').
+    Return the result, or {"error": message} for invalid scenarios and for
+    the scenarios that failed, so that they never stop the rest of a batch.
+    """
+    try:
+        if 'election' in scenario:
+            return apportion_election(scenario['election'], scenario.get('system'), scenario.get('by_region', False),
+                                      scenario.get('groups'))
+        return apportion_votes(scenario.get('system'), scenario.get('regions'), scenario.get('by_region', False))
+    except API_Error as e:
+        return {'error': str(e)}
+    except Exception as e:
+        return {'error': '{}: {}'.format(type(e).__name__, e)}
+
+
+def create_api(elections, processes=API_PROCESSES, jobs=None):
+    """
+    Return the Flask Blueprint of the API, given the stored elections (a
+    dictionary whose keys are countries and values are dictionaries whose keys
+    are dates and values are elections.Election objects, like main.ELECTIONS).
+    If processes is 0, the apportionments run in the request thread.
+    If a jobs.Job_Manager is given, the job endpoints run their jobs on it.
+    """
+    api = Blueprint('api', __name__, url_prefix=API_PREFIX)
+    executor = None
+
+    # Share the elections already loaded with batch.get_election, so that the
+    # request threads (if processes is 0) don't load them again. The workers of
+    # the pool are spawned (see jobs.POOL_CONTEXT), so they load the elections
+    # of their scenarios once each
+    for dates in elections.values():
+        # Only the loaded elections of an elections.Lazy_Elections
+        for election in getattr(dates, 'loaded', dates).values():
+            batch._ELECTIONS.setdefault(type(election).__name__, election)
+
+    def run(scenarios):
+        """
+        Yield the results of the scenarios in order, computed in the pool.
+        """
+        nonlocal executor
+        if processes == 0:
+            yield from map(compute_scenario, scenarios)
+            return
+        if executor is None:
+            executor = ProcessPoolExecutor(processes, mp_context=POOL_CONTEXT)
+        try:
+            yield from executor.map(compute_scenario, scenarios, chunksize=max(1, len(scenarios) // (4*processes)))
+        except BrokenProcessPool:
+            # A worker died: the next requests get a new pool
+            executor = None
+            raise
+
+    def resolve(scenario):
+        """
+        Replace the country and date of a stored election by its class name.
+        """
+        if not isinstance(scenario, dict):
+            raise API_Error("Every scenario must be an object.")
+        if 'country' not in scenario and 'date' not in scenario:
+            return scenario
+        try:
+            dates = elections[scenario['country']]
+            # The class of an elections.Lazy_Elections, without loading it here
+            election_class = dates.classes[scenario['date']] if hasattr(dates, 'classes') else type(dates[scenario['date']])
+        except KeyError:
+            raise API_Error("Election '{} {}' does not exist.".format(scenario.get('country'), scenario.get('date')))
+        return dict(scenario, election=election_class.__name__)
+
+    def get_body():
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            raise API_Error("The request body must be a JSON object.")
+        return body
+
+    def single_response(scenario):
+        result = next(run([scenario]))
+        return jsonify(result), 400 if 'error' in result else 200
+
+    @api.errorhandler(API_Error)
+    def handle_api_error(e):
+        return jsonify({'error': str(e)}), 400
+
+    @api.route('/', methods=['GET'])
+    def documentation():
+        return Response(__doc__.strip() + '\n', mimetype='text/plain')
+
+    @api.route('/elections', methods=['GET'])
+    def list_elections():
+        return jsonify({country: list(dates) for country, dates in elections.items()})
+
+    @api.route('/elections/<country>/<date>/apportion', methods=['POST'])
+    def apportion_stored_election(country, date):
+        return single_response(resolve(dict(get_body(), country=country, date=date)))
+
+    @api.route('/apportion', methods=['POST'])
+    def apportion_posted_votes():
+        body = get_body()
+        return single_response({k: body.get(k) for k in ['system', 'regions', 'by_region']})
+
+    @api.route('/batch', methods=['POST'])
+    def apportion_batch():
+        scenarios = get_body().get('scenarios')
+        if not isinstance(scenarios, list):
+            raise API_Error("'scenarios' must be a list.")
+        if len(scenarios) > MAX_SCENARIOS:
+            raise API_Error("At most {} scenarios can be sent per request.".format(MAX_SCENARIOS))
+
+        resolved = []
+        for scenario in scenarios:
+            try:
+                resolved.append(resolve(scenario))
+            except API_Error as e:
+                resolved.append({'error': str(e)})
+        if jobs is not None and len(resolved) > BATCH_JOB_SCENARIOS:
+            return jsonify({'id': jobs.submit('scenarios', {'scenarios': resolved})}), 202
+
+        def generate():
+            valid = [s for s in resolved if 'error' not in s]
+            results = run(valid)
+            # If the pool itself fails (e.g. a worker is killed), the rest of
+            # the scenarios get its error
+            failure = None
+            for i, scenario in enumerate(resolved):
+                if 'error' in scenario:
+                    result = scenario
+                elif failure is not None:
+                    result = failure
+                else:
+                    try:
+                        result = next(results)
+                    except Exception as e:
+                        result = failure = {'error': '{}: {}'.format(type(e).__name__, e)}
+                yield json.dumps(dict({'index': i}, **result)) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    if jobs is None:
+        return api
+
+    def get_job_status(job_id):
+        status = jobs.get_status(job_id)
+        if status is None:
+            raise API_Error("Job '{}' does not exist.".format(job_id))
+        return status
+
+    @api.route('/jobs', methods=['POST'])
+    def submit_job():
+        body = get_body()
+        params = body.get('params', {})
+        if not isinstance(params, dict):
+            raise API_Error("'params' must be an object.")
+        if body.get('kind') == 'ensemble' and 'election' not in params:
+            params = resolve(params)
+            params = {k: v for k, v in params.items() if k not in ['country', 'date']}
+        try:
+            job_id = jobs.submit(body.get('kind'), params)
+        except ValueError as e:
+            raise API_Error(str(e))
+        return jsonify({'id': job_id}), 202
+
+    @api.route('/jobs/<job_id>', methods=['GET', 'DELETE'])
+    def job_status(job_id):
+        get_job_status(job_id)
+        if request.method == 'DELETE':
+            jobs.cancel(job_id)
+        return jsonify(jobs.get_status(job_id))
+
+    @api.route('/jobs/<job_id>/result', methods=['GET'])
+    def job_result(job_id):
+        status = get_job_status(job_id)
+        if status['state'] != 'done':
+            return jsonify({'error': "Job '{}' is {}.".format(job_id, status['state'])}), 409
+        return jsonify(jobs.get_result(job_id))
+
+    @api.route('/jobs/<job_id>/files/<name>', methods=['GET'])
+    def job_file(job_id, name):
+        get_job_status(job_id)
+        path = jobs.get_file(job_id, name)
+        if path is None:
+            return jsonify({'error': "Job '{}' has no file '{}'.".format(job_id, name)}), 404
+        return send_file(path, as_attachment=True)
+
+    return api
@@ -0,0 +1,213 @@
+from collections import Counter
+import heapq
+import math
+import numpy as np
+import os
+import sys
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+import stv  # noqa: E402
+from telemetry import APPORTIONMENTS  # noqa: E402
+
+# Divisor of the next seat of a party or region that already holds s seats.
+# (See https://en.wikipedia.org/wiki/Highest_averages_method)
+DIVISORS = {
+    'Jefferson': lambda s: s + 1,  # Same as d'Hondt
+    'Webster': lambda s: 2*s + 1,  # Same as Sainte-Laguë
+    'Adams': lambda s: s,
+    'Dean': lambda s: s*(s+1) / (s+0.5),
+    'Huntington-Hill': lambda s: math.sqrt(s*(s+1)),
+}
+APPORTIONMENT_METHODS = list(DIVISORS) + ['Hamilton']
+
+
+def _priority(weight, divisor):
+    return weight / divisor if divisor else math.inf
+
+
+def divisor_method(weights, n_seats, divisor, min_seats=None):
+    """
+    Distribute n_seats proportionally to weights (a dictionary whose values are
+    the number of votes, or the census, of every party or region) using a
+    highest averages method with the given divisor function.
+    The next seat always goes to the key with the highest weight/divisor(s),
+    where s are its seats so far; ties are broken by the order of the keys.
+    If min_seats (a dictionary) is given, every key starts with its minimum
+    number of seats.
+
+    A priority queue is used, so that the cost is O(n_seats * log(len(weights))).
+    Return a collections.Counter with the number of seats of every key.
+    """
+    seats = Counter({k: (min_seats or {}).get(k, 0) for k in weights})
+    heap = [(-_priority(w, divisor(seats[k])), i, k) for i, (k, w) in enumerate(weights.items())]
+    heapq.heapify(heap)
+    for _ in range(n_seats - sum(seats.values())):
+        _, i, k = heapq.heappop(heap)
+        seats[k] += 1
+        heapq.heappush(heap, (-_priority(weights[k], divisor(seats[k])), i, k))
+    return seats
+
+
+def largest_remainder(weights, n_seats, min_seats=None):
+    """
+    Distribute n_seats proportionally to weights using the largest remainder
+    method with the Hare quota. If min_seats (a dictionary) is given, the
+    minimum seats are assigned first and the remaining seats are distributed
+    proportionally to the weights.
+    Return a collections.Counter with the number of seats of every key.
+    """
+    seats = Counter({k: (min_seats or {}).get(k, 0) for k in weights})
+    n_remaining_seats = n_seats - sum(seats.values())
+    total_weight = sum(weights.values())
+    if n_remaining_seats <= 0 or total_weight == 0:
+        return seats
+
+    quotas = {k: w * n_remaining_seats / total_weight for k, w in weights.items()}
+    for k, quota in quotas.items():
+        seats[k] += int(quota)
+    n_left = n_seats - sum(seats.values())
+    order = {k: i for i, k in enumerate(weights)}
+    for k in heapq.nlargest(n_left, weights, key=lambda k: (quotas[k] - int(quotas[k]), -order[k])):
+        seats[k] += 1
+    return seats
+
+
+def reapportion(census, n_seats, method='Huntington-Hill', min_seats=0):
+    """
+    Distribute the n_seats of a chamber among regions proportionally to their
+    census (a dictionary whose keys are region names and values are census).
+
+    method must be one of APPORTIONMENT_METHODS. min_seats can be an integer
+    (the same minimum for every region) or a dictionary with the minimum number
+    of seats of every region (e.g. 2 seats per province in Spain).
+    With the divisor methods, regions start with their minimum seats and keep
+    competing for the rest; with 'Hamilton', the minimum seats are assigned
+    first and the rest are distributed proportionally to the census.
+
+    Return a dictionary whose keys are region names and values are their
+    number of seats, which can be passed to Electoral_Region.compute_result.
+    """
+    if isinstance(min_seats, int):
+        min_seats = {k: min_seats for k in census}
+    if sum(min_seats.get(k, 0) for k in census) > n_seats:
+        raise ValueError("The minimum number of seats exceeds the number of seats of the chamber.")
+
+    if method == 'Hamilton':
+        seats = largest_remainder(census, n_seats, min_seats)
+    elif method in DIVISORS:
+        seats = divisor_method(census, n_seats, DIVISORS[method], min_seats)
+    else:
+        raise ValueError("Apportionment method must be one of {}".format(', '.join(APPORTIONMENT_METHODS)))
+
+    return {k: seats[k] for k in census}
+
+
+def apportion_matrix(votes, n_seats, system, valid_parties=None):
+    """
+    Vectorized version of regions.Electoral_Region.compute_election_result that
+    computes the seats of every party in every region at once.
+
+    votes is an array of shape (n_regions, n_parties), n_seats an array with
+    the number of seats of every region and system an electoral_systems.System.
+    If valid_parties is given (a boolean array of length n_parties), only those
+    parties are considered, as with a country-level threshold.
+    Return an integer array of shape (n_regions, n_parties) with the seats.
+    """
+    votes = np.asarray(votes)
+    n_seats = np.asarray(n_seats, dtype=np.int64)
+    n_regions, n_parties = votes.shape
+    APPORTIONMENTS.inc(system.name, amount=n_regions)
+    seats = np.zeros((n_regions, n_parties), dtype=np.int64)
+    total_votes = votes.sum(axis=1)
+    rows = np.arange(n_regions)
+
+    if system.name == 'Winner Takes All':
+        single = n_seats > 0
+    elif system.name == 'STV':
+        single = np.zeros(n_regions, dtype=bool)
+    else:
+        single = n_seats == 1
+    seats[rows[single], votes[single].argmax(axis=1)] = n_seats[single]
+    rest = (n_seats > 0) & ~single
+    if not rest.any():
+        return seats
+
+    def get_valid(threshold):
+        if threshold == 'n/2s':
+            vote_threshold = total_votes / (2*n_seats)
+        else:
+            vote_threshold = total_votes*int(threshold)/100
+        return votes > vote_threshold[:, None]
+
+    if valid_parties is not None and valid_parties.any():
+        valid = valid_parties[None, :] & (votes > 0)
+    else:
+        valid = get_valid(system.threshold)
+    # As in compute_election_result, regions without valid parties get no seats
+    rest &= valid.any(axis=1)
+
+    if system.name == 'STV':
+        # Ranked ballots can't be vectorized, so regions are counted one by one
+        for i in rows[rest]:
+            region_votes = dict(enumerate(votes[i].tolist()))
+            candidates = np.flatnonzero(valid[i]).tolist()
+            for j, s in stv.compute_stv_result(region_votes, int(n_seats[i]), candidates, system.transfer_model).items():
+                seats[i, j] = s
+    elif 'LRM' in system.name:
+        seats[rest] = _largest_remainder_matrix(votes[rest], n_seats[rest], total_votes[rest], valid[rest], system.name)
+        if 'Imperiali' in system.name or 'HB' in system.name:
+            overflow = rest.copy()
+            overflow[rest] = seats[rest].sum(axis=1) > n_seats[rest]
+            if overflow.any():
+                # As in compute_election_result, fall back to the Droop quota
+                # with the regional threshold.
+                droop_valid = get_valid(system.threshold)[overflow]
+                seats[overflow] = _largest_remainder_matrix(votes[overflow], n_seats[overflow], total_votes[overflow],
+                                                            droop_valid, 'LRM-Droop')
+    else:
+        divisor = DIVISORS['Jefferson'] if system.name == 'dHondt' else DIVISORS['Webster']
+        seats[rest] = _divisor_matrix(votes[rest], n_seats[rest], valid[rest], divisor)
+
+    return seats
+
+
+def _divisor_matrix(votes, n_seats, valid, divisor):
+    n_regions, n_parties = votes.shape
+    max_seats = int(n_seats.max())
+    divisors = np.array([divisor(s) for s in range(max_seats)], dtype=np.float64)
+    quotients = np.where(valid[:, :, None], votes[:, :, None] / divisors, -np.inf)
+    # Ties are broken by party order, as in the sequential method
+    order = np.argsort(-quotients.reshape(n_regions, -1), axis=1, kind='stable')[:, :max_seats]
+    # Rows without valid parties get no seats
+    selected = (np.arange(max_seats) < n_seats[:, None]) & valid.any(axis=1)[:, None]
+    parties = order // max_seats
+    regions = np.broadcast_to(np.arange(n_regions)[:, None], parties.shape)
+    seats = np.bincount((regions*n_parties + parties)[selected], minlength=n_regions*n_parties)
+    return seats.reshape(n_regions, n_parties)
+
+
+def _largest_remainder_matrix(votes, n_seats, total_votes, valid, system_name):
+    if 'Hare' in system_name:
+        seat_cost = total_votes / n_seats
+    elif 'Droop' in system_name:
+        seat_cost = 1 + total_votes / (1 + n_seats)
+    elif 'HB' in system_name:
+        seat_cost = total_votes / (1 + n_seats)
+    elif 'Imperiali' in system_name:
+        seat_cost = total_votes / (2 + n_seats)
+
+    remainders, seats = np.modf(votes / seat_cost[:, None])
+    seats = np.where(valid, seats, 0).astype(np.int64)
+
+    # Missing seats go round the valid parties by decreasing remainder
+    n_valid = valid.sum(axis=1)
+    missing = np.maximum(n_seats - seats.sum(axis=1), 0)
+    full_rounds = np.where(n_valid > 0, missing // np.maximum(n_valid, 1), 0)
+    extra = np.where(n_valid > 0, missing % np.maximum(n_valid, 1), 0)
+    order = np.argsort(np.where(valid, -remainders, np.inf), axis=1, kind='stable')
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(votes.shape[1])[None, :], axis=1)
+    seats += np.where(valid, full_rounds[:, None] + (rank < extra[:, None]), 0)
+    return seats
@@ -0,0 +1,197 @@
+"""
+Apportion a grid of elections, systems, levels and thresholds in parallel and
+write the seats of every party as a table, without starting the dashboard or
+building any figure. e.g.
+
+    python -m app.batch --elections Spain_2019_11 Spain_2015_12 --systems dHondt SL \
+        --levels 1 2 --thresholds 0 3 5 --processes 8 --output results.csv
+"""
+import argparse
+from collections import Counter
+import csv
+import inspect
+import itertools
+import multiprocessing
+import os
+import sys
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+import elections  # noqa: E402
+import electoral_systems  # noqa: E402
+from telemetry import count_cache  # noqa: E402
+
+COLUMNS = ['election', 'system', 'level', 'threshold', 'threshold_country', 'region', 'party', 'votes', 'seats']
+
+# Elections loaded by every worker process, so that each of them is only
+# parsed once per process
+_ELECTIONS = {}
+
+
+def get_election_names():
+    """
+    Return the names of all the elections.Election subclasses that represent
+    a particular election (e.g. 'Spain_2019_11'). Of the USA cycles, only
+    those whose data has been preprocessed (see elections.get_usa_years).
+    """
+    usa_names = {'USA_{}'.format(year) for year in elections.get_usa_years()}
+    return [
+        name for name, cls in inspect.getmembers(elections, inspect.isclass)
+        if issubclass(cls, elections.Election) and cls.__module__ == elections.__name__
+        and not inspect.signature(cls.__init__).parameters.keys() - {'self'}
+        and (not issubclass(cls, elections.USA_Election) or name in usa_names)
+    ]
+
+
+def get_election(name):
+    """
+    Return the election of the given class name (one of get_election_names),
+    loading it the first time. Raise ValueError if it doesn't exist.
+    """
+    count_cache('elections', name in _ELECTIONS)
+    if name not in _ELECTIONS:
+        if name not in get_election_names():
+            raise ValueError("Election '{}' does not exist.".format(name))
+        _ELECTIONS[name] = getattr(elections, name)()
+    return _ELECTIONS[name]
+
+
+def compute_rows(task):
+    """
+    Given a tuple (election name, system name, level, threshold,
+    threshold_country, by_region), return the list of table rows with the seats
+    (and votes) of every party, either in every region of the system level or
+    in the whole country. Parties without seats nor votes are omitted, and so
+    are the levels that the election doesn't have.
+    If the task fails, return {"error": message} instead, so that it never
+    stops the rest of a batch.
+    """
+    try:
+        return _compute_rows(*task)
+    except Exception as e:
+        return {'error': '{}: {}'.format(type(e).__name__, e)}
+
+
+def _compute_rows(election_name, system_name, level, threshold, threshold_country, by_region):
+    election = get_election(election_name)
+    if level not in election.regions:
+        return []
+    system = electoral_systems.System(system_name, level, threshold, threshold_country)
+    country_region = next(iter(election.regions[0].values()))
+    result = country_region.compute_result(system).result
+
+    if by_region:
+        region_seats = result.items()
+    else:
+        total_seats = Counter()
+        for seats in result.values():
+            total_seats.update(seats)
+        region_seats = [(country_region.name, total_seats)]
+
+    rows = []
+    for region_name, seats in region_seats:
+        votes = election.regions[level if by_region else 0][region_name].votes
+        for party in election.parties:
+            if seats.get(party, 0) or votes.get(party, 0):
+                rows.append([election_name, system_name, level, threshold, threshold_country, region_name, party,
+                             votes.get(party, 0), seats.get(party, 0)])
+    return rows
+
+
+def get_tasks(election_names, system_names, levels, thresholds, threshold_countries=(False,), by_region=False):
+    """
+    Return the list of tasks (see compute_rows) of the grid.
+    """
+    for election_name in election_names:
+        if election_name not in get_election_names():
+            raise ValueError("Election '{}' does not exist.".format(election_name))
+    grid = itertools.product(election_names, system_names, levels, thresholds, threshold_countries)
+    return [task + (by_region,) for task in grid]
+
+
+def run_batch(election_names, system_names, levels, thresholds, threshold_countries=(False,), by_region=False, processes=None,
+              progress=None, errors=None):
+    """
+    Apportion every combination of the given elections (class names, see
+    get_election_names), system names, levels, thresholds and threshold
+    scopes, using a pool of processes (all the CPUs by default; 1 to run in
+    the current process).
+    Yield the table rows (see COLUMNS) in the order of the grid.
+    If progress is given, it is called with the number of tasks of the grid
+    done so far and the total number of tasks.
+    The tasks that fail have no rows. If errors is given (a list), a tuple
+    (task, message) is appended to it for each of them.
+    """
+    tasks = get_tasks(election_names, system_names, levels, thresholds, threshold_countries, by_region)
+    if processes == 1:
+        results = map(compute_rows, tasks)
+        yield from _iter_rows(tasks, results, progress, errors)
+        return
+
+    # The grid is ordered by election, so chunks of consecutive tasks make
+    # every worker load as few elections as possible
+    with multiprocessing.Pool(processes) as pool:
+        chunksize = max(1, len(tasks) // (4 * (processes or os.cpu_count() or 1)))
+        yield from _iter_rows(tasks, pool.imap(compute_rows, tasks, chunksize=chunksize), progress, errors)
+
+
+def _iter_rows(tasks, results, progress=None, errors=None):
+    for i, (task, rows) in enumerate(zip(tasks, results)):
+        if isinstance(rows, dict):
+            if errors is not None:
+                errors.append((task, rows['error']))
+        else:
+            yield from rows
+        if progress:
+            progress(i + 1, len(tasks))
+
+
+def write_table(rows, file, delimiter=','):
+    """
+    Write the header (COLUMNS) and the given rows to a file object.
+    """
+    writer = csv.writer(file, delimiter=delimiter, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    writer.writerows(rows)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.batch', description=__doc__.split('e.g.')[0].strip())
+    parser.add_argument('--elections', nargs='+', default=['all'],
+                        help="Election class names, e.g. Spain_2019_11 (default: all)")
+    parser.add_argument('--systems', nargs='+', default=electoral_systems.SYSTEM_NAMES,
+                        choices=electoral_systems.SYSTEM_NAMES + list(electoral_systems.TWO_TIER_SYSTEMS) + [electoral_systems.BIPROPORTIONAL],
+                        metavar='SYSTEM', help="System names (default: {})".format(', '.join(electoral_systems.SYSTEM_NAMES)))
+    parser.add_argument('--levels', nargs='+', type=int, default=[0, 1, 2])
+    parser.add_argument('--thresholds', nargs='+', default=['3'], help="Thresholds in %% or 'n/2s'")
+    parser.add_argument('--threshold-country', choices=['no', 'yes', 'both'], default='no',
+                        help="Whether the thresholds apply at country level")
+    parser.add_argument('--by-region', action='store_true', help="Write the seats of every region instead of the totals")
+    parser.add_argument('--processes', type=int, default=None, help="Number of processes (default: all the CPUs)")
+    parser.add_argument('--output', default='-', help="Output file (default: standard output)")
+    parser.add_argument('--delimiter', default=',')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    election_names = get_election_names() if args.elections == ['all'] else args.elections
+    threshold_countries = {'no': (False,), 'yes': (True,), 'both': (False, True)}[args.threshold_country]
+    errors = []
+    rows = run_batch(election_names, args.systems, args.levels, args.thresholds, threshold_countries,
+                     args.by_region, args.processes, errors=errors)
+
+    if args.output == '-':
+        write_table(rows, sys.stdout, args.delimiter)
+    else:
+        with open(args.output, 'w', newline='') as f:
+            write_table(rows, f, args.delimiter)
+    for task, message in errors:
+        print('Failed {}: {}'.format(' '.join(map(str, task[:5])), message), file=sys.stderr)
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+"""
+Benchmarks of the apportionment engine, the figures of the dashboard, the
+loading of the elections and the startup of the app. The timings are saved as
+JSON, so that runs on different commits can be compared. e.g.
+
+    python -m app.benchmark run --output base.json
+    git checkout my-branch
+    python -m app.benchmark run --output new.json
+    python -m app.benchmark compare base.json new.json --tolerance 0.1
+
+compare exits with status 1 if any benchmark got slower than the tolerance.
+"""
+import argparse
+import datetime
+import fnmatch
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+import batch  # noqa: E402
+import elections  # noqa: E402
+import electoral_systems  # noqa: E402
+
+ELECTION_NAMES = ['Spain_2019_11', 'Costa_Rica_2018']
+STATISTICS = ['min', 'mean', 'p50', 'p95', 'max']
+
+# Keys are benchmark names, values are functions that prepare a benchmark and
+# return the function to time (without arguments)
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    Decorator that adds a benchmark to BENCHMARKS.
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def _get_country_region(election_name):
+    election = batch.get_election(election_name)
+    return next(iter(election.regions[0].values()))
+
+
+def _add_apportionment_benchmarks():
+    for level in [1, 2]:
+        for system_name in electoral_systems.SYSTEM_NAMES:
+            @benchmark('compute_election_result/{}-{}'.format(system_name, level))
+            def setup_election_result(system_name=system_name, level=level):
+                election = batch.get_election('Spain_2019_11')
+                system = electoral_systems.System(system_name, level, '3')
+                regions = list(election.regions[level].values())
+                return lambda: [region.compute_election_result(system) for region in regions]
+
+    for election_name in ELECTION_NAMES:
+        for system_name in ['dHondt', 'STV', 'MMP', electoral_systems.BIPROPORTIONAL]:
+            @benchmark('compute_result/{}-{}'.format(election_name, system_name))
+            def setup_result(election_name=election_name, system_name=system_name):
+                country_region = _get_country_region(election_name)
+                system = electoral_systems.System(system_name, max(batch.get_election(election_name).regions), '3')
+                return lambda: country_region.compute_result(system)
+
+
+def _add_figure_benchmarks():
+    def setup_results():
+        country_region = _get_country_region('Spain_2019_11')
+        return (country_region.compute_result(electoral_systems.System('dHondt', 2, '3')),
+                country_region.compute_result(electoral_systems.System('SL', 1, '3')))
+
+    @benchmark('get_map_plot')
+    def setup_map_plot():
+        result, other = setup_results()
+        return lambda: (result.get_map_plot(), result.get_map_plot(other))
+
+    @benchmark('get_piechart_plot')
+    def setup_piechart_plot():
+        result, other = setup_results()
+        return lambda: (result.get_piechart_plot(), result.get_piechart_plot(other))
+
+    @benchmark('get_bar_plot')
+    def setup_bar_plot():
+        result, other = setup_results()
+        return lambda: (result.get_bar_plot('Lost Votes'), result.get_bar_plot('Seat Difference', other))
+
+    @benchmark('plot_tooltip')
+    def setup_tooltip():
+        election = batch.get_election('Spain_2019_11')
+        region = election.regions[1]['Andalucía']
+        system, other_system = electoral_systems.System('dHondt', 2, '3'), electoral_systems.System('SL', 2, '3')
+        return lambda: region.compute_result(system).plot_tooltip(region.compute_result(other_system))
+
+
+def _add_loading_benchmarks():
+    for election_name in ['Spain_2019_11', 'USA_2020']:
+        @benchmark('Election/{}'.format(election_name))
+        def setup_election(election_name=election_name):
+            return getattr(elections, election_name)
+
+    @benchmark('import main')
+    def setup_import_main():
+        # In a new interpreter, as importing main loads all the elections
+        command = [sys.executable, '-c', 'import main']
+
+        def run():
+            process = subprocess.run(command, cwd=myPath, capture_output=True, text=True)
+            if process.returncode:
+                raise RuntimeError(process.stderr.strip().splitlines()[-1])
+        return run
+
+
+_add_apportionment_benchmarks()
+_add_figure_benchmarks()
+_add_loading_benchmarks()
+
+
+def time_benchmark(name, repeat=20, warmup=1, max_time=30):
+    """
+    Run a benchmark of BENCHMARKS warmup + repeat times (or until it has run
+    for max_time seconds) and return a dictionary with the list of durations in
+    seconds ('samples') and their STATISTICS, or with the 'error' it raised.
+    """
+    try:
+        function = BENCHMARKS[name]()
+        for _ in range(warmup):
+            function()
+        samples = []
+        start = time.perf_counter()
+        while len(samples) < repeat and (not samples or time.perf_counter() - start < max_time):
+            t = time.perf_counter()
+            function()
+            samples.append(time.perf_counter() - t)
+    except Exception as e:
+        return {'error': '{}: {}'.format(type(e).__name__, e)}
+
+    samples_array = np.array(samples)
+    return dict({
+        'min': samples_array.min(),
+        'mean': samples_array.mean(),
+        'p50': np.percentile(samples_array, 50),
+        'p95': np.percentile(samples_array, 95),
+        'max': samples_array.max(),
+    }, samples=samples)
+
+
+def get_metadata():
+    """
+    Return the commit, the date and the versions of the environment of a run.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=myPath, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+    }
+
+
+def run_benchmarks(patterns=('*',), repeat=20, warmup=1, max_time=30, log=None):
+    """
+    Run the benchmarks whose names match any of the given glob patterns and
+    return a dictionary with the 'metadata' of the run and the 'benchmarks'
+    (keys are names, values are the results of time_benchmark).
+    If log is a file object, a line is written to it after every benchmark.
+    """
+    names = [name for name in BENCHMARKS if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)]
+    results = {}
+    for name in names:
+        results[name] = time_benchmark(name, repeat, warmup, max_time)
+        if log:
+            print(format_result(name, results[name]), file=log, flush=True)
+    return {'metadata': get_metadata(), 'benchmarks': results}
+
+
+def format_result(name, result):
+    if 'error' in result:
+        return '{:<45} {}'.format(name, result['error'])
+    return '{:<45} '.format(name) + '  '.join('{} {:9.2f} ms'.format(s, 1000*result[s]) for s in ['p50', 'p95'])
+
+
+def compare_runs(base, new, statistic='p95', tolerance=0.1):
+    """
+    Compare two runs (see run_benchmarks) and return a list of tuples
+    (benchmark name, base time, new time, ratio, status) for the benchmarks of
+    both runs, where status is 'regression' if the statistic of the new run is
+    more than tolerance (relative) slower, 'improvement' if it is that much
+    faster, 'error' if either of them failed, and 'ok' otherwise.
+    """
+    rows = []
+    for name, new_result in new['benchmarks'].items():
+        if name not in base['benchmarks']:
+            continue
+        base_result = base['benchmarks'][name]
+        if 'error' in base_result or 'error' in new_result:
+            rows.append((name, base_result.get(statistic), new_result.get(statistic), None, 'error'))
+            continue
+        ratio = new_result[statistic] / base_result[statistic]
+        if ratio > 1 + tolerance:
+            status = 'regression'
+        elif ratio < 1 / (1 + tolerance):
+            status = 'improvement'
+        else:
+            status = 'ok'
+        rows.append((name, base_result[statistic], new_result[statistic], ratio, status))
+    return rows
+
+
+def format_report(rows, base, new, statistic='p95'):
+    """
+    Return the text of the report of compare_runs.
+    """
+    lines = [
+        'Base: {commit} ({date})'.format(**base['metadata']),
+        'New:  {commit} ({date})'.format(**new['metadata']),
+        '',
+        '{:<45} {:>12} {:>12} {:>8}  {}'.format('Benchmark', 'Base ' + statistic, 'New ' + statistic, 'Ratio', 'Status'),
+    ]
+    for name, base_time, new_time, ratio, status in rows:
+        times = ['{:9.2f} ms'.format(1000*t) if t is not None else '-' for t in [base_time, new_time]]
+        lines.append('{:<45} {:>12} {:>12} {:>8}  {}'.format(name, *times, '{:.2f}x'.format(ratio) if ratio else '-', status))
+    n_regressions = sum(row[-1] == 'regression' for row in rows)
+    lines.extend(['', '{} regression(s), {} improvement(s) out of {} benchmarks.'.format(
+        n_regressions, sum(row[-1] == 'improvement' for row in rows), len(rows))])
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.benchmark', description=__doc__.split('e.g.')[0].strip())
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Run the benchmarks and save the timings as JSON")
+    run_parser.add_argument('patterns', nargs='*', default=['*'], help="Glob patterns of the benchmarks to run (default: all)")
+    run_parser.add_argument('--repeat', type=int, default=20, help="Number of timed runs of every benchmark")
+    run_parser.add_argument('--warmup', type=int, default=1, help="Number of untimed runs before timing")
+    run_parser.add_argument('--max-time', type=float, default=30, help="Maximum seconds spent timing every benchmark")
+    run_parser.add_argument('--output', default=None, help="JSON file of the results (default: standard output)")
+    run_parser.add_argument('--list', action='store_true', help="Only list the names of the benchmarks")
+
+    compare_parser = subparsers.add_parser('compare', help="Compare two JSON files of results")
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--statistic', choices=STATISTICS, default='p95')
+    compare_parser.add_argument('--tolerance', type=float, default=0.1, help="Relative slowdown considered a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'run':
+        if args.list:
+            print('\n'.join(BENCHMARKS))
+            return 0
+        results = run_benchmarks(args.patterns, args.repeat, args.warmup, args.max_time, log=sys.stderr)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        else:
+            json.dump(results, sys.stdout, indent=2)
+        return 0
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    rows = compare_runs(base, new, args.statistic, args.tolerance)
+    print(format_report(rows, base, new, args.statistic))
+    return int(any(row[-1] == 'regression' for row in rows))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
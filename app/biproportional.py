@@ -0,0 +1,165 @@
+import numpy as np
+import os
+import sys
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+import apportionment  # noqa: E402
+from apportionment import _divisor_matrix  # noqa: E402
+
+# Both the party totals and the seats of every region are computed with the
+# Sainte-Laguë (Webster) method, i.e. with standard rounding.
+DIVISOR = apportionment.DIVISORS['Webster']
+
+
+def _get_multipliers(weights, seats):
+    """
+    For every row, return a multiplier a such that rounding a * weights gives
+    the given seats (the middle of the interval of valid multipliers).
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        low = np.where(seats > 0, (seats - 0.5) / weights, 0).max(axis=1)
+        high = np.where(weights > 0, (seats + 0.5) / weights, np.inf).min(axis=1)
+    return np.where(np.isfinite(high), (low + high) / 2, 1)
+
+
+def _apportion_rows(weights, n_seats):
+    seats = _divisor_matrix(weights, n_seats, weights > 0, DIVISOR)
+    return seats, _get_multipliers(weights, seats)
+
+
+def biproportional_apportionment(votes, region_seats, party_seats, max_iterations=1000):
+    """
+    Biproportional apportionment of the seats of a regions x parties vote
+    matrix, with the alternating scaling algorithm of Balinski and Pukelsheim.
+    (See https://en.wikipedia.org/wiki/Biproportional_apportionment)
+
+    Every region gets region_seats[i] seats and every party party_seats[j]
+    seats. The votes are alternately scaled by a multiplier per region, so that
+    the seats of every region are right, and by a multiplier per party, so that
+    the totals of every party are right, until both hold at the same time.
+    Every step apportions all the regions (or parties) at once.
+
+    Return the integer array of seats and the list with the number of
+    misallocated seats after every iteration, which decreases as the algorithm
+    converges.
+    """
+    weights = np.asarray(votes, dtype=np.float64)
+    region_seats = np.asarray(region_seats, dtype=np.int64)
+    party_seats = np.asarray(party_seats, dtype=np.int64)
+    if region_seats.sum() != party_seats.sum():
+        raise ValueError("The regions and the parties must have the same total number of seats.")
+    if ((weights > 0).sum(axis=1) == 0)[region_seats > 0].any() or ((weights > 0).sum(axis=0) == 0)[party_seats > 0].any():
+        raise ValueError("Every region and party with seats must have votes.")
+
+    # Start with the multipliers of the party totals
+    party_votes = weights.sum(axis=0)
+    weights *= np.divide(party_seats, party_votes, out=np.zeros_like(party_votes), where=party_votes > 0)
+
+    flaws = []
+    for _ in range(max_iterations):
+        seats, multipliers = _apportion_rows(weights, region_seats)
+        weights *= multipliers[:, None]
+        flaw = int(np.abs(seats.sum(axis=0) - party_seats).sum())
+        flaws.append(flaw)
+        if flaw == 0:
+            return seats, flaws
+
+        seats, multipliers = _apportion_rows(weights.T, party_seats)
+        seats = seats.T
+        weights *= multipliers[None, :]
+        flaw = int(np.abs(seats.sum(axis=1) - region_seats).sum())
+        flaws.append(flaw)
+        if flaw == 0:
+            return seats, flaws
+
+    raise ValueError("The biproportional apportionment didn't converge after {} iterations "
+                     "({} seats misallocated).".format(max_iterations, flaws[-1]))
+
+
+def get_valid_parties(votes, n_seats, threshold):
+    """
+    Return the boolean array of the parties (columns of votes) that reach the
+    threshold in at least one region, as in Zürich.
+    """
+    total_votes = votes.sum(axis=1)
+    if threshold == 'n/2s':
+        vote_threshold = total_votes / (2*np.maximum(n_seats, 1))
+    else:
+        vote_threshold = total_votes*int(threshold)/100
+    return (votes > vote_threshold[:, None]).any(axis=0)
+
+
+def compute_seat_matrix(election, system, n_seats=None, valid_parties=None, with_flaws=False):
+    """
+    Given an elections.Election and an electoral_systems.System, return the
+    integer array of shape (n_regions, n_parties) with the biproportional seats
+    of every party in every region of level system.level, in the order of
+    election.get_vote_matrix(system.level).
+
+    The party totals are apportioned with the Sainte-Laguë method in every
+    region of level system.compensatory_level, among the parties that reach the
+    threshold in at least one of its regions (or in the country if
+    valid_parties, a boolean array, is given). Like in
+    regions.Electoral_Region.compute_election_result, the regions where no
+    valid party has votes get no seats.
+    If n_seats is given (an array), it overrides the seats of the regions.
+    If with_flaws is True, also return a dictionary whose keys are the names
+    of the regions of system.compensatory_level and values are the flaws of
+    their apportionment (see biproportional_apportionment).
+    """
+    if system.compensatory_level > system.level:
+        raise ValueError("The compensatory level can't be higher than the system level.")
+    vote_matrix = election.get_vote_matrix(system.level)
+    votes = vote_matrix.votes
+    n_seats = vote_matrix.n_seats if n_seats is None else np.asarray(n_seats, dtype=np.int64)
+    parent_index = election.get_parent_index(system.level, system.compensatory_level)
+
+    seats = np.zeros(votes.shape, dtype=np.int64)
+    flaws = {}
+    for p, parent_name in enumerate(election.regions[system.compensatory_level]):
+        group = parent_index == p
+        group_votes = votes[group]
+        if valid_parties is not None and valid_parties.any():
+            valid = valid_parties & (group_votes.sum(axis=0) > 0)
+        else:
+            valid = get_valid_parties(group_votes, n_seats[group], system.threshold)
+        group_votes = np.where(valid, group_votes, 0)
+        group_seats = np.where(group_votes.sum(axis=1) > 0, n_seats[group], 0)
+        if group_seats.sum() == 0:
+            flaws[parent_name] = []
+            continue
+
+        party_seats = _divisor_matrix(group_votes.sum(axis=0)[None, :], group_seats.sum()[None],
+                                      valid[None, :], DIVISOR)[0]
+        seats[group], flaws[parent_name] = biproportional_apportionment(group_votes, group_seats, party_seats)
+    if with_flaws:
+        return seats, flaws
+    return seats
+
+
+def compute_biproportional_result(region, system, n_seats=None, valid_parties=None):
+    """
+    Given an Electoral_Region and an electoral_systems.System, return a
+    dictionary whose keys are the names of the regions of level system.level
+    within the region and values are collections.Counter objects with the
+    biproportional seats of every party.
+    If n_seats is given (a dictionary whose keys are region names and values
+    are their number of seats), it overrides the number of seats.
+    valid_parties is the list of parties above a country-level threshold.
+    """
+    election = region.election
+    vote_matrix = election.get_vote_matrix(system.level)
+    if n_seats is not None:
+        n_seats = [n_seats[name] for name in vote_matrix.region_names]
+    if valid_parties is not None:
+        valid_parties = set(valid_parties)
+        valid_parties = np.array([p in valid_parties for p in vote_matrix.parties])
+
+    seats = compute_seat_matrix(election, system, n_seats, valid_parties)
+    result = {}
+    for subregion in region.get_subregions(system.level):
+        i = vote_matrix.region_index[subregion.name]
+        result[subregion.name] = {p: int(s) for p, s in zip(vote_matrix.parties, seats[i]) if s}
+    return result
@@ -0,0 +1,192 @@
+import numpy as np
+import os
+import plotly.graph_objects as go
+import sys
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+import apportionment  # noqa: E402
+import biproportional  # noqa: E402
+from electoral_systems import BIPROPORTIONAL, TWO_TIER_SYSTEMS  # noqa: E402
+from telemetry import timed  # noqa: E402
+
+
+def compute_seat_matrix(election, system):
+    """
+    Given an elections.Election and an electoral_systems.System, return an
+    integer array of shape (n_regions, n_parties) with the seats of every
+    party in every region of level system.level, in the order of
+    election.get_vote_matrix(system.level).
+    Two-tier systems are computed on the region tree and then arranged into
+    the matrix.
+    """
+    vote_matrix = election.get_vote_matrix(system.level)
+    valid_parties = None
+    if system.threshold_country:
+        valid_parties = set(election.get_valid_parties(system.threshold))
+        valid_parties = np.array([p in valid_parties for p in vote_matrix.parties])
+
+    if system.name == BIPROPORTIONAL:
+        return biproportional.compute_seat_matrix(election, system, valid_parties=valid_parties)
+    if system.name in TWO_TIER_SYSTEMS:
+        country_region = next(iter(election.regions[0].values()))
+        result = country_region.compute_result(system).result
+        seats = np.zeros(vote_matrix.votes.shape, dtype=np.int64)
+        party_index = {p: j for j, p in enumerate(vote_matrix.parties)}
+        for i, region_name in enumerate(vote_matrix.region_names):
+            for p, s in result[region_name].items():
+                seats[i, party_index[p]] = s
+        return seats
+
+    return apportionment.apportion_matrix(vote_matrix.votes, vote_matrix.n_seats, system, valid_parties)
+
+
+class Comparison_Matrix():
+    """
+    Class containing the pairwise seat differences between K electoral systems
+    applied to the same election.
+
+    The seat difference between systems a and b in a region is the number of
+    seats that change hands, i.e. the sum over parties of max(seats_a - seats_b, 0),
+    the same quantity shown by regions.Election_Result.get_seat_diff.
+
+    ...
+    Attributes
+    ----------
+    election: elections.Election
+        The election the systems are applied to.
+    systems: list
+        The electoral_systems.System objects being compared.
+    labels: list
+        The names used for every system in the plots.
+    level: int
+        The level of the regions at which the regional differences are computed.
+    region_names: list
+        The names of the regions of the given level.
+    seats: numpy.ndarray
+        Array of shape (K, n_regions, n_parties) with the seats of every system,
+        aggregated to the given level.
+    regional: numpy.ndarray
+        Array of shape (K, K, n_regions) with the seat differences between every
+        pair of systems in every region.
+    national: numpy.ndarray
+        Array of shape (K, K) with the seat differences between every pair of
+        systems at country level.
+
+    Methods
+    -------
+    get_heatmap_plot(region_name=None): plotly.graph_objects.Figure
+        Get the heatmap of the seat differences, either national or in a region.
+    plot_tooltip(region_name): plotly.graph_objects.Figure
+        Get the tooltip to show when hovering on a region of the map.
+    get_tooltip_data(): dict
+        Get the data of the tooltips of all the regions of the map.
+    get_map_plot(): plotly.graph_objects.Figure
+        Get the choropleth map with the largest seat difference between any two
+        systems in every region.
+    """
+    @timed('aggregation')
+    def __init__(self, election, systems, labels=None, level=None):
+        """
+        Parameters
+        ----------
+        election: elections.Election
+            The election the systems are applied to.
+        systems: list
+            The electoral_systems.System objects being compared.
+        labels: list
+            The names used for every system in the plots. If not specified, the
+            system names are used.
+        level: int
+            The level of the regions at which the regional differences are
+            computed. It can't be higher than the level of any system; if not
+            specified, the lowest system level is used.
+        """
+        if level is None:
+            level = min(s.level for s in systems)
+        if any(s.level < level for s in systems):
+            raise ValueError("The comparison level can't be higher than the level of the systems.")
+
+        self.election = election
+        self.systems = systems
+        self.labels = labels or [s.name for s in systems]
+        self.level = level
+        self.region_names = election.get_vote_matrix(level).region_names
+
+        # All the systems are apportioned over the vote matrices of their level,
+        # which are shared, and then aggregated to the comparison level.
+        self.seats = np.stack([election.aggregate_rows(compute_seat_matrix(election, s), s.level, level) for s in systems])
+        self.regional = np.maximum(self.seats[:, None] - self.seats[None, :], 0).sum(axis=-1)
+        national_seats = self.seats.sum(axis=1)
+        self.national = np.maximum(national_seats[:, None] - national_seats[None, :], 0).sum(axis=-1)
+
+    @timed('figures')
+    def get_heatmap_plot(self, region_name=None):
+        """
+        Get a figure with the heatmap of the seat differences between every pair
+        of systems, at country level or in the given region of self.level.
+        """
+        if region_name is None:
+            z = self.national
+            title = 'Seat Difference between Systems'
+        else:
+            z = self.regional[:, :, self.region_names.index(region_name)]
+            title = region_name
+
+        fig = go.Figure(data=[go.Heatmap(
+            z=z.tolist(),
+            x=self.labels,
+            y=self.labels,
+            colorscale='Reds',
+            zmin=0,
+            hovertemplate="%{y} vs %{x}: %{z} seats<extra></extra>",
+        )])
+        fig.update_layout(
+            title=title,
+            font={'size': 16},
+            margin=dict(t=40, b=20, l=0, r=0),
+            yaxis={'autorange': 'reversed'},
+        )
+        return fig
+
+    @timed('figures')
+    def plot_tooltip(self, region_name):
+        """
+        Get the tooltip with the heatmap of the seat differences in the given
+        region, to show when hovering on the map.
+        """
+        tooltip = self.get_heatmap_plot(region_name)
+        tooltip.update_traces(showscale=False)
+        tooltip.update_layout(
+            margin=dict(t=40, b=10, l=0, r=0),
+            width=300,
+            height=300,
+            font={'size': 10},
+        )
+        return tooltip
+
+    @timed('aggregation')
+    def get_tooltip_data(self):
+        """
+        Get the data of the tooltips of all the regions of self.level (see
+        tooltips.get_tooltip_data), rendered by tooltips.plot_tooltip as
+        plot_tooltip does: a dictionary whose keys are the region names and
+        values are dictionaries with their 'title', the 'labels' of the
+        systems and the 'seat_differences' between every pair of systems.
+        """
+        return {
+            name: {'title': name, 'labels': self.labels, 'seat_differences': self.regional[:, :, i].tolist()}
+            for i, name in enumerate(self.region_names)
+        }
+
+    @timed('figures')
+    def get_map_plot(self):
+        """
+        Get a figure (a dictionary, see elections.Election.get_map) with the
+        choropleth map showing, for every region, the largest seat difference
+        between any two systems.
+        """
+        max_seat_diff = self.regional.max(axis=(0, 1)).tolist()
+        return self.election.get_map(self.level, max_seat_diff, 'Largest Seat Difference between Systems per Region',
+                                     zmax=max(10, max(max_seat_diff)))
@@ -1,5 +1,8 @@
+from collections import defaultdict
 import geojson
+import math
 import os
+from urllib.parse import quote
 
 COUNTRY_LIST = [
     'Costa Rica',
@@ -7,6 +10,10 @@ COUNTRY_LIST = [
     'USA',
 ]
 
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# URL of the geojson files of the countries, served by install
+GEOJSON_URL = '/geojson/{country}/level_{level}.geojson'
+
 
 class Country():
     """
@@ -33,9 +40,15 @@ class Country():
     get_regions(level): List
         Return the geojson string containing all the region boundaries at a
         given level.
+    get_geojson_url(level): str
+        Return the URL of the geojson file of a level (see install).
+    get_adjacency(level): dict
+        Return a dictionary whose keys are the region names of a given level and
+        values are the sets of names of their neighbouring regions.
     """
     def __init__(self, name: str):
         self.name = name
+        self._adjacency = {}
         return
 
     @property
@@ -99,6 +112,72 @@ class Country():
         """
         return self._regions[level]
 
+    def get_geojson_url(self, level):
+        """
+        Return the URL at which install serves the geojson file of the regions
+        of a given level, so that the maps can load it instead of embedding it.
+        """
+        return GEOJSON_URL.format(country=quote(self.name), level=level)
+
+    def get_adjacency(self, level):
+        """
+        Return a dictionary whose keys are the region names of a given level and
+        values are the sets of names of their neighbouring regions.
+        Two regions are neighbours if their boundaries share a vertex.
+        Regions that can't be reached by land (e.g. islands) are linked to the
+        closest region (by centroid) so that the resulting graph is connected.
+        The adjacency is computed once per level and cached.
+        """
+        if level in self._adjacency:
+            return self._adjacency[level]
+
+        vertex_regions = defaultdict(set)
+        centroids = {}
+        for feature in self.get_geojson(level)['features']:
+            geometry = feature['geometry']
+            if geometry['type'] == 'Polygon':
+                polygons = [geometry['coordinates']]
+            else:
+                polygons = geometry['coordinates']
+            points = [point for polygon in polygons for ring in polygon for point in ring]
+            for lon, lat in points:
+                vertex_regions[(round(lon, 6), round(lat, 6))].add(feature['id'])
+            centroids[feature['id']] = (sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points))
+
+        adjacency = {region_name: set() for region_name in centroids}
+        for region_names in vertex_regions.values():
+            for region_name in region_names:
+                adjacency[region_name] |= region_names - {region_name}
+
+        def get_components():
+            components, visited = [], set()
+            for region_name in adjacency:
+                if region_name in visited:
+                    continue
+                component, stack = set(), [region_name]
+                while stack:
+                    r = stack.pop()
+                    if r not in component:
+                        component.add(r)
+                        stack.extend(adjacency[r] - component)
+                visited |= component
+                components.append(component)
+            return components
+
+        components = get_components()
+        while len(components) > 1:
+            component = min(components, key=len)
+            a, b = min(
+                ((a, b) for a in component for b in adjacency if b not in component),
+                key=lambda x: math.dist(centroids[x[0]], centroids[x[1]]),
+            )
+            adjacency[a].add(b)
+            adjacency[b].add(a)
+            components = get_components()
+
+        self._adjacency[level] = adjacency
+        return adjacency
+
 
 class Costa_Rica(Country):
     """
@@ -161,3 +240,20 @@ class USA(Country):
             1: level_1,
             2: level_2,
         }
+
+
+def install(server):
+    """
+    Serve the geojson files of the countries of COUNTRY_LIST at GEOJSON_URL
+    of the Flask server, straight from the data directory. The files are
+    read from the page cache of the operating system, which is shared by all
+    the worker processes.
+    """
+    from flask import abort, send_from_directory
+
+    @server.route(GEOJSON_URL.format(country='<country>', level='<int:level>'))
+    def geojson_file(country, level):
+        if country not in COUNTRY_LIST:
+            abort(404)
+        return send_from_directory(os.path.join(DATA_DIR, country), 'level_{}.geojson'.format(level),
+                                   mimetype='application/geo+json')
@@ -1,14 +1,33 @@
+from collections import OrderedDict
+from collections.abc import Mapping
+import numpy as np
 import os
 import pickle
 import plotly.graph_objects as go
 import sys
+import threading
+from types import MappingProxyType
 
 myPath = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, myPath)
 
+import apportionment  # noqa: E402
 import countries  # noqa: E402
-from regions import Electoral_Region  # noqa: E402
+from regions import Electoral_Region, Sparse_Electoral_Region, get_map_layout, iter_subregions  # noqa: E402
 import electoral_systems  # noqa: E402
+from matrices import Sparse_Vote_Matrix, Vote_Matrix  # noqa: E402
+from telemetry import count_cache  # noqa: E402
+
+# Whether the maps load the geojson files served by countries.install instead
+# of embedding the geojson in every figure (see Election.maps). Serializing the
+# embedded geojson in every response touches millions of objects, which with a
+# preloaded app (see gunicorn_config.py) copies them into every worker.
+MAP_GEOJSON_URLS = os.environ.get('MAP_GEOJSON_URLS', '') == '1'
+
+# Maximum number of entries (regions x parties) of the dense vote matrix of a
+# level added with Election.add_sparse_level (10 million, i.e. 80 MB). Larger
+# levels can only be used through their sparse matrix.
+MAX_DENSE_CELLS = int(os.environ.get('MAX_DENSE_VOTE_CELLS', 10**7))
 
 
 class Election():
@@ -35,6 +54,10 @@ class Election():
     electoral_system: electoral_systems.System
         An object of the class electoral_systems.System containing the
         information about the system used on the election.
+    maps: dict
+        Keys are region levels, values are the read-only templates of the
+        choropleth maps of the regions of that level, built the first time they
+        are accessed.
 
     Methods
     -------
@@ -44,24 +67,106 @@ class Election():
     get_regions(level): dict
         Given a region level, return a dict containing all the Electoral_Regions.region
         objects corresponding to that level. Keys of the dictionary are region names.
+    warm_up()
+        Build the caches and figure templates that are built on first use.
+    get_map(level, z, title, zmax=1): dict
+        Return a new figure of the choropleth map of a level with the given
+        values, built from its template in maps.
     get_valid_parties(threshold): list
         For a particular election, given a national-level threshold, return
         a list of parties that have a number of votes above that threshold.
+    get_vote_matrix(level): matrices.Vote_Matrix
+        Given a region level, return the regions x parties Vote_Matrix of all
+        the regions at that level.
+    get_sparse_vote_matrix(level): matrices.Sparse_Vote_Matrix
+        Given a region level, return the sparse regions x parties matrix of all
+        the regions at that level.
+    get_parent_index(level, parent_level): numpy.ndarray
+        Return the index of the region of a lower level that contains every
+        region of a level.
+    aggregate_rows(values, level, parent_level): numpy.ndarray
+        Given an array whose rows are the regions of a level, sum the rows of
+        the regions of every region of a lower level.
+    get_level_membership(level, parent_level): numpy.ndarray
+        Return the membership matrix of the regions of a level in the regions
+        of a lower level.
+    add_sparse_level(vote_matrix, parent_names, update_parents=False): int
+        Add a level of small regions (e.g. municipalities) stored in a sparse
+        matrix below the highest level of the election.
+    reapportion(level, n_seats, method='Huntington-Hill', min_seats=0): dict
+        Distribute n_seats among the regions of a level proportionally to their
+        census.
     """
     def __init__(self, country: countries.Country, date: str = None):
         self.date = date
         self.country = country
-        self.maps = {}
-        for level in range(len(self.regions)):
-            self.maps[level] = go.Figure(go.Choroplethmapbox(
-                geojson=self.country.get_geojson(level),
-                locations=[x for x in self.regions[level]],
-                z=[0] * len(self.regions[level]),
-                colorscale="Reds",
-                zmin=0, zmax=1,
-                marker_line_width=1,
-                hoverinfo='none',
-            ))
+        self._vote_matrices = {}
+        self._sparse_vote_matrices = {}
+        self._parent_indices = {}
+        self._maps = None
+
+    @property
+    def maps(self):
+        """
+        A dictionary whose keys are region levels and values are the templates
+        of the choropleth maps of the regions of every level: read-only
+        mappings {'data': (trace,), 'layout': layout} of plain values, whose
+        trace has the geojson of the country (or its URL, if MAP_GEOJSON_URLS),
+        the locations and the style of the map, but no values (see get_map).
+        The templates are shared by all the requests and threads, so they must
+        never be modified. They are only built the first time they are needed,
+        so that elections can be used without building any figure (e.g. in
+        batch jobs).
+        """
+        count_cache('maps', self._maps is not None)
+        if self._maps is None:
+            # Built in a local dictionary, so that other threads never see it half built
+            maps = {}
+            # The colorscale is resolved by plotly without building a figure with the geojson
+            colorscale = go.Choroplethmapbox(colorscale='Reds').colorscale
+            layout = MappingProxyType(get_map_layout(self.country))
+            for level in range(len(self.country.regions)):
+                trace = MappingProxyType({
+                    'type': 'choroplethmapbox',
+                    'geojson': self.country.get_geojson_url(level) if MAP_GEOJSON_URLS else self.country.get_geojson(level),
+                    'locations': tuple(self.regions[level]),
+                    'colorscale': colorscale,
+                    'marker': {'line': {'width': 1}},
+                    'hoverinfo': 'none',
+                })
+                maps[level] = MappingProxyType({'data': (trace,), 'layout': layout})
+            self._maps = maps
+        return self._maps
+
+    def warm_up(self):
+        """
+        Build the map templates, the vote matrices of the levels of regions
+        with dictionaries of votes and the parent indices between levels,
+        which are otherwise built the first time they are needed. Building them
+        before forking the workers of a preloaded app (see gunicorn_config.py)
+        lets all of them share the same copy.
+        """
+        self.maps
+        for level in self.regions:
+            if level not in self._sparse_vote_matrices:
+                self.get_vote_matrix(level)
+            for parent_level in range(level + 1):
+                self.get_parent_index(level, parent_level)
+
+    def get_map(self, level, z, title, zmax=1):
+        """
+        Return a new figure (a dictionary, as accepted by dcc.Graph) of the
+        choropleth map of the regions of a level, with the values z (in the
+        order of the regions), the color range [0, zmax] and the given title.
+        Only the outer dictionaries of the template (see maps) are copied, so
+        the geojson is shared by every figure (and with the country) instead of
+        being copied like in a plotly.graph_objects.Figure, and every request
+        gets its own figure, even if several threads build maps of the same
+        election at the same time.
+        """
+        template = self.maps[level]
+        trace = dict(template['data'][0], z=list(z), zmin=0, zmax=zmax)
+        return {'data': [trace], 'layout': dict(template['layout'], title={'text': title})}
 
     @property
     def regions(self):
@@ -152,6 +257,159 @@ class Election():
 
         return parties
 
+    def get_vote_matrix(self, level):
+        """
+        Given a region level, return the regions x parties Vote_Matrix of all
+        the regions at that level. Rows follow the order of self.regions[level]
+        and columns the order of self.parties.
+        The matrix is built once per level and cached. For the levels added
+        with add_sparse_level, raise ValueError if it would have more than
+        MAX_DENSE_CELLS entries (use get_sparse_vote_matrix instead).
+        """
+        count_cache('vote_matrix', level in self._vote_matrices)
+        if level not in self._vote_matrices:
+            if level in self._sparse_vote_matrices:
+                n_regions, n_parties = self._sparse_vote_matrices[level].shape
+                if n_regions*n_parties > MAX_DENSE_CELLS:
+                    raise ValueError("The votes of the {} regions and {} parties of level {} are too many for a dense matrix."
+                                     .format(n_regions, n_parties, level))
+                self._vote_matrices[level] = self._sparse_vote_matrices[level].to_dense()
+            else:
+                self._vote_matrices[level] = Vote_Matrix.from_regions(self.regions[level].values(), self.parties)
+        return self._vote_matrices[level]
+
+    def get_sparse_vote_matrix(self, level):
+        """
+        Given a region level, return the regions x parties Sparse_Vote_Matrix
+        of all the regions at that level, in the same order as get_vote_matrix.
+        For the levels added with add_sparse_level it is the matrix that stores
+        their votes; for the rest it is built once and cached.
+        """
+        count_cache('sparse_vote_matrix', level in self._sparse_vote_matrices)
+        if level not in self._sparse_vote_matrices:
+            self._sparse_vote_matrices[level] = Sparse_Vote_Matrix.from_regions(self.regions[level].values(), self.parties)
+        return self._sparse_vote_matrices[level]
+
+    def get_parent_index(self, level, parent_level):
+        """
+        Return the integer array whose i-th entry is the position, in
+        self.regions[parent_level], of the region that contains the i-th region
+        of the given level (-1 if there is none), with parent_level <= level.
+        """
+        count_cache('parent_index', (level, parent_level) in self._parent_indices)
+        if (level, parent_level) not in self._parent_indices:
+            region_index = {name: i for i, name in enumerate(self.regions[level])}
+            parent_index = np.full(len(region_index), -1, dtype=np.int64)
+            for p, parent_region in enumerate(self.regions[parent_level].values()):
+                for region in iter_subregions(parent_region, level):
+                    parent_index[region_index[region.name]] = p
+            self._parent_indices[(level, parent_level)] = parent_index
+        return self._parent_indices[(level, parent_level)]
+
+    def aggregate_rows(self, values, level, parent_level):
+        """
+        Given an array whose rows follow the order of the regions of the given
+        level (e.g. the votes of get_vote_matrix(level)), return the array
+        whose rows are the sums of the rows of the subregions of every region
+        of parent_level, with parent_level <= level.
+        This is the product of get_level_membership(level, parent_level) by
+        the array, computed with a single bincount over the parent indices, so
+        that the dense membership matrix is never built.
+        """
+        values = np.asarray(values)
+        parent_index = self.get_parent_index(level, parent_level)
+        has_parent = parent_index >= 0
+        n_parents, n_columns = len(self.regions[parent_level]), int(np.prod(values.shape[1:]))
+        keys = (parent_index[has_parent, None]*n_columns + np.arange(n_columns)).ravel()
+        sums = np.bincount(keys, weights=values[has_parent].ravel(), minlength=n_parents*n_columns)
+        return sums.reshape((n_parents,) + values.shape[1:]).astype(values.dtype)
+
+    def get_level_membership(self, level, parent_level):
+        """
+        Return the membership matrix of shape (n_regions(parent_level),
+        n_regions(level)) whose entry (p, r) is 1 if the region r of the given
+        level is a subregion of the region p of parent_level, with parent_level <= level.
+        Rows and columns follow the order of self.regions.
+        The matrix is dense and it isn't cached, so aggregate_rows must be used
+        to aggregate the rows of get_vote_matrix(level) instead.
+        """
+        parent_index = self.get_parent_index(level, parent_level)
+        membership = np.zeros((len(self.regions[parent_level]), len(parent_index)), dtype=np.int64)
+        has_parent = parent_index >= 0
+        membership[parent_index[has_parent], np.flatnonzero(has_parent)] = 1
+        return membership
+
+    def add_sparse_level(self, vote_matrix, parent_names, update_parents=False):
+        """
+        Add a level of small regions (e.g. municipalities or precincts) below
+        the highest level of the election. The regions are
+        regions.Sparse_Electoral_Region objects backed by the given
+        matrices.Sparse_Vote_Matrix, and parent_names contains the name of the
+        region of the highest level that contains every row of the matrix.
+
+        If update_parents is True, the votes, census, 'None of the Above' and
+        spoilt votes of the regions of every lower level are recomputed by
+        aggregating the new level (their number of seats is kept).
+        Return the new level.
+        """
+        level = max(self.regions) + 1
+        if level > electoral_systems.MAX_LEVEL:
+            raise ValueError("Regional level must be between 0 and {}".format(electoral_systems.MAX_LEVEL))
+        if len(parent_names) != len(vote_matrix.region_names):
+            raise ValueError("Every region must have a parent region.")
+
+        # Sort the columns like self.parties, appending the new parties
+        party_index = {p: i for i, p in enumerate(self.parties)}
+        for party in vote_matrix.parties:
+            if party not in party_index:
+                party_index[party] = len(party_index)
+        if list(party_index) != vote_matrix.parties:
+            columns = np.array([party_index[p] for p in vote_matrix.parties], dtype=np.int64)
+            vote_matrix = Sparse_Vote_Matrix(
+                vote_matrix.region_names, list(party_index), vote_matrix.indptr, columns[vote_matrix.indices],
+                vote_matrix.data, vote_matrix.census, vote_matrix.n_seats, vote_matrix.nota, vote_matrix.spoilt_votes,
+            )
+            self.parties = list(party_index)
+
+        parents = self.regions[level - 1]
+        regions = {}
+        for i, (name, parent_name) in enumerate(zip(vote_matrix.region_names, parent_names)):
+            if parent_name not in parents:
+                raise ValueError("Region '{}' of level {} does not exist.".format(parent_name, level - 1))
+            parent = parents[parent_name]
+            if not isinstance(getattr(parent, 'subregions', None), list):
+                parent.subregions = list(getattr(parent, 'subregions', []))
+            region = Sparse_Electoral_Region(self, level, vote_matrix, i)
+            parent.subregions.append(region)
+            regions[name] = region
+        self.regions[level] = regions
+
+        if update_parents:
+            for parent_level in range(level):
+                aggregated = vote_matrix.aggregate(self.get_parent_index(level, parent_level), list(self.regions[parent_level]))
+                for i, region in enumerate(self.regions[parent_level].values()):
+                    region.votes = {p: v for p, v in aggregated.get_votes(i).items() if v}
+                    region.census = int(aggregated.census[i])
+                    region.nota = int(aggregated.nota[i])
+                    region.spoilt_votes = int(aggregated.spoilt_votes[i])
+                    region.total_votes = sum(region.votes.values())
+
+        # The cached matrices of the other levels may have different columns or votes
+        self._vote_matrices = {}
+        self._sparse_vote_matrices = {level: vote_matrix}
+        return level
+
+    def reapportion(self, level, n_seats, method='Huntington-Hill', min_seats=0):
+        """
+        Distribute n_seats among the regions of a level proportionally to their
+        census, using one of apportionment.APPORTIONMENT_METHODS and the given
+        minimum number of seats per region (an int or a dictionary).
+        Return a dictionary whose keys are region names and values are their
+        number of seats, to be passed to Electoral_Region.compute_result.
+        """
+        census = {name: region.census for name, region in self.regions[level].items()}
+        return apportionment.reapportion(census, n_seats, method, min_seats)
+
     def _parse_data(self, filename, max_level):
         """
         Extract the data from the pickle file, initialize the Electoral_Regions.region
@@ -460,18 +718,49 @@ usa_colors = {
 }
 
 
-class USA_2020(Election):
-    def __init__(self):
-        data_file = 'data/USA/election_data.pkl'
-        data_file = os.path.join(os.path.dirname(__file__), data_file)
-        parsed_data = self._parse_data(data_file, max_level=2)
+# Cycles of the elections to the House of Representatives
+USA_YEARS = list(range(1976, 2021, 2))
+_usa_country = None
+
+
+def get_usa_country():
+    """
+    Return the countries.USA object shared by all the USA elections, loading
+    its borders the first time.
+    """
+    global _usa_country
+    if _usa_country is None:
+        _usa_country = countries.USA()
+    return _usa_country
+
+
+def get_usa_data_file(year):
+    return os.path.join(os.path.dirname(__file__), 'data/USA/election_data_{}.pkl'.format(year))
+
+
+def get_usa_years():
+    """
+    Return the cycles of USA_YEARS whose data has been preprocessed (see
+    data/USA/preprocess_data.py), most recent first.
+    """
+    return [year for year in reversed(USA_YEARS) if os.path.exists(get_usa_data_file(year))]
+
+
+class USA_Election(Election):
+    """
+    Parent class to all the classes that represent elections to the House of
+    Representatives of the USA. There is one subclass per cycle of
+    USA_YEARS, named USA_<year>.
+    """
+    def __init__(self, year: int):
+        parsed_data = self._parse_data(get_usa_data_file(year), max_level=2)
         self.regions = parsed_data['regions']
         self.parties = parsed_data['parties']
         self.electoral_system = electoral_systems.System(name='dHondt', level=2, threshold=0)
         self.colors = usa_colors
         self._build_region_tree()
 
-        super(USA_2020, self).__init__(country=countries.USA(), date='2020')
+        super(USA_Election, self).__init__(country=get_usa_country(), date=str(year))
 
     def _build_region_tree(self):
         self.regions[0]['USA'].subregions = self.regions[1].values()
@@ -482,6 +771,23 @@ class USA_2020(Election):
                 self.regions[1][region_name.split('_')[0]].subregions = [region_value]
 
 
+def _usa_election_class(year):
+    class USA_Cycle(USA_Election):
+        def __init__(self):
+            super(USA_Cycle, self).__init__(year)
+
+    USA_Cycle.__name__ = USA_Cycle.__qualname__ = 'USA_{}'.format(year)
+    USA_Cycle.__doc__ = """
+    Class representing the elections to the House of Representatives that
+    were held in the USA in {}.
+    """.format(year)
+    return USA_Cycle
+
+
+for _year in USA_YEARS:
+    globals()['USA_{}'.format(_year)] = _usa_election_class(_year)
+
+
 ##############
 # Costa Rica #
 ##############
@@ -521,3 +827,67 @@ class Costa_Rica_2018(Election):
 
     def _build_region_tree(self):
         self.regions[0]['Costa Rica'].subregions = self.regions[1].values()
+
+
+################
+# LAZY LOADING #
+################
+
+class Lazy_Elections(Mapping):
+    """
+    Read-only dictionary of elections that are only loaded the first time
+    they are accessed, for countries with too many elections to keep all of
+    them (and their figures) in memory.
+
+    ...
+    Attributes
+    ----------
+    classes: dict
+        Keys are the keys of the dictionary (e.g. dates), values are the
+        Election subclasses that load them.
+    max_loaded: int
+        If given, the maximum number of elections kept in memory: the least
+        recently used one is dropped when another one is loaded.
+    loaded: OrderedDict
+        The elections in memory, from the least to the most recently used.
+    """
+    def __init__(self, classes, max_loaded=None):
+        self.classes = dict(classes)
+        self.max_loaded = max_loaded
+        self.loaded = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def __getitem__(self, key):
+        cls = self.classes[key]
+        election = self.loaded.get(key)
+        if election is None:
+            # Every election is loaded under its own lock, so that concurrent
+            # requests don't load the same one twice but don't wait for others
+            with self._lock:
+                key_lock = self._loading.setdefault(key, threading.Lock())
+            with key_lock:
+                election = self.loaded.get(key)
+                if election is None:
+                    count_cache('lazy_elections', False)
+                    election = cls()
+                    with self._lock:
+                        self.loaded[key] = election
+                        while self.max_loaded and len(self.loaded) > self.max_loaded:
+                            self.loaded.popitem(last=False)
+                        self._loading.pop(key, None)
+                    return election
+        count_cache('lazy_elections', True)
+        with self._lock:
+            if key in self.loaded:
+                self.loaded.move_to_end(key)
+        return election
+
+    def __contains__(self, key):
+        return key in self.classes
+
+    def __iter__(self):
+        return iter(self.classes)
+
+    def __len__(self):
+        return len(self.classes)
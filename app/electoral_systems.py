@@ -1,4 +1,37 @@
-SYSTEM_NAMES = ['dHondt', 'SL', 'LRM-Hare', 'LRM-Droop', 'LRM-HB', 'LRM-Imperiali', 'Winner Takes All']
+import os
+import sys
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+from telemetry import timed  # noqa: E402
+
+SYSTEM_NAMES = ['dHondt', 'SL', 'LRM-Hare', 'LRM-Droop', 'LRM-HB', 'LRM-Imperiali', 'Winner Takes All', 'STV']
+# Two-tier systems: constituency seats are assigned at system.level with the
+# constituency method, and leveling seats at system.compensatory_level so that
+# the totals of every party approach proportionality. leveling_seats is the
+# number of leveling seats of every constituency, or the fraction of its seats
+# if it is lower than 1, always leaving at least one constituency seat. Overhang seats are either balanced by enlarging the
+# chamber ('balance') or the parties with overhang are excluded from the
+# leveling seats ('exclude').
+TWO_TIER_SYSTEMS = {
+    'MMP': {
+        'constituency_method': 'Winner Takes All',
+        'compensatory_method': 'SL',
+        'leveling_seats': 0.5,
+        'overhang': 'balance',
+    },
+    'Leveling Seats': {
+        'constituency_method': 'dHondt',
+        'compensatory_method': 'SL',
+        'leveling_seats': 1,
+        'overhang': 'exclude',
+    },
+}
+# Biproportional apportionment (see biproportional.py) assigns the seats of
+# all the regions of system.level jointly, with party totals computed at
+# system.compensatory_level
+BIPROPORTIONAL = 'Biproportional'
 MAX_LEVEL = 3
 MAX_THRESHOLD = 15
 
@@ -12,7 +45,9 @@ class System():
     ----------
     name: str
         The name of the system. Must be one of 'dHondt', 'SL', 'LRM-Hare',
-        'LRM-Droop', 'LRM-HB', 'LRM-Imperiali'.
+        'LRM-Droop', 'LRM-HB', 'LRM-Imperiali', 'Winner Takes All', 'STV', or
+        one of the two-tier systems 'MMP' and 'Leveling Seats', or
+        'Biproportional'.
     level: int
         The regional level at which the parliament seats are assigned.
     threshold: int
@@ -21,12 +56,22 @@ class System():
     threshold_country: bool
         Whether the threshold applies at a country-level or not. If False, it
         means that the threshold applies at a regional level.
+    transfer_model: stv.Transfer_Model
+        How the ranked ballots used by 'STV' are generated from the votes.
+        If None, the default stv.Transfer_Model is used.
+    compensatory_level: int
+        The regional level at which the leveling seats of two-tier systems, or
+        the party totals of the biproportional apportionment, are assigned.
     """
-    def __init__(self, name: str, level: int, threshold: int, threshold_country=False):
+    @timed('system')
+    def __init__(self, name: str, level: int, threshold: int, threshold_country=False, transfer_model=None,
+                 compensatory_level: int = 0):
         self.name = name
         self.level = level
         self.threshold = threshold
         self.threshold_country = threshold_country
+        self.transfer_model = transfer_model
+        self.compensatory_level = compensatory_level
         return
 
     @property
@@ -38,7 +83,7 @@ class System():
 
     @name.setter
     def name(self, value):
-        if value not in SYSTEM_NAMES:
+        if value not in SYSTEM_NAMES and value not in TWO_TIER_SYSTEMS and value != BIPROPORTIONAL:
             raise ValueError("System not supported")
         self._name = value
 
@@ -82,3 +127,17 @@ class System():
         if not type(value) == bool:
             raise TypeError("Country-level threshold should be boolean.")
         self._threshold_country = value
+
+    @property
+    def compensatory_level(self):
+        """
+        The regional level at which the leveling seats of two-tier systems, or
+        the party totals of the biproportional apportionment, are assigned.
+        """
+        return self._compensatory_level
+
+    @compensatory_level.setter
+    def compensatory_level(self, value):
+        if not 0 <= value <= MAX_LEVEL:
+            raise ValueError("Regional level must be between 0 and {}".format(MAX_LEVEL))
+        self._compensatory_level = value
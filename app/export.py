@@ -0,0 +1,262 @@
+"""
+Export the seats, lost votes and metrics of a grid of elections, systems,
+levels and thresholds to CSV, Parquet or Arrow IPC files, one per table. The
+rows are computed in a pool of processes and written in chunks, so that memory
+doesn't grow with the size of the grid. e.g.
+
+    python -m app.export --elections all --systems dHondt SL Biproportional \
+        --levels 1 2 --thresholds 0 3 5 --format parquet --output-dir exports
+
+Parquet and Arrow IPC need pyarrow (pip install pyarrow).
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc  # noqa: F401 (pa.ipc)
+    import pyarrow.parquet  # noqa: F401 (pa.parquet)
+except ImportError:
+    pa = None
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+import batch  # noqa: E402
+import electoral_systems  # noqa: E402
+import metrics  # noqa: E402
+
+# Columns of every table, with their types
+_GRID_COLUMNS = [('election', str), ('system', str), ('level', int), ('threshold', str), ('threshold_country', bool)]
+TABLES = {
+    'seats': _GRID_COLUMNS + [('region', str), ('party', str), ('votes', int), ('seats', int)],
+    'lost_votes': _GRID_COLUMNS + [('region', str), ('party', str), ('lost_votes', int)],
+    'metrics': _GRID_COLUMNS + [('region_level', int), ('region', str), ('metric', str), ('value', float)],
+}
+FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def compute_tables(task):
+    """
+    Given a tuple (election name, system name, level, threshold,
+    threshold_country, table names), return a dictionary whose keys are the
+    table names and values are the lists of rows of the task (see TABLES):
+     - 'seats': the votes and seats of every party in every region of the
+       system level (parties without votes nor seats are omitted).
+     - 'lost_votes': the votes of the parties without seats in every region of
+       the system level (see regions.Election_Result.get_lost_votes).
+     - 'metrics': the value of every metrics.METRIC_NAMES in every region of
+       every level up to the system level.
+    Levels that the election doesn't have give no rows.
+    """
+    election_name, system_name, level, threshold, threshold_country, table_names = task
+    tables = {table: [] for table in table_names}
+    election = batch.get_election(election_name)
+    if level not in election.regions:
+        return tables
+    system = electoral_systems.System(system_name, level, threshold, threshold_country)
+    grid_row = [election_name, system_name, level, threshold, threshold_country]
+
+    if 'seats' in tables or 'lost_votes' in tables:
+        country_region = next(iter(election.regions[0].values()))
+        result = country_region.compute_result(system)
+        for region_name, seats in result.result.items():
+            region = election.regions[level][region_name]
+            if 'seats' in tables:
+                tables['seats'].extend(
+                    grid_row + [region_name, party, region.votes.get(party, 0), seats.get(party, 0)]
+                    for party in election.parties if seats.get(party, 0) or region.votes.get(party, 0)
+                )
+            if 'lost_votes' in tables:
+                tables['lost_votes'].extend(
+                    grid_row + [region_name, party, votes]
+                    for party, votes in result.get_lost_votes(region, level).items() if votes
+                )
+
+    if 'metrics' in tables:
+        election_metrics = metrics.Election_Metrics(election, system)
+        for region_level, values in election_metrics.values.items():
+            region_names = list(election.regions[region_level])
+            for metric, metric_values in values.items():
+                tables['metrics'].extend(
+                    grid_row + [region_level, region_name, metric, float(value)]
+                    for region_name, value in zip(region_names, metric_values)
+                )
+    return tables
+
+
+def iter_chunks(election_names, system_names, levels, thresholds, threshold_countries=(False,), table_names=tuple(TABLES),
+                chunk_size=100000, processes=None, progress=None):
+    """
+    Compute the tables of every combination of the given elections, system
+    names, levels, thresholds and threshold scopes, in a pool of processes (all
+    the CPUs by default; 1 to run in the current process).
+    Yield tuples (table name, rows) with at most chunk_size rows, in the order
+    of the grid, as soon as they are available.
+    If progress is given, it is called with the number of tasks of the grid
+    done so far and the total number of tasks.
+    """
+    tasks = [task[:5] + (tuple(table_names),) for task in batch.get_tasks(
+        election_names, system_names, levels, thresholds, threshold_countries)]
+    buffers = {table: [] for table in table_names}
+
+    if processes == 1:
+        results = map(compute_tables, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        chunksize = max(1, len(tasks) // (4 * (processes or os.cpu_count() or 1)))
+        results = pool.imap(compute_tables, tasks, chunksize=chunksize)
+
+    try:
+        for i, tables in enumerate(results):
+            for table, rows in tables.items():
+                buffers[table].extend(rows)
+                while len(buffers[table]) >= chunk_size:
+                    yield table, buffers[table][:chunk_size]
+                    del buffers[table][:chunk_size]
+            if progress:
+                progress(i + 1, len(tasks))
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    for table, rows in buffers.items():
+        if rows:
+            yield table, rows
+
+
+class Table_Writer():
+    """
+    Writes the chunks of rows of a table (see TABLES) to a file, in one of
+    FORMATS.
+
+    ...
+    Methods
+    -------
+    write(rows)
+        Append a list of rows to the file.
+    close()
+        Finish the file. Table_Writer objects can also be used as context
+        managers.
+    """
+    def __init__(self, path, table, format='csv'):
+        """
+        Parameters
+        ----------
+        path: str
+            The path of the file.
+        table: str
+            The name of the table (a key of TABLES).
+        format: str
+            One of FORMATS.
+        """
+        if format not in FORMATS:
+            raise ValueError("Format '{}' is not supported. Choose one of: {}.".format(format, ', '.join(FORMATS)))
+        if format != 'csv' and pa is None:
+            raise ImportError("Exporting to {} requires pyarrow (pip install pyarrow).".format(format))
+        self.path = path
+        self.columns = TABLES[table]
+        self.format = format
+
+        if format == 'csv':
+            self._file = open(path, 'w', newline='')
+            self._writer = csv.writer(self._file, lineterminator='\n')
+            self._writer.writerow([name for name, _ in self.columns])
+        else:
+            self.schema = get_arrow_schema(table)
+            if format == 'parquet':
+                self._writer = pa.parquet.ParquetWriter(path, self.schema)
+            else:
+                self._writer = pa.ipc.new_file(path, self.schema)
+
+    def write(self, rows):
+        if self.format == 'csv':
+            self._writer.writerows(rows)
+        else:
+            columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in self.columns]
+            self._writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, self.schema)], schema=self.schema))
+
+    def close(self):
+        if self.format == 'csv':
+            self._file.close()
+        else:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_arrow_schema(table):
+    """
+    Return the pyarrow.Schema of a table (see TABLES).
+    """
+    types = {str: pa.string(), int: pa.int64(), bool: pa.bool_(), float: pa.float64()}
+    return pa.schema([(name, types[column_type]) for name, column_type in TABLES[table]])
+
+
+def export(output_dir, election_names, system_names, levels, thresholds, threshold_countries=(False,),
+           table_names=tuple(TABLES), format='csv', chunk_size=100000, processes=None, progress=None):
+    """
+    Write every table in table_names to the file <output_dir>/<table><extension>
+    (see iter_chunks for the rest of parameters).
+    Return a dictionary whose keys are the paths of the files and values are
+    their number of rows.
+    """
+    if format not in FORMATS:
+        raise ValueError("Format '{}' is not supported. Choose one of: {}.".format(format, ', '.join(FORMATS)))
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {table: os.path.join(output_dir, table + FORMATS[format]) for table in table_names}
+    writers = {}
+    n_rows = dict.fromkeys(paths.values(), 0)
+    try:
+        for table in table_names:
+            writers[table] = Table_Writer(paths[table], table, format)
+        for table, rows in iter_chunks(election_names, system_names, levels, thresholds, threshold_countries, table_names,
+                                       chunk_size, processes, progress):
+            writers[table].write(rows)
+            n_rows[paths[table]] += len(rows)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return n_rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.export', description=__doc__.split('e.g.')[0].strip())
+    parser.add_argument('--elections', nargs='+', default=['all'],
+                        help="Election class names, e.g. Spain_2019_11 (default: all)")
+    parser.add_argument('--systems', nargs='+', default=electoral_systems.SYSTEM_NAMES,
+                        choices=electoral_systems.SYSTEM_NAMES + list(electoral_systems.TWO_TIER_SYSTEMS) + [electoral_systems.BIPROPORTIONAL],
+                        metavar='SYSTEM', help="System names (default: {})".format(', '.join(electoral_systems.SYSTEM_NAMES)))
+    parser.add_argument('--levels', nargs='+', type=int, default=[0, 1, 2])
+    parser.add_argument('--thresholds', nargs='+', default=['3'], help="Thresholds in %% or 'n/2s'")
+    parser.add_argument('--threshold-country', choices=['no', 'yes', 'both'], default='no',
+                        help="Whether the thresholds apply at country level")
+    parser.add_argument('--tables', nargs='+', choices=list(TABLES), default=list(TABLES))
+    parser.add_argument('--format', choices=list(FORMATS), default='csv')
+    parser.add_argument('--chunk-size', type=int, default=100000, help="Maximum number of rows written at once")
+    parser.add_argument('--processes', type=int, default=None, help="Number of processes (default: all the CPUs)")
+    parser.add_argument('--output-dir', default='.', help="Directory of the output files (default: current directory)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    election_names = batch.get_election_names() if args.elections == ['all'] else args.elections
+    threshold_countries = {'no': (False,), 'yes': (True,), 'both': (False, True)}[args.threshold_country]
+    n_rows = export(args.output_dir, election_names, args.systems, args.levels, args.thresholds, threshold_countries,
+                    args.tables, args.format, args.chunk_size, args.processes)
+    for path, n in n_rows.items():
+        print('{}: {} rows'.format(path, n))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import copy
+import os
+import sys
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+from matrices import membership_matrix  # noqa: E402
+from regions import Electoral_Region  # noqa: E402
+from telemetry import timed  # noqa: E402
+
+
+class District_Grouping():
+    """
+    Class representing a custom division of a country into electoral districts,
+    each of them being the union of several regions of a given level.
+    (e.g. merging the four Galician provinces into a single district)
+
+    The votes, census and seats of the districts are obtained by multiplying a
+    districts x regions membership matrix by the election's vote matrix, so
+    that many groupings can be evaluated on the same election cheaply.
+
+    ...
+    Attributes
+    ----------
+    election: elections.Election
+        The election whose regions are grouped.
+    level: int
+        The level of the regions that are grouped into districts.
+    groups: dict
+        Keys are district names, values are lists with the names of the regions
+        that make up the district. Regions that are not part of any of the
+        given groups are kept as single-region districts with their own name.
+    district_names: list
+        The names of the districts.
+    membership: numpy.ndarray
+        Array of shape (n_districts, n_regions) whose entry (d, r) is 1 if the
+        region r belongs to district d and 0 otherwise.
+
+    Methods
+    -------
+    get_vote_matrix(): matrices.Vote_Matrix
+        Return the districts x parties Vote_Matrix.
+    get_region(): regions.Electoral_Region
+        Return a country-level Electoral_Region whose subregions (level 1) are
+        the districts.
+    get_district(region_name): str
+        Return the name of the district that contains the given region.
+    compute_result(system, region_name=None): regions.Election_Result
+        Given an electoral_systems.System, return the result of applying it to
+        the districts.
+    get_map_plot(result, other=None): plotly.graph_objects.Figure
+        Get the choropleth map of a result, painting every region with the value
+        of its district.
+    """
+    @timed('aggregation')
+    def __init__(self, election, groups: dict, level: int = None):
+        """
+        Parameters
+        ----------
+        election: elections.Election
+            The election whose regions are grouped.
+        groups: dict
+            Keys are district names, values are lists with the names of the
+            regions that make up the district.
+        level: int
+            The level of the regions that are grouped. If not specified, the
+            highest level of the election is used.
+        """
+        self.election = election
+        self.level = max(election.regions) if level is None else level
+
+        region_names = election.get_vote_matrix(self.level).region_names
+        self.groups = {name: list(members) for name, members in groups.items()}
+        grouped_regions = {r for members in self.groups.values() for r in members}
+        for region_name in region_names:
+            if region_name not in grouped_regions:
+                if region_name in self.groups:
+                    raise ValueError("District '{}' has the name of a region that is not part of it.".format(region_name))
+                self.groups[region_name] = [region_name]
+
+        self.membership = membership_matrix(region_names, self.groups)
+        self.district_names = list(self.groups)
+        self._district_of = {r: d for d, members in self.groups.items() for r in members}
+        self._region = None
+
+    def get_vote_matrix(self):
+        """
+        Return the districts x parties matrices.Vote_Matrix.
+        """
+        vote_matrix = self.election.get_vote_matrix(self.level)
+        return vote_matrix.aggregate(self.membership, self.district_names)
+
+    def get_region(self):
+        """
+        Return a country-level Electoral_Region whose subregions (level 1) are
+        the districts. The tree is built once and cached.
+        """
+        if self._region is None:
+            country_region = next(iter(self.election.regions[0].values()))
+            self._region = Electoral_Region(
+                self.election,
+                country_region.name,
+                0,
+                country_region.census,
+                country_region.n_seats,
+                country_region.votes,
+                country_region.nota,
+                country_region.spoilt_votes,
+            )
+
+            vote_matrix = self.get_vote_matrix()
+            self._region.subregions = [
+                Electoral_Region(
+                    self.election,
+                    name,
+                    1,
+                    int(vote_matrix.census[i]),
+                    int(vote_matrix.n_seats[i]),
+                    vote_matrix.get_votes(i),
+                    int(vote_matrix.nota[i]),
+                    int(vote_matrix.spoilt_votes[i]),
+                ) for i, name in enumerate(vote_matrix.region_names)
+            ]
+        return self._region
+
+    def get_district(self, region_name):
+        """
+        Return the name of the district that contains the given region.
+        """
+        return self._district_of[region_name]
+
+    @timed('compute_result')
+    def compute_result(self, system, region_name=None):
+        """
+        Given an electoral_systems.System, return the regions.Election_Result of
+        applying it to every district, regardless of system.level.
+        If region_name is specified, the result is only computed for the
+        district containing that region.
+        """
+        district_system = copy.copy(system)
+        district_system.level = 1
+
+        region = self.get_region()
+        if region_name is not None:
+            district_name = self.get_district(region_name)
+            region = next(r for r in region.subregions if r.name == district_name)
+
+        return region.compute_result(district_system)
+
+    @timed('figures')
+    def get_map_plot(self, result, other=None):
+        """
+        Get a figure (a dictionary, see elections.Election.get_map) with the
+        choropleth map of the regions of self.level, every region showing the
+        value of the district it belongs to.
+        If 'other' result is specified, show the seat difference between result
+        and other for every district.
+        Otherwise, show the percentage of lost votes of every district.
+        """
+        district_values = {}
+        for district in self.get_region().subregions:
+            if not other:
+                n_lost_votes = sum(result.get_lost_votes(district).values())
+                district_values[district.name] = n_lost_votes / district.total_votes
+            else:
+                seat_diff = result.get_seat_diff(other, region=district, level=1)
+                district_values[district.name] = sum([x for x in seat_diff.values() if x > 0])
+
+        z = [district_values[self._district_of[r]] for r in self.election.regions[self.level]]
+        if not other:
+            return self.election.get_map(self.level, z, 'Percentage of Lost Votes per District')
+        return self.election.get_map(self.level, z, 'Seat difference per District', zmax=max(10, max(z)))
+
+
+def parse_groups(text):
+    """
+    Parse the groups of a District_Grouping from a text with one district per
+    line, in the format 'District name: region 1, region 2, ...'.
+    Empty lines are ignored.
+    """
+    groups = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if ':' not in line:
+            raise ValueError("Districts must be written as 'District name: region 1, region 2, ...'")
+        district_name, members = line.split(':', 1)
+        members = [x.strip() for x in members.split(',') if x.strip()]
+        if not district_name.strip() or not members:
+            raise ValueError("District '{}' must have a name and at least one region.".format(line.strip()))
+        groups[district_name.strip()] = members
+    return groups
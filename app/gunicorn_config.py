@@ -1,2 +1,39 @@
-bind = "0.0.0.0:8080"
-workers = 1
+import gc
+import os
+
+# Every worker serves the dashboard callbacks, which are CPU-bound, so the
+# number of workers is bounded by the CPUs and by the memory of the instance,
+# and threads mostly help with slow clients. Threads are safe: every request
+# builds its own figures from the read-only templates of Election.maps (see
+# Election.get_map). Measure the throughput and latency of every setting with
+# app/loadtest.py before changing the defaults of the deployment.
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:{}'.format(os.environ.get('PORT', 8080)))
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+# With several workers, the app is loaded once by the master (main.ELECTIONS,
+# the geometries of the countries and what Election.warm_up builds; the USA
+# elections are still loaded lazily by every worker) and the forked workers
+# share its memory pages until they write to them (copy-on-write). To keep
+# those pages clean:
+#  - The garbage collector is disabled while the app is loaded and the objects
+#    of the master are frozen (gc.freeze) before forking, so that the
+#    collections of the workers never write to their headers.
+#  - The maps load the geojson from the files served by countries.install
+#    (MAP_GEOJSON_URLS), so the workers never walk the geometries to serialize
+#    them in every response.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1' if workers > 1 else '0') == '1'
+if preload_app:
+    os.environ.setdefault('MAP_GEOJSON_URLS', '1')
+    gc.disable()
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        gc.enable()
@@ -0,0 +1,404 @@
+"""
+Background jobs for the analyses that are too long for a Dash callback or an
+API request: redistricting ensembles, batch grids, exports and long batches
+of API scenarios (see JOB_KINDS).
+
+Jobs are submitted to a Job_Manager, which runs them in a pool of
+JOBS_PROCESSES processes, so that they don't hold the GIL of the threads
+serving the dashboard, and returns their id at once. Every job has a directory
+<JOBS_DIR>/<id> with:
+
+    status.json
+        {"id", "kind", "params", "state", "done", "total", "message",
+        "created", "started", "finished", "error"}, where state is one of
+        STATES. It is rewritten by the job while it runs, so the progress can
+        be polled by any thread or worker process.
+    result.json
+        The result of the job, once it is 'done'.
+    Other files
+        The tables written by the job (listed in the 'files' of its result).
+
+A job is cancelled by creating the file 'cancel' in its directory: queued jobs
+don't start, and running jobs stop the next time they report their progress.
+
+The processes of the pool are started with the 'spawn' method (see
+POOL_CONTEXT) and not forked, since forking a threaded server can copy a lock
+held by another thread (e.g. of a telemetry metric) into a worker that would
+then wait for it forever. If a worker dies, its jobs are marked as failed and
+the pool is replaced with the next job, and the running jobs whose process
+no longer exists (e.g. after a restart) are reported as failed.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import csv
+import functools
+import inspect
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+import batch  # noqa: E402
+import electoral_systems  # noqa: E402
+import export  # noqa: E402
+import redistricting  # noqa: E402
+
+JOBS_DIR = os.environ.get('JOBS_DIR', os.path.join(myPath, 'job_results'))
+JOBS_PROCESSES = int(os.environ.get('JOBS_PROCESSES', min(2, os.cpu_count() or 1)))
+STATES = ['queued', 'running', 'done', 'failed', 'cancelled']
+FINISHED_STATES = {'done', 'failed', 'cancelled'}
+# Minimum seconds between two writes of the progress of a job
+PROGRESS_INTERVAL = 0.2
+# Start method of the processes of the pools of the jobs and of the API
+POOL_CONTEXT = multiprocessing.get_context(os.environ.get('POOL_START_METHOD', 'spawn'))
+
+_JOB_ID = re.compile('[0-9a-f]{32}')
+
+
+class Job_Cancelled(Exception):
+    """
+    Raised inside a job when it has been cancelled.
+    """
+    pass
+
+
+def _write_json(path, data):
+    # Write to a temporary file and rename it, so that readers never see a partial file
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class Job_Context():
+    """
+    What a running job uses to report its progress and write its files.
+
+    ...
+    Attributes
+    ----------
+    directory: str
+        The directory of the job.
+    status: dict
+        The status of the job (see status.json).
+
+    Methods
+    -------
+    progress(done, total, message=None)
+        Report the progress of the job. Raise Job_Cancelled if it has been
+        cancelled.
+    get_path(name): str
+        Return the path of a file of the job.
+    is_cancelled(): bool
+        Return whether the job has been cancelled.
+    update(**values)
+        Update the status of the job and write it.
+    """
+    def __init__(self, directory, status):
+        self.directory = directory
+        self.status = status
+        self._last_write = 0
+
+    def get_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def is_cancelled(self):
+        return os.path.exists(self.get_path('cancel'))
+
+    def update(self, **values):
+        self.status.update(values)
+        _write_json(self.get_path('status.json'), self.status)
+        self._last_write = time.monotonic()
+
+    def progress(self, done, total, message=None):
+        if self.is_cancelled():
+            raise Job_Cancelled()
+        self.status.update(done=done, total=total)
+        if message is not None:
+            self.status['message'] = message
+        if done == total or time.monotonic() - self._last_write >= PROGRESS_INTERVAL:
+            self.update()
+
+
+def _get_system(spec):
+    return electoral_systems.System(
+        spec['name'], int(spec.get('level', 0)), str(spec.get('threshold', 0)), bool(spec.get('threshold_country', False)),
+        compensatory_level=int(spec.get('compensatory_level', 0)),
+    )
+
+
+def run_ensemble_job(context, election, system, n_districts, n_plans, level=None, n_chains=1, tolerance=0.5, seed=None):
+    """
+    Job of a redistricting ensemble (see redistricting.run_ensemble) of the
+    election of the given class name, with the system described as in the
+    JSON API. The seats of every party in every plan are written to
+    seats.csv, and the result is the seat summary of the ensemble.
+    """
+    ensemble = redistricting.run_ensemble(batch.get_election(election), n_districts, _get_system(system), n_plans, level,
+                                          n_chains, processes=1, tolerance=tolerance, seed=seed, progress=context.progress)
+    with open(context.get_path('seats.csv'), 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(ensemble.parties)
+        writer.writerows(ensemble.seats.tolist())
+    return {
+        'summary': ensemble.get_seat_summary(),
+        'acceptance_rate': ensemble.acceptance_rate,
+        'files': ['seats.csv'],
+    }
+
+
+def run_batch_job(context, elections, systems, levels, thresholds, threshold_countries=(False,), by_region=False):
+    """
+    Job of a batch grid (see batch.run_batch), written to seats.csv. The
+    result includes the errors of the tasks that failed.
+    """
+    n_rows = 0
+    errors = []
+    with open(context.get_path('seats.csv'), 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(batch.COLUMNS)
+        for row in batch.run_batch(elections, systems, levels, thresholds, threshold_countries, by_region, processes=1,
+                                   progress=context.progress, errors=errors):
+            writer.writerow(row)
+            n_rows += 1
+    return {'rows': n_rows, 'files': ['seats.csv'],
+            'errors': [{'task': list(task[:5]), 'error': message} for task, message in errors]}
+
+
+def run_export_job(context, elections, systems, levels, thresholds, threshold_countries=(False,), tables=tuple(export.TABLES),
+                   format='csv'):
+    """
+    Job of an export (see export.export), written to the directory of the job.
+    """
+    n_rows = export.export(context.directory, elections, systems, levels, thresholds, threshold_countries, tables, format,
+                           processes=1, progress=context.progress)
+    return {'rows': {os.path.basename(path): n for path, n in n_rows.items()},
+            'files': [os.path.basename(path) for path in n_rows]}
+
+
+def run_scenarios_job(context, scenarios):
+    """
+    Job of a long batch of the JSON API (see api.compute_scenario), whose
+    results are written to results.ndjson as in the response of the batch
+    endpoint.
+    """
+    # Imported here, since the API imports this module
+    import api
+
+    n_errors = 0
+    with open(context.get_path('results.ndjson'), 'w') as f:
+        for i, scenario in enumerate(scenarios):
+            result = scenario if 'error' in scenario else api.compute_scenario(scenario)
+            n_errors += 'error' in result
+            f.write(json.dumps(dict({'index': i}, **result)) + '\n')
+            context.progress(i + 1, len(scenarios))
+    return {'scenarios': len(scenarios), 'errors': n_errors, 'files': ['results.ndjson']}
+
+
+# Functions of every kind of job, called with a Job_Context and the parameters
+# of the job, that return its (JSON-serializable) result
+JOB_KINDS = {
+    'ensemble': run_ensemble_job,
+    'batch': run_batch_job,
+    'export': run_export_job,
+    'scenarios': run_scenarios_job,
+}
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def run_job(directory):
+    """
+    Run the job of the given directory (in a worker of the pool), updating its
+    status until it finishes.
+    """
+    context = Job_Context(directory, _read_json(os.path.join(directory, 'status.json')))
+    if context.is_cancelled():
+        context.update(state='cancelled', finished=time.time())
+        return
+    context.update(state='running', started=time.time(), pid=os.getpid())
+    try:
+        result = JOB_KINDS[context.status['kind']](context, **context.status['params'])
+    except Job_Cancelled:
+        context.update(state='cancelled', finished=time.time())
+    except Exception as e:
+        context.update(state='failed', error='{}: {}'.format(type(e).__name__, e), finished=time.time())
+    else:
+        _write_json(context.get_path('result.json'), result)
+        context.update(state='done', finished=time.time())
+
+
+class Job_Manager():
+    """
+    Queue of background jobs, run in a pool of processes and persisted in a
+    directory (see the documentation of the module).
+
+    ...
+    Attributes
+    ----------
+    directory: str
+        The directory of the jobs.
+    processes: int
+        The number of processes of the pool (0 to run the jobs in a thread of
+        the current process).
+
+    Methods
+    -------
+    submit(kind, params): str
+        Queue a job and return its id.
+    get_status(job_id): dict
+        Return the status of a job, or None if it doesn't exist.
+    get_result(job_id): dict
+        Return the result of a job, or None if it isn't done.
+    get_file(job_id, name): str
+        Return the path of a file written by a job, or None.
+    cancel(job_id): bool
+        Cancel a job, if it hasn't finished.
+    wait(job_id, timeout=None): dict
+        Wait until a job submitted by this manager finishes and return its
+        status.
+    shutdown()
+        Stop the pool, cancelling the queued jobs.
+    """
+    def __init__(self, directory=JOBS_DIR, processes=JOBS_PROCESSES):
+        self.directory = directory
+        self.processes = processes
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _get_directory(self, job_id):
+        if not isinstance(job_id, str) or not _JOB_ID.fullmatch(job_id):
+            return None
+        return os.path.join(self.directory, job_id)
+
+    def submit(self, kind, params):
+        if kind not in JOB_KINDS:
+            raise ValueError("Job kind '{}' does not exist. Choose one of: {}.".format(kind, ', '.join(JOB_KINDS)))
+        try:
+            inspect.signature(JOB_KINDS[kind]).bind(None, **params)
+        except TypeError as e:
+            raise ValueError("Invalid parameters of a job '{}': {}.".format(kind, e))
+        job_id = uuid.uuid4().hex
+        directory = self._get_directory(job_id)
+        os.makedirs(directory)
+        _write_json(os.path.join(directory, 'status.json'), {
+            'id': job_id, 'kind': kind, 'params': params, 'state': 'queued', 'done': 0, 'total': None, 'message': '',
+            'created': time.time(), 'started': None, 'finished': None, 'error': None, 'pid': None,
+        })
+        with self._lock:
+            # The pool is created with the first job, so that importing the
+            # app (e.g. in the gunicorn master) doesn't start any process
+            if self._executor is None:
+                self._executor = self._create_executor()
+            try:
+                future = self._executor.submit(run_job, directory)
+            except BrokenProcessPool:
+                # A worker died and _finish hasn't dropped the pool yet
+                self._executor = self._create_executor()
+                future = self._executor.submit(run_job, directory)
+            executor = self._executor
+            self._futures[job_id] = future
+        # Outside the lock, since the callback runs at once if the future is done
+        future.add_done_callback(functools.partial(self._finish, job_id, executor))
+        return job_id
+
+    def _create_executor(self):
+        if self.processes == 0:
+            return ThreadPoolExecutor(1)
+        return ProcessPoolExecutor(self.processes, mp_context=POOL_CONTEXT)
+
+    def _finish(self, job_id, executor, future):
+        """
+        Mark the job of a future that raised (i.e. whose worker died) as
+        failed, and drop its broken pool.
+        """
+        if future.cancelled() or future.exception() is None:
+            return
+        self._fail(job_id, future.exception())
+        if isinstance(future.exception(), BrokenProcessPool):
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+
+    def _fail(self, job_id, error):
+        status = _read_json(os.path.join(self._get_directory(job_id), 'status.json'))
+        if status is not None and status['state'] not in FINISHED_STATES:
+            status.update(state='failed', error='{}: {}'.format(type(error).__name__, error), finished=time.time())
+            _write_json(os.path.join(self._get_directory(job_id), 'status.json'), status)
+
+    def get_status(self, job_id):
+        directory = self._get_directory(job_id)
+        status = _read_json(os.path.join(directory, 'status.json')) if directory else None
+        if status is not None and status['state'] == 'running' and status.get('pid') and not _is_alive(status['pid']):
+            # The process running the job died without reporting it
+            self._fail(job_id, ProcessLookupError('The process running the job exited.'))
+            status = _read_json(os.path.join(directory, 'status.json'))
+        return status
+
+    def get_result(self, job_id):
+        directory = self._get_directory(job_id)
+        return _read_json(os.path.join(directory, 'result.json')) if directory else None
+
+    def get_file(self, job_id, name):
+        result = self.get_result(job_id)
+        if result is None or name not in result.get('files', []):
+            return None
+        return os.path.join(self._get_directory(job_id), name)
+
+    def cancel(self, job_id):
+        status = self.get_status(job_id)
+        if status is None or status['state'] in FINISHED_STATES:
+            return False
+        open(os.path.join(self._get_directory(job_id), 'cancel'), 'w').close()
+        future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            status.update(state='cancelled', finished=time.time())
+            _write_json(os.path.join(self._get_directory(job_id), 'status.json'), status)
+        return True
+
+    def wait(self, job_id, timeout=None):
+        future = self._futures[job_id]
+        if not future.cancelled():
+            try:
+                future.result(timeout)
+            except BrokenProcessPool as e:
+                # The done callback may not have run yet
+                self._fail(job_id, e)
+        return self.get_status(job_id)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                # Executor.shutdown(cancel_futures=True) needs Python 3.9
+                for job_id, future in self._futures.items():
+                    if future.cancel():
+                        directory = self._get_directory(job_id)
+                        status = _read_json(os.path.join(directory, 'status.json'))
+                        status.update(state='cancelled', finished=time.time())
+                        _write_json(os.path.join(directory, 'status.json'), status)
+                self._executor.shutdown(wait=False)
+                self._executor = None
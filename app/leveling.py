@@ -0,0 +1,198 @@
+from collections import Counter
+import copy
+import heapq
+import os
+import sys
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+import apportionment  # noqa: E402
+from electoral_systems import TWO_TIER_SYSTEMS  # noqa: E402
+
+COMPENSATORY_DIVISORS = {
+    'dHondt': apportionment.DIVISORS['Jefferson'],
+    'SL': apportionment.DIVISORS['Webster'],
+}
+
+
+def _n_leveling_seats(n_seats, leveling_seats):
+    # Every constituency keeps at least one constituency seat, so that the
+    # single-seat constituencies of MMP are still won by plurality
+    if leveling_seats < 1:
+        return min(int(n_seats * leveling_seats + 0.5), max(n_seats - 1, 0))
+    return min(int(leveling_seats), max(n_seats - 1, 0))
+
+
+def _get_eligible_parties(tier_region, n_seats, system, valid_parties):
+    if valid_parties is not None:
+        return [p for p, v in tier_region.votes.items() if p in valid_parties and v > 0]
+    if system.threshold == 'n/2s':
+        vote_threshold = tier_region.total_votes / (2*n_seats)
+    else:
+        vote_threshold = tier_region.total_votes * int(system.threshold) / 100
+    return [p for p, v in tier_region.votes.items() if v > vote_threshold]
+
+
+def get_entitlements(votes, constituency_seats, n_seats, eligible_parties, divisor, overhang):
+    """
+    Given the votes of a compensatory region, the constituency seats of every
+    party in it (collections.Counter) and its total number of seats, return a
+    dictionary with the total number of seats every party is entitled to.
+
+    Parties that are not eligible keep their constituency seats. With
+    overhang='exclude', parties that won more constituency seats than their
+    proportional share keep them and are excluded from the apportionment, which
+    is repeated with the remaining seats (as in the Nordic countries).
+    With overhang='balance', the number of seats is increased until no party
+    has overhang seats (as in Germany).
+    """
+    eligible_parties = [p for p in eligible_parties if votes.get(p, 0) > 0]
+    excluded = {p for p, s in constituency_seats.items() if s and p not in eligible_parties}
+    if overhang == 'exclude':
+        while True:
+            n_free_seats = n_seats - sum(constituency_seats[p] for p in excluded)
+            weights = {p: votes[p] for p in eligible_parties if p not in excluded}
+            entitlements = apportionment.divisor_method(weights, max(n_free_seats, 0), divisor)
+            overhang_parties = {p for p, s in entitlements.items() if s < constituency_seats[p]}
+            if not overhang_parties:
+                break
+            excluded |= overhang_parties
+    elif overhang == 'balance':
+        n_free_seats = max(n_seats - sum(constituency_seats[p] for p in excluded), 0)
+        weights = {p: votes[p] for p in eligible_parties}
+
+        def has_overhang(n):
+            return any(s < constituency_seats[p] for p, s in apportionment.divisor_method(weights, n, divisor).items())
+
+        # Divisor methods are house monotone, so the smallest chamber without
+        # overhang can be found with an exponential and a binary search
+        if has_overhang(n_free_seats):
+            low, high = n_free_seats, 2*n_free_seats + 1
+            while has_overhang(high):
+                low, high = high, 2*high
+            while high - low > 1:
+                middle = (low + high) // 2
+                if has_overhang(middle):
+                    low = middle
+                else:
+                    high = middle
+            n_free_seats = high
+        entitlements = apportionment.divisor_method(weights, n_free_seats, divisor)
+    else:
+        raise ValueError("Overhang handling must be 'exclude' or 'balance'.")
+
+    for p in excluded:
+        entitlements[p] = constituency_seats[p]
+    return entitlements
+
+
+def distribute_leveling_seats(constituencies, n_seats, result, leveling_seats, slots, divisor):
+    """
+    Assign the leveling seats of every party (a dictionary) to the given
+    constituencies, updating result (a dictionary whose keys are constituency
+    names and values are collections.Counter objects) in place.
+
+    Every seat goes to the constituency and party with the highest quotient
+    votes / divisor(seats), relative to the average number of votes per seat of
+    the constituency, while the constituency has free leveling slots. Slots are
+    ignored once all of them are taken (because of balance seats), or if the
+    remaining parties got no votes in the constituencies with free slots.
+    """
+    remaining = {p: s for p, s in leveling_seats.items() if s > 0}
+    free_slots = list(slots)
+    n_free_slots = sum(free_slots)
+
+    def quotient(i, p):
+        c = constituencies[i]
+        votes_per_seat = c.total_votes / n_seats[i] if n_seats[i] else c.total_votes
+        return c.votes[p] / divisor(result[c.name][p]) / (votes_per_seat or 1)
+
+    heap = [
+        (-quotient(i, p), i, p) for i, c in enumerate(constituencies)
+        for p in remaining if c.votes.get(p, 0) > 0
+    ]
+    heapq.heapify(heap)
+    postponed = []
+
+    def release_postponed():
+        nonlocal postponed
+        for j, q in postponed:
+            heapq.heappush(heap, (-quotient(j, q), j, q))
+        postponed = []
+
+    while remaining:
+        if not heap:
+            if not postponed:
+                break
+            n_free_slots = 0
+            release_postponed()
+        _, i, p = heapq.heappop(heap)
+        if p not in remaining:
+            continue
+        if free_slots[i] == 0 and n_free_slots > 0:
+            postponed.append((i, p))
+            continue
+
+        result[constituencies[i].name][p] += 1
+        remaining[p] -= 1
+        if remaining[p] == 0:
+            del remaining[p]
+        if free_slots[i] > 0:
+            free_slots[i] -= 1
+            n_free_slots -= 1
+            if n_free_slots == 0:
+                release_postponed()
+        heapq.heappush(heap, (-quotient(i, p), i, p))
+
+
+def compute_leveling_result(region, system, n_seats=None, valid_parties=None):
+    """
+    Given an Electoral_Region and a two-tier electoral_systems.System (see
+    electoral_systems.TWO_TIER_SYSTEMS), return a dictionary whose keys are the
+    names of the constituencies (regions of level system.level) and values are
+    collections.Counter objects with the constituency and leveling seats of
+    every party.
+
+    The constituency results are computed once, aggregated to every region of
+    level system.compensatory_level together with their votes, and reused to
+    compute the entitlements and to place the leveling seats.
+    If n_seats is given (a dictionary whose keys are constituency names and
+    values are their number of seats), it overrides the number of seats.
+
+    If the region is below system.compensatory_level (e.g. when showing the
+    tooltip of a province), the result is computed for the whole country and
+    only the constituencies of the region are returned.
+    """
+    if system.compensatory_level > system.level:
+        raise ValueError("The compensatory level can't be higher than the system level.")
+    if region.level > system.compensatory_level:
+        country_region = next(iter(region.election.regions[0].values()))
+        result = compute_leveling_result(country_region, system, n_seats, valid_parties)
+        return {c.name: result[c.name] for c in region.get_subregions(system.level)}
+    params = TWO_TIER_SYSTEMS[system.name]
+    divisor = COMPENSATORY_DIVISORS[params['compensatory_method']]
+
+    constituency_system = copy.copy(system)
+    constituency_system.name = params['constituency_method']
+    constituency_system.threshold = 0
+    constituency_system.threshold_country = False
+
+    result = {}
+    for tier_region in region.get_subregions(system.compensatory_level):
+        constituencies = tier_region.get_subregions(system.level)
+        tier_seats = [n_seats[c.name] if n_seats else c.n_seats for c in constituencies]
+        slots = [_n_leveling_seats(n, params['leveling_seats']) for n in tier_seats]
+
+        constituency_seats = Counter()
+        for c, n, n_slots in zip(constituencies, tier_seats, slots):
+            result[c.name] = Counter(c.compute_election_result(constituency_system, n_seats=n - n_slots))
+            constituency_seats.update(result[c.name])
+
+        eligible_parties = _get_eligible_parties(tier_region, sum(tier_seats), system, valid_parties)
+        entitlements = get_entitlements(tier_region.votes, constituency_seats, sum(tier_seats), eligible_parties,
+                                        divisor, params['overhang'])
+        leveling_seats = {p: s - constituency_seats[p] for p, s in entitlements.items()}
+        distribute_leveling_seats(constituencies, tier_seats, result, leveling_seats, slots, divisor)
+
+    return {name: Counter({p: s for p, s in seats.items() if s}) for name, seats in result.items()}
@@ -0,0 +1,477 @@
+"""
+Load test of the dashboard: start the app under gunicorn with every
+combination of the given numbers of workers and threads, replay a mix of Dash
+callback requests (POST /_dash-update-component) from concurrent virtual users,
+and report the throughput and the latency percentiles of every callback. e.g.
+
+    python -m app.loadtest --workers 1 2 4 --threads 1 4 --users 16 --duration 60 --output loadtest.json
+
+By default the traffic is synthetic: every virtual user picks a country
+(switch_country), changes the parameters of the sidebar (which triggers the
+callbacks of their results and update_figures, in the order of the Dash
+renderer) and hovers on several regions of the resulting map
+(display_tooltip). Real traffic
+can be recorded by starting the app with DASH_RECORD_FILE=requests.jsonl and
+replayed with --replay requests.jsonl. Use --url to test a running server
+instead of starting gunicorn.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+
+UPDATE_PATH = '/_dash-update-component'
+
+# Keys are callback names, values are one of their outputs
+CALLBACKS = {
+    'switch_country': 'dropdown-elections.options',
+    'update_districts': 'districts-store.data',
+    'compute_result_1': 'result-store-1.data',
+    'compute_result_2': 'result-store-2.data',
+    'update_figures': 'map.figure',
+    'display_tooltip': 'graph-tooltip.show',
+    'update_ensemble': 'ensemble-job.data',
+}
+
+# Inputs of the sidebar that a user changes before every update
+FIGURE_INPUTS = [
+    'dropdown-metrics.value', 'dropdown-system-name-1.value', 'dropdown-region-level-1.value', 'threshold-1.value',
+    'threshold-switch-1.on', 'dropdown-system-name-2.value', 'dropdown-region-level-2.value', 'threshold-2.value',
+    'threshold-switch-2.on', 'dropdown-elections.value',
+]
+
+
+def get_callback_name(output):
+    """
+    Return the name of the callback (a key of CALLBACKS) with the given output
+    string of the Dash dependencies, or the output itself if it is unknown.
+    """
+    for name, callback_output in CALLBACKS.items():
+        if callback_output in output.strip('.').split('...'):
+            return name
+    return output
+
+
+def install_recorder(server, path):
+    """
+    Append every callback request received by the Flask server to the file at
+    path, as a JSON line {"callback": name, "payload": request body}, so that
+    it can be replayed with --replay.
+    """
+    from flask import request
+    lock = threading.Lock()
+
+    @server.before_request
+    def record_request():
+        if request.path.endswith(UPDATE_PATH) and request.method == 'POST':
+            payload = request.get_json(silent=True)
+            if payload:
+                line = json.dumps({'callback': get_callback_name(payload.get('output', '')), 'payload': payload})
+                with lock:
+                    with open(path, 'a') as f:
+                        f.write(line + '\n')
+
+
+class Dash_Client():
+    """
+    HTTP client of a Dash app, keeping its connection alive between requests.
+    """
+    def __init__(self, url, timeout=120):
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.prefix = parsed.path.rstrip('/')
+        self.timeout = timeout
+        self._connection = None
+
+    def request(self, method, path, body=None):
+        """
+        Return the status, the decoded JSON body (None if it isn't JSON) and
+        the latency in seconds of a request.
+        """
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        data = json.dumps(body) if body is not None else None
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            start = time.perf_counter()
+            try:
+                self._connection.request(method, self.prefix + path, data, headers)
+                response = self._connection.getresponse()
+                content = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server may close idle keep-alive connections
+                self._connection.close()
+                self._connection = None
+                if attempt:
+                    raise
+        latency = time.perf_counter() - start
+        try:
+            content = json.loads(content)
+        except ValueError:
+            content = None
+        return response.status, content, latency
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+
+
+def get_layout_values(layout):
+    """
+    Return two dictionaries whose keys are 'id.property' strings: the values
+    of the properties of every component of a Dash layout (the JSON of
+    /_dash-layout) and the options of its dropdowns.
+    """
+    values, options = {}, {}
+    stack = [layout]
+    while stack:
+        component = stack.pop()
+        if isinstance(component, list):
+            stack.extend(component)
+        elif isinstance(component, dict) and 'props' in component:
+            props = component['props']
+            if 'id' in props:
+                for prop, value in props.items():
+                    values['{}.{}'.format(props['id'], prop)] = value
+                if 'options' in props:
+                    options['{}.value'.format(props['id'])] = [
+                        o['value'] if isinstance(o, dict) else o for o in props['options']
+                    ]
+            stack.extend(v for v in props.values() if isinstance(v, (list, dict)))
+    return values, options
+
+
+def build_payload(dependency, values, changed):
+    """
+    Return the body of the request of a callback, given its dependency (from
+    /_dash-dependencies), a dictionary with the current value of every
+    'id.property' and the list of the 'id.property' that triggered it.
+    """
+    def get_props(items):
+        return [dict(id=item['id'], property=item['property'], value=values.get('{}.{}'.format(item['id'], item['property'])))
+                for item in items]
+
+    output = dependency['output']
+    outputs = [dict(zip(['id', 'property'], o.rsplit('.', 1))) for o in output.strip('.').split('...')]
+    return {
+        'output': output,
+        'outputs': outputs if output.startswith('..') else outputs[0],
+        'inputs': get_props(dependency['inputs']),
+        'state': get_props(dependency['state']),
+        'changedPropIds': list(changed),
+    }
+
+
+def update_values(values, response):
+    """
+    Update the values of the components with the response of a callback.
+    Return the list of the 'id.property' that were updated.
+    """
+    if not response or 'response' not in response:
+        return []
+    updated = []
+    for component_id, props in response['response'].items():
+        for prop, value in props.items():
+            values['{}.{}'.format(component_id, prop)] = value
+            updated.append('{}.{}'.format(component_id, prop))
+    return updated
+
+
+def get_props(items):
+    return {'{}.{}'.format(item['id'], item['property']) for item in items}
+
+
+class Load_Stats():
+    """
+    Latencies and errors of the requests of every callback, shared by the
+    virtual users.
+    """
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def add(self, callback, latency, error=False):
+        with self._lock:
+            self.latencies.setdefault(callback, []).append(latency)
+            self.errors[callback] = self.errors.get(callback, 0) + int(error)
+
+    def get_summary(self, duration):
+        """
+        Return a dictionary whose keys are callback names (and 'all') and values
+        are dictionaries with the number of requests, errors, throughput
+        (requests per second) and latency statistics in milliseconds.
+        """
+        summary = {}
+        all_latencies = list(itertools.chain(*self.latencies.values()))
+        for callback, latencies in sorted(self.latencies.items()) + [('all', all_latencies)]:
+            latencies = np.array(latencies) * 1000
+            summary[callback] = {
+                'requests': len(latencies),
+                'errors': sum(self.errors.values()) if callback == 'all' else self.errors[callback],
+                'throughput': len(latencies) / duration,
+                'mean': float(latencies.mean()) if len(latencies) else None,
+                'p50': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'p95': float(np.percentile(latencies, 95)) if len(latencies) else None,
+                'p99': float(np.percentile(latencies, 99)) if len(latencies) else None,
+            }
+        return summary
+
+
+class Synthetic_User():
+    """
+    Virtual user that chooses a country, changes the parameters of the
+    dashboard and hovers on the map, like a real user.
+    """
+    def __init__(self, client, dependencies, layout, stats, hovers=10, switch_probability=0.1, seed=None):
+        self.client = client
+        self.callbacks = {get_callback_name(d['output']): d for d in dependencies}
+        self.values, self.options = get_layout_values(layout)
+        self.stats = stats
+        self.hovers = hovers
+        self.switch_probability = switch_probability
+        self.rng = random.Random(seed)
+
+    def call(self, callback, changed):
+        payload = build_payload(self.callbacks[callback], self.values, changed)
+        try:
+            status, response, latency = self.client.request('POST', UPDATE_PATH, payload)
+        except (OSError, http.client.HTTPException):
+            self.stats.add(callback, self.client.timeout, error=True)
+            return None
+        # Dash answers 204 when the callback doesn't update anything
+        self.stats.add(callback, latency, error=status not in (200, 204))
+        if status == 200:
+            update_values(self.values, response)
+            for prop, value in list(self.values.items()):
+                if prop.endswith('.options') and isinstance(value, list):
+                    self.options[prop[:-len('options')] + 'value'] = [o['value'] if isinstance(o, dict) else o for o in value]
+            return response
+
+    def call_chain(self, changed):
+        """
+        Call the callbacks triggered by the changed 'id.property', and those
+        triggered by their outputs, like the Dash renderer: a callback is only
+        called once the triggered callbacks that update its inputs are done.
+        Return a dictionary with the responses of every called callback.
+        """
+        changed, responses = set(changed), {}
+        while True:
+            triggered = {name: callback for name, callback in self.callbacks.items()
+                         if name not in responses and get_props(callback['inputs']) & changed}
+            pending_outputs = {name: set(callback['output'].strip('.').split('...')) for name, callback in triggered.items()}
+            ready = [name for name, callback in triggered.items()
+                     if not any(get_props(callback['inputs']) & outputs for other, outputs in pending_outputs.items() if other != name)]
+            if not ready:
+                return responses
+            for name in ready:
+                responses[name] = self.call(name, sorted(get_props(self.callbacks[name]['inputs']) & changed))
+                changed.update(update_values({}, responses[name]))
+
+    def run_session(self):
+        """
+        Switch country (sometimes), update the figures and hover on the map.
+        """
+        if self.rng.random() < self.switch_probability and 'switch_country' in self.callbacks:
+            self.values['dropdown-countries.value'] = self.rng.choice(self.options['dropdown-countries.value'])
+            self.call_chain(['dropdown-countries.value'])
+
+        changed = self.rng.sample(FIGURE_INPUTS, self.rng.randint(1, 3))
+        for prop in changed:
+            if prop.endswith('.on'):
+                self.values[prop] = not self.values.get(prop)
+            elif self.options.get(prop):
+                self.values[prop] = self.rng.choice(self.options[prop])
+        if self.values.get('dropdown-metrics.value') == 'System Comparison':
+            self.values['dropdown-comparison-systems.value'] = self.rng.sample(
+                self.options['dropdown-comparison-systems.value'], self.rng.randint(2, 4))
+        self.call_chain(changed)
+        figure = self.values.get('map.figure')
+        if not figure:
+            return
+
+        locations = figure['data'][0].get('locations') or []
+        for _ in range(self.hovers if locations else 0):
+            location = self.rng.choice(locations)
+            self.values['map.hoverData'] = {'points': [{
+                'curveNumber': 0, 'pointNumber': locations.index(location), 'location': location,
+                'bbox': {'x0': 100, 'x1': 110, 'y0': 100, 'y1': 110},
+            }]}
+            self.call('display_tooltip', ['map.hoverData'])
+
+    def run(self, deadline):
+        # Load the page: the callbacks whose inputs are set in the layout, and those triggered by their outputs
+        self.call_chain(set(self.values))
+        while time.monotonic() < deadline:
+            self.run_session()
+
+
+def run_load(url, users=8, duration=30, hovers=10, switch_probability=0.1, replay=None, seed=0):
+    """
+    Send requests to the Dash app at url from the given number of concurrent
+    virtual users for duration seconds, either synthetic ones (see
+    Synthetic_User) or replaying the requests of the JSON lines file replay in
+    order (until it is exhausted or the time is over).
+    Return the summary of the latencies (see Load_Stats.get_summary).
+    """
+    stats = Load_Stats()
+    client = Dash_Client(url)
+    _, dependencies, _ = client.request('GET', '/_dash-dependencies')
+    _, layout, _ = client.request('GET', '/_dash-layout')
+    client.close()
+
+    if replay:
+        with open(replay) as f:
+            lines = iter([json.loads(line) for line in f if line.strip()])
+        lock = threading.Lock()
+
+        def run_user(i, deadline):
+            client = Dash_Client(url)
+            while time.monotonic() < deadline:
+                with lock:
+                    line = next(lines, None)
+                if line is None:
+                    break
+                try:
+                    status, _, latency = client.request('POST', UPDATE_PATH, line['payload'])
+                    stats.add(line['callback'], latency, error=status not in (200, 204))
+                except (OSError, http.client.HTTPException):
+                    stats.add(line['callback'], client.timeout, error=True)
+            client.close()
+    else:
+        def run_user(i, deadline):
+            client = Dash_Client(url)
+            Synthetic_User(client, dependencies, layout, stats, hovers, switch_probability, seed=seed + i).run(deadline)
+            client.close()
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=run_user, args=(i, start + duration)) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats.get_summary(time.monotonic() - start)
+
+
+def start_server(app='main:server', workers=1, threads=1, port=8050, env=None, startup_timeout=600):
+    """
+    Start the app under gunicorn (with gunicorn_config.py) and wait until it
+    answers. Return the process and the startup time in seconds.
+
+    The log of gunicorn goes to a temporary file (process.log) rather than a
+    pipe, which would fill up and block the server if it was not read.
+    """
+    env = dict(os.environ, GUNICORN_WORKERS=str(workers), GUNICORN_THREADS=str(threads),
+               GUNICORN_BIND='127.0.0.1:{}'.format(port), **(env or {}))
+    command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(myPath, 'gunicorn_config.py'), app]
+    log = tempfile.TemporaryFile('w+')
+    process = subprocess.Popen(command, cwd=myPath, env=env, stdout=subprocess.DEVNULL, stderr=log, text=True)
+    process.log = log
+    start = time.monotonic()
+    client = Dash_Client('http://127.0.0.1:{}'.format(port), timeout=10)
+    while time.monotonic() - start < startup_timeout:
+        if process.poll() is not None:
+            log.seek(0)
+            message = log.read()[-2000:]
+            log.close()
+            raise RuntimeError("gunicorn exited:\n" + message)
+        try:
+            if client.request('GET', '/_dash-dependencies')[0] == 200:
+                client.close()
+                return process, time.monotonic() - start
+        except OSError:
+            time.sleep(0.5)
+    stop_server(process)
+    raise RuntimeError("The app did not start in {} seconds.".format(startup_timeout))
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    process.log.close()
+
+
+def format_summary(summary):
+    lines = ['{:<18} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9}'.format('Callback', 'Requests', 'Errors', 'Req/s', 'p50 ms', 'p95 ms', 'p99 ms')]
+    for callback, s in summary.items():
+        lines.append('{:<18} {:>9} {:>7} {:>9.1f} {:>9} {:>9} {:>9}'.format(
+            callback, s['requests'], s['errors'], s['throughput'],
+            *['{:.1f}'.format(s[p]) if s[p] is not None else '-' for p in ['p50', 'p95', 'p99']]))
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.loadtest', description=__doc__.split('e.g.')[0].strip())
+    parser.add_argument('--workers', nargs='+', type=int, default=[1], help="Numbers of gunicorn workers to test")
+    parser.add_argument('--threads', nargs='+', type=int, default=[1], help="Numbers of threads per worker to test")
+    parser.add_argument('--env', nargs='+', default=[], metavar='KEY=VALUE',
+                        help="Environment variables of the app (e.g. cache sizes); several values of the same key are tested in turn")
+    parser.add_argument('--users', type=int, default=8, help="Number of concurrent virtual users")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds of load for every configuration")
+    parser.add_argument('--hovers', type=int, default=10, help="Tooltips per figure update of the synthetic users")
+    parser.add_argument('--switch-probability', type=float, default=0.1, help="Probability of switching country before an update")
+    parser.add_argument('--replay', default=None, help="JSON lines file of recorded requests (see DASH_RECORD_FILE)")
+    parser.add_argument('--app', default='main:server', help="WSGI application of gunicorn (default: main:server)")
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--url', default=None, help="Test the server at this URL instead of starting gunicorn")
+    parser.add_argument('--output', default=None, help="JSON file of the report")
+    return parser.parse_args(argv)
+
+
+def get_env_grid(env_args):
+    """
+    Return the list of combinations of the environment variables given as
+    KEY=VALUE strings (repeated keys are alternatives).
+    """
+    options = {}
+    for item in env_args:
+        key, _, value = item.partition('=')
+        options.setdefault(key, []).append(value)
+    return [dict(zip(options, values)) for values in itertools.product(*options.values())]
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_args = dict(users=args.users, duration=args.duration, hovers=args.hovers,
+                     switch_probability=args.switch_probability, replay=args.replay)
+    report = []
+    if args.url:
+        summary = run_load(args.url, **load_args)
+        print(format_summary(summary))
+        report.append({'url': args.url, 'summary': summary})
+    else:
+        for workers, threads, env in itertools.product(args.workers, args.threads, get_env_grid(args.env)):
+            process, startup_time = start_server(args.app, workers, threads, args.port, env)
+            try:
+                summary = run_load('http://127.0.0.1:{}'.format(args.port), **load_args)
+            finally:
+                stop_server(process)
+            print('\nworkers={} threads={} {}(startup {:.1f}s)'.format(
+                workers, threads, ''.join('{}={} '.format(k, v) for k, v in env.items()), startup_time))
+            print(format_summary(summary))
+            report.append({'workers': workers, 'threads': threads, 'env': env, 'startup_time': startup_time, 'summary': summary})
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'runs': report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
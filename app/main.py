@@ -1,11 +1,24 @@
-from dash import Dash, html, dcc, no_update, Input, Output, State
+from dash import Dash, callback_context, html, dcc, no_update, Input, Output, State
 import dash_bootstrap_components as dbc
 from dash_daq import BooleanSwitch
+import json
+import os
 
 # Custom modules
+import api
+import comparisons
 import countries
 import elections
 import electoral_systems
+import groupings
+import jobs
+import loadtest
+import memory
+import metrics
+import profiling
+import regions
+import telemetry
+import tooltips
 
 # Read the markdown files
 with open('texts/about.md', 'r') as file:
@@ -15,7 +28,11 @@ with open('texts/country_election_metric.md', 'r') as file:
 with open('texts/electoral_systems.md', 'r') as file:
     systems_md = file.read()
 
-# initialize all the elections so that all the data loading is done when starting the app
+# The most recently used USA elections kept in memory (see elections.Lazy_Elections)
+USA_MAX_LOADED = int(os.environ.get('USA_MAX_LOADED', 4))
+
+# initialize all the elections so that all the data loading is done when starting the app,
+# except those of the USA, which are loaded the first time they are selected
 ELECTIONS = {
     'Costa Rica': {
         '2018': elections.Costa_Rica_2018(),
@@ -30,14 +47,74 @@ ELECTIONS = {
         '2004-03-14': elections.Spain_2004_03(),
         '2000-03-12': elections.Spain_2000_03(),
     },
-    'USA': {
-        '2020': elections.USA_2020()
-    }
+    'USA': elections.Lazy_Elections(
+        {str(year): getattr(elections, 'USA_{}'.format(year)) for year in elections.get_usa_years()},
+        max_loaded=USA_MAX_LOADED,
+    ),
 }
 
+# Build what the elections otherwise build on first use, so that a preloaded app
+# shares it with all its workers (see gunicorn_config.py)
+for country_elections in ELECTIONS.values():
+    for election in getattr(country_elections, 'loaded', country_elections).values():
+        election.warm_up()
+
+# Tooltip data of the most recently rendered configurations (see tooltips.py)
+TOOLTIPS = tooltips.Tooltip_Cache()
+
+# Background jobs of the dashboard and the API (see jobs.py)
+JOBS = jobs.Job_Manager()
+
+
+def get_tooltip_key(country, election_date, system_1, system_2, groups):
+    """
+    Return the key of the TOOLTIPS of a configuration, given the parameters
+    of its systems as tuples (name, level, threshold, threshold_country), the
+    second one being None unless the seat difference is shown.
+    """
+    return country, election_date, system_1, system_2, json.dumps(groups, sort_keys=True) if groups else None
+
+
+def compute_tooltip_data(election, system_1, system_2, groups):
+    """
+    Return the tooltip data of a configuration (see get_tooltip_key), when it
+    isn't in TOOLTIPS (e.g. it was rendered by another worker process).
+    """
+    grouping = groupings.District_Grouping(election, groups) if groups else None
+    region = grouping.get_region() if grouping else next(iter(election.regions[0].values()))
+
+    def compute_result(params):
+        system = electoral_systems.System(*params)
+        return grouping.compute_result(system) if grouping else region.compute_result(system)
+
+    return tooltips.get_tooltip_data(compute_result(system_1), compute_result(system_2) if system_2 else None, grouping)
+
+
+def get_comparison_systems(system_names, level, threshold, threshold_country):
+    """
+    Return the systems compared by the 'System Comparison' metric: all the
+    given system names, with the level and threshold of system 1.
+    """
+    return [electoral_systems.System(name, level, threshold, threshold_country) for name in system_names]
+
+
+def get_comparison_tooltip_key(country, election_date, system_names, level, threshold, threshold_country):
+    """
+    Return the key of the TOOLTIPS of a 'System Comparison' (see
+    get_comparison_systems).
+    """
+    return country, election_date, 'System Comparison', tuple(system_names), level, threshold, threshold_country
+
+
 # Initialize the app
 app = Dash(__name__, external_stylesheets=[dbc.themes.LUMEN])
 server = app.server  # Necessary for deployment on DigitalOcean
+server.register_blueprint(api.create_api(ELECTIONS, jobs=JOBS))
+countries.install(server)  # Geojson files of the maps at /geojson
+telemetry.install(server)  # Prometheus metrics at /metrics
+memory.install(server, ELECTIONS)  # Memory report at /admin/memory, if MEMORY_ADMIN_TOKEN is set
+if os.environ.get('DASH_RECORD_FILE'):  # Record the callback requests to replay them with loadtest.py
+    loadtest.install_recorder(server, os.environ['DASH_RECORD_FILE'])
 
 ##############
 #   LAYOUT   #
@@ -70,13 +147,35 @@ dropdown_metrics = dcc.Dropdown(
     options=[
         {'label': 'Seat Difference', 'value': 'Seat Difference'},
         {'label': 'Lost Votes', 'value': 'Lost Votes'},
-    ],
+        {'label': 'System Comparison', 'value': 'System Comparison'},
+    ] + [{'label': metric, 'value': metric} for metric in metrics.METRIC_NAMES],
     value='Seat Difference',
     placeholder='Metric',
     style={'font-size': '20px', 'margin-top': '5px'},
     clearable=False,
 )
 
+dropdown_comparison_systems = dcc.Dropdown(
+    id="dropdown-comparison-systems",
+    options=[
+        {'label': "d'Hondt", 'value': 'dHondt'},
+        {'label': "Sainte-Laguë", 'value': 'SL'},
+        {'label': "Winner Takes All", 'value': "Winner Takes All"},
+        {'label': "LRM (Hare Quota)", 'value': 'LRM-Hare'},
+        {'label': "LRM (Droop Quota)", 'value': 'LRM-Droop'},
+        {'label': "LRM (Hagenbach-Bischoff Quota)", 'value': 'LRM-HB'},
+        {'label': "LRM (Imperiali Quota)", 'value': 'LRM-Imperiali'},
+        {'label': "STV (Droop Quota)", 'value': 'STV'},
+        {'label': "MMP (Mixed-Member)", 'value': 'MMP'},
+        {'label': "Nordic Leveling Seats", 'value': 'Leveling Seats'},
+        {'label': "Biproportional (Pukelsheim)", 'value': 'Biproportional'},
+    ],
+    value=electoral_systems.SYSTEM_NAMES,
+    multi=True,
+    placeholder='Methods to compare',
+    style={'font-size': '16px', 'margin-top': '5px'},
+)
+
 # BUTTONS
 about_button = html.Div(
     [
@@ -133,6 +232,10 @@ system_1_dropdown = dcc.Dropdown(
         {'label': "LRM (Droop Quota)", 'value': 'LRM-Droop'},
         {'label': "LRM (Hagenbach-Bischoff Quota)", 'value': 'LRM-HB'},
         {'label': "LRM (Imperiali Quota)", 'value': 'LRM-Imperiali'},
+        {'label': "STV (Droop Quota)", 'value': 'STV'},
+        {'label': "MMP (Mixed-Member)", 'value': 'MMP'},
+        {'label': "Nordic Leveling Seats", 'value': 'Leveling Seats'},
+        {'label': "Biproportional (Pukelsheim)", 'value': 'Biproportional'},
     ],
     placeholder='System 1',
     value='dHondt',
@@ -197,6 +300,10 @@ system_2_dropdown = dcc.Dropdown(
         {'label': "LRM (Droop Quota)", 'value': 'LRM-Droop'},
         {'label': "LRM (Hagenbach-Bischoff Quota)", 'value': 'LRM-HB'},
         {'label': "LRM (Imperiali Quota)", 'value': 'LRM-Imperiali'},
+        {'label': "STV (Droop Quota)", 'value': 'STV'},
+        {'label': "MMP (Mixed-Member)", 'value': 'MMP'},
+        {'label': "Nordic Leveling Seats", 'value': 'Leveling Seats'},
+        {'label': "Biproportional (Pukelsheim)", 'value': 'Biproportional'},
     ],
     placeholder='System 2',
     value='SL',
@@ -248,6 +355,40 @@ system_2_group = html.Div([
     system_2_threshold,
 ])
 
+districts_group = html.Div([
+    html.P('Custom Districts', style={'font-size': '20px'}),
+    dcc.Textarea(
+        id='districts-text',
+        value='',
+        placeholder='Galicia: A Coruña, Lugo, Ourense, Pontevedra',
+        style={'width': '100%', 'height': '80px', 'font-size': '14px'},
+    ),
+    dbc.Button("Apply", id="districts-button", n_clicks=0, color='primary', size='sm'),
+    dcc.Store(id='districts-store'),
+    # The results of both systems (see regions.Election_Result.to_dict), so
+    # that only the system that changes is recomputed
+    dcc.Store(id='result-store-1'),
+    dcc.Store(id='result-store-2'),
+])
+
+ensemble_group = html.Div([
+    html.P('Redistricting Ensemble', style={'font-size': '20px'}),
+    dbc.Row([
+        dbc.Col(dcc.Input(id='ensemble-districts', type='number', min=1, step=1, value=10, placeholder='Districts',
+                          style={'width': '100%'}), width=6),
+        dbc.Col(dcc.Input(id='ensemble-plans', type='number', min=1, step=1, value=1000, placeholder='Plans',
+                          style={'width': '100%'}), width=6),
+    ]),
+    dbc.Button("Run", id="ensemble-button", n_clicks=0, color='primary', size='sm', style={'margin-top': '5px'}),
+    dbc.Button("Cancel", id="ensemble-cancel-button", n_clicks=0, color='secondary', size='sm',
+               style={'margin-top': '5px', 'margin-left': '5px'}),
+    dbc.Progress(id='ensemble-progress', value=0, style={'margin-top': '5px'}),
+    html.P('', id='ensemble-text', style={'font-size': '14px', 'white-space': 'pre-line'}),
+    # The id of the job (see jobs.py), polled while it runs
+    dcc.Store(id='ensemble-job'),
+    dcc.Interval(id='ensemble-interval', interval=1000, disabled=True),
+])
+
 system_unselected_color = '#F4CCCC'
 
 # GRAPHS
@@ -297,10 +438,15 @@ sidebar = html.Div(
         dropdown_countries,
         dropdown_elections,
         dropdown_metrics,
+        dropdown_comparison_systems,
         html.Hr(),
         system_1_group,
         html.Br(),
         system_2_group,
+        html.Br(),
+        districts_group,
+        html.Br(),
+        ensemble_group,
         html.Hr(),
         html.H3("", id='extra-text-title'),
         html.P("", id='extra-text', style={'font-size': '25px'}),
@@ -331,8 +477,10 @@ print("Everything is loaded!")
     Output('dropdown-region-level-1', 'value'),
     Output('dropdown-region-level-2', 'options'),
     Output('dropdown-region-level-2', 'value'),
+    Output('districts-text', 'value'),
     Input('dropdown-countries', 'value'),
 )
+@telemetry.instrument_callback
 def switch_country(country):
     """
     Update the election options whenever the selected country changes.
@@ -368,10 +516,8 @@ def switch_country(country):
         ]
         level_value = 2
     elif country == 'USA':
-        election_options = [
-            {'label': '2020', 'value': '2020'},
-        ]
-        election_value = '2020'
+        election_options = [{'label': date, 'value': date} for date in ELECTIONS['USA']]
+        election_value = election_options[0]['value']
 
         level_options = [
             {'label': '0: Country', 'value': 0},
@@ -379,7 +525,7 @@ def switch_country(country):
             {'label': '2: District', 'value': 2},
         ]
         level_value = 2
-    return election_options, election_value, level_options, level_value, level_options, max(0, level_value-1)
+    return election_options, election_value, level_options, level_value, level_options, max(0, level_value-1), ''
 
 
 @app.callback(
@@ -415,6 +561,100 @@ def toggle_systems_modal(n1, is_open):
     return is_open
 
 
+def get_grouping(election, groups):
+    """
+    Return the groupings.District_Grouping of the groups of districts-store,
+    or None.
+    """
+    return groupings.District_Grouping(election, groups) if groups else None
+
+
+def compute_system_result(country, election_date, groups, system):
+    """
+    Return the regions.Election_Result of a system in the regions of the
+    election, or in the custom districts if there are groups.
+    """
+    election = ELECTIONS[country][election_date]
+    grouping = get_grouping(election, groups)
+    if grouping:
+        return grouping.compute_result(system)
+    return next(iter(election.regions[0].values())).compute_result(system)
+
+
+@app.callback(
+    Output('districts-store', 'data'),
+    Output('extra-text-title', 'children'),
+    Output('extra-text', 'children'),
+    Input('districts-button', 'n_clicks'),
+    Input('dropdown-elections', 'value'),
+    State('districts-text', 'value'),
+    State('dropdown-countries', 'value'),
+)
+@telemetry.instrument_callback
+def update_districts(districts_clicks, election_date, districts_text, country):
+    """
+    Dash callback to apply the custom districts, whenever the button is
+    clicked or the election changes.
+
+    The districts are parsed and checked against the regions of the election,
+    and stored in districts-store (None if there are none or they are
+    invalid).
+    """
+    if not districts_text or not districts_text.strip():
+        return None, '', ''
+    try:
+        groups = groupings.parse_groups(districts_text)
+        grouping = groupings.District_Grouping(ELECTIONS[country][election_date], groups)
+    except ValueError as e:
+        return None, 'Custom Districts', str(e)
+    return groups, 'Custom Districts', '{} districts'.format(len(grouping.district_names))
+
+
+@app.callback(
+    Output('result-store-1', 'data'),
+    Input('dropdown-system-name-1', 'value'),
+    Input('dropdown-region-level-1', 'value'),
+    Input('threshold-1', 'value'),
+    Input('threshold-switch-1', 'on'),
+    Input('dropdown-elections', 'value'),
+    Input('districts-store', 'data'),
+    State('dropdown-countries', 'value'),
+)
+@telemetry.instrument_callback
+def compute_result_1(system_name, level, threshold, threshold_country, election_date, groups, country):
+    """
+    Dash callback to compute the result of system 1 whenever any of its
+    parameters, the election or the custom districts change, and store it in
+    result-store-1.
+    """
+    system = electoral_systems.System(system_name, level, threshold, threshold_country)
+    return compute_system_result(country, election_date, groups, system).to_dict()
+
+
+@app.callback(
+    Output('result-store-2', 'data'),
+    Input('dropdown-system-name-2', 'value'),
+    Input('dropdown-region-level-2', 'value'),
+    Input('threshold-2', 'value'),
+    Input('threshold-switch-2', 'on'),
+    Input('dropdown-elections', 'value'),
+    Input('districts-store', 'data'),
+    Input("dropdown-metrics", "value"),
+    State('dropdown-countries', 'value'),
+)
+@telemetry.instrument_callback
+def compute_result_2(system_name, level, threshold, threshold_country, election_date, groups, metric, country):
+    """
+    Dash callback to compute the result of system 2 and store it in
+    result-store-2. It is only needed to show the seat difference, so it isn't
+    computed (nor are the figures updated) with the other metrics.
+    """
+    if metric != 'Seat Difference':
+        return no_update
+    system = electoral_systems.System(system_name, level, threshold, threshold_country)
+    return compute_system_result(country, election_date, groups, system).to_dict()
+
+
 @app.callback(
     Output('map', 'figure'),
     Output('chart', 'figure'),
@@ -425,45 +665,66 @@ def toggle_systems_modal(n1, is_open):
     Output('dropdown-system-name-2', 'style'),
     Output('dropdown-region-level-2', 'style'),
     Output('threshold-2', 'style'),
+    Output('dropdown-comparison-systems', 'disabled'),
     Input("dropdown-metrics", "value"),
-    Input('dropdown-system-name-1', 'value'),
-    Input('dropdown-region-level-1', 'value'),
-    Input('threshold-1', 'value'),
-    Input('threshold-switch-1', 'on'),
-    Input('dropdown-system-name-2', 'value'),
-    Input('dropdown-region-level-2', 'value'),
-    Input('threshold-2', 'value'),
-    Input('threshold-switch-2', 'on'),
-    Input('dropdown-elections', 'value'),
+    Input('result-store-1', 'data'),
+    Input('result-store-2', 'data'),
+    Input('dropdown-comparison-systems', 'value'),
+    State('dropdown-system-name-1', 'value'),
+    State('dropdown-region-level-1', 'value'),
+    State('threshold-1', 'value'),
+    State('threshold-switch-1', 'on'),
+    State('dropdown-system-name-2', 'value'),
+    State('dropdown-region-level-2', 'value'),
+    State('threshold-2', 'value'),
+    State('threshold-switch-2', 'on'),
+    State('dropdown-elections', 'value'),
+    State('districts-store', 'data'),
     State('dropdown-countries', 'value'),
 )
-def update_figures(metric, system_name_1, level_1, threshold_1, threshold_1_country,
-                   system_name_2, level_2, threshold_2, threshold_2_country, election_date,
-                   country):
+@telemetry.instrument_callback
+def update_figures(metric, result_data_1, result_data_2, comparison_system_names, system_name_1, level_1,
+                   threshold_1, threshold_1_country, system_name_2, level_2, threshold_2, threshold_2_country,
+                   election_date, groups, country):
     """
     Dash callback to display the figures according to the parameters specified
     by the user.
 
     The callback is triggered whenever the metric to be displayed is modified,
-    or whenever any parameter either in system 1 or system 2 changes.
+    or whenever the stored result of system 1 or system 2 changes (see
+    compute_result_1 and compute_result_2), so the result of the system that
+    didn't change isn't recomputed.
     This callbacks modifies all three figures of the dashboard: The bar chart,
     the pie chart and the map.
+    If custom districts are applied, both systems are computed on the districts
+    instead of the regions of the selected levels.
+    The 'System Comparison' metric compares all the selected methods, using the
+    level and threshold of system 1, on the regions of the election.
+    The proportionality metrics (metrics.METRIC_NAMES) are computed for system 1
+    on the regions of the election.
     """
+    if result_data_1 is None or (metric == 'Seat Difference' and result_data_2 is None):
+        # The stored results aren't computed yet
+        return [no_update] * 10
     election = ELECTIONS[country][election_date]
-    regions = election.regions
-    country_region = next(iter(regions[0].values()))
+    grouping = get_grouping(election, groups)
+    region = grouping.get_region() if grouping else next(iter(election.regions[0].values()))
+
+    def get_map_plot(result, other=None):
+        if grouping:
+            return grouping.get_map_plot(result, other=other)
+        return result.get_map_plot(other=other)
 
     system_1 = electoral_systems.System(system_name_1, level_1, threshold_1, threshold_1_country)
-    result_1 = country_region.compute_result(system_1)
+    result_1 = regions.Election_Result.from_dict(region, result_data_1)
 
     if metric == 'Seat Difference':
         disable = False
         dropdown_style = {'font-size': '20px', 'margin-top': '5px'}
 
-        system_2 = electoral_systems.System(system_name_2, level_2, threshold_2, threshold_2_country)
-        result_2 = country_region.compute_result(system_2)
+        result_2 = regions.Election_Result.from_dict(region, result_data_2)
 
-        map = result_1.get_map_plot(other=result_2)
+        map = get_map_plot(result_1, other=result_2)
         pie = result_1.get_piechart_plot(other=result_2)
         bar = result_1.get_bar_plot(metric, other=result_2)
 
@@ -471,14 +732,45 @@ def update_figures(metric, system_name_1, level_1, threshold_1, threshold_1_coun
         disable = True
         dropdown_style = {'font-size': '20px', 'margin-top': '5px', 'backgroundColor': system_unselected_color}
 
-        map = result_1.get_map_plot()
+        map = get_map_plot(result_1)
         pie = result_1.get_piechart_plot()
         bar = result_1.get_bar_plot(metric)
 
+    elif metric == 'System Comparison':
+        disable = True
+        dropdown_style = {'font-size': '20px', 'margin-top': '5px', 'backgroundColor': system_unselected_color}
+
+        system_names = comparison_system_names or [system_name_1]
+        comparison = comparisons.Comparison_Matrix(
+            election, get_comparison_systems(system_names, level_1, threshold_1, threshold_1_country))
+        key = get_comparison_tooltip_key(country, election_date, system_names, level_1, threshold_1, threshold_1_country)
+        TOOLTIPS.put(key, comparison.get_tooltip_data())
+
+        map = comparison.get_map_plot()
+        pie = result_1.get_piechart_plot()
+        bar = comparison.get_heatmap_plot()
+
+    elif metric in metrics.METRIC_NAMES:
+        disable = True
+        dropdown_style = {'font-size': '20px', 'margin-top': '5px', 'backgroundColor': system_unselected_color}
+
+        election_metrics = metrics.Election_Metrics(election, system_1)
+
+        map = election_metrics.get_map_plot(metric)
+        pie = result_1.get_piechart_plot()
+        bar = election_metrics.get_bar_plot(metric)
+
     else:
         raise ValueError("You got the metric name wrong!")
 
-    return map, bar, pie, disable, disable, disable, dropdown_style, dropdown_style, dropdown_style
+    if metric != 'System Comparison':
+        # The tooltips of all the regions, so that hovering is just a lookup
+        system_2_params = (system_name_2, level_2, threshold_2, threshold_2_country) if metric == 'Seat Difference' else None
+        key = get_tooltip_key(country, election_date, (system_name_1, level_1, threshold_1, threshold_1_country), system_2_params, groups)
+        TOOLTIPS.put(key, tooltips.get_tooltip_data(result_1, result_2 if system_2_params else None, grouping))
+
+    return (map, bar, pie, disable, disable, disable, dropdown_style, dropdown_style, dropdown_style,
+            metric != 'System Comparison')
 
 
 @app.callback(
@@ -497,10 +789,13 @@ def update_figures(metric, system_name_1, level_1, threshold_1, threshold_1_coun
     State('dropdown-region-level-2', 'value'),
     State('threshold-2', 'value'),
     State('threshold-switch-2', 'on'),
+    State('districts-store', 'data'),
+    State('dropdown-comparison-systems', 'value'),
 )
+@telemetry.instrument_callback
 def display_tooltip(hoverData, country, election_date, metric, system_name_1, level_1,
                     threshold_1, threshold_country_1, system_name_2, level_2,
-                    threshold_2, threshold_country_2):
+                    threshold_2, threshold_country_2, groups, comparison_system_names):
     """
     Dash callback to display a tooltip when the user hovers on the map regions.
 
@@ -515,25 +810,108 @@ def display_tooltip(hoverData, country, election_date, metric, system_name_1, le
 
     election = ELECTIONS[country][election_date]
 
-    if metric == 'Seat Difference':
-        level = min(level_1, level_2)
+    # The tooltips are computed by update_figures, unless they aren't cached
+    if metric == 'System Comparison':
+        system_names = comparison_system_names or [system_name_1]
+        key = get_comparison_tooltip_key(country, election_date, system_names, level_1, threshold_1, threshold_country_1)
+        tooltip_data = TOOLTIPS.get(key)
+        if tooltip_data is None:
+            systems = get_comparison_systems(system_names, level_1, threshold_1, threshold_country_1)
+            tooltip_data = comparisons.Comparison_Matrix(election, systems).get_tooltip_data()
+            TOOLTIPS.put(key, tooltip_data)
     else:
-        level = level_1
-    region = election.get_region(level, region_name)
+        if metric == 'Seat Difference':
+            system_2 = (system_name_2, level_2, threshold_2, threshold_country_2)
+        elif metric == 'Lost Votes' or metric in metrics.METRIC_NAMES:
+            system_2 = None
+        else:
+            raise ValueError("You got the metric name wrong!")
+
+        system_1 = (system_name_1, level_1, threshold_1, threshold_country_1)
+        key = get_tooltip_key(country, election_date, system_1, system_2, groups)
+        tooltip_data = TOOLTIPS.get(key)
+        if tooltip_data is None:
+            tooltip_data = compute_tooltip_data(election, system_1, system_2, groups)
+            TOOLTIPS.put(key, tooltip_data)
+    if region_name not in tooltip_data:
+        return False, no_update, no_update
+    tooltip = tooltips.plot_tooltip(tooltip_data[region_name], election.colors)
+    return True, bbox, dcc.Graph(figure=tooltip)
 
-    system_1 = electoral_systems.System(system_name_1, level_1, threshold_1, threshold_country_1)
-    result_1 = region.compute_result(system_1)
 
-    if metric == 'Seat Difference':
-        system_2 = electoral_systems.System(system_name_2, level_2, threshold_2, threshold_country_2)
-        result_2 = region.compute_result(system_2)
-        tooltip = result_1.plot_tooltip(other=result_2)
-    elif metric == 'Lost Votes':
-        tooltip = result_1.plot_tooltip()
-    else:
-        raise ValueError("You got the metric name wrong!")
+def get_ensemble_text(status, result):
+    """
+    Return the text of the ensemble-text of a job, given its status and its
+    result (None unless it is done).
+    """
+    if status['state'] == 'failed':
+        return 'Failed: {}'.format(status['error'])
+    if status['state'] != 'done':
+        return status['state'].capitalize()
+    summary = sorted(result['summary'].items(), key=lambda x: -x[1]['mean'])
+    return 'Acceptance rate: {:.0%}\n'.format(result['acceptance_rate']) + '\n'.join(
+        '{}: {:.1f} ({}-{})'.format(party, seats['mean'], seats['min'], seats['max']) for party, seats in summary)
 
-    return True, bbox, dcc.Graph(figure=tooltip)
+
+@app.callback(
+    Output('ensemble-job', 'data'),
+    Output('ensemble-interval', 'disabled'),
+    Output('ensemble-progress', 'value'),
+    Output('ensemble-progress', 'label'),
+    Output('ensemble-text', 'children'),
+    Input('ensemble-button', 'n_clicks'),
+    Input('ensemble-cancel-button', 'n_clicks'),
+    Input('ensemble-interval', 'n_intervals'),
+    State('ensemble-job', 'data'),
+    State('ensemble-districts', 'value'),
+    State('ensemble-plans', 'value'),
+    State('dropdown-system-name-1', 'value'),
+    State('dropdown-region-level-1', 'value'),
+    State('threshold-1', 'value'),
+    State('threshold-switch-1', 'on'),
+    State('dropdown-elections', 'value'),
+    State('dropdown-countries', 'value'),
+)
+@telemetry.instrument_callback
+def update_ensemble(run_clicks, cancel_clicks, n_intervals, job, n_districts, n_plans, system_name, level, threshold,
+                    threshold_country, election_date, country):
+    """
+    Dash callback to run a redistricting ensemble (see redistricting.py) of
+    the election with system 1 as a background job (see jobs.py), grouping the
+    regions of the level of system 1 into the given number of districts.
+
+    The job is started when the Run button is clicked, and its progress is
+    polled with ensemble-interval until it finishes or it is cancelled, so
+    the callback returns at once.
+    """
+    triggered = callback_context.triggered[0]['prop_id'].split('.')[0] if callback_context.triggered else None
+    if triggered == 'ensemble-button' and run_clicks:
+        if not n_districts or not n_plans:
+            return no_update, True, 0, '', 'Choose the number of districts and plans.'
+        dates = ELECTIONS[country]
+        # The class of an elections.Lazy_Elections, without loading it here
+        election_class = dates.classes[election_date] if hasattr(dates, 'classes') else type(dates[election_date])
+        system = {'name': system_name, 'level': level, 'threshold': threshold, 'threshold_country': threshold_country}
+        job_id = JOBS.submit('ensemble', {'election': election_class.__name__, 'system': system, 'level': level,
+                                          'n_districts': int(n_districts), 'n_plans': int(n_plans)})
+        return {'id': job_id}, False, 0, '', 'Queued'
+
+    if not job:
+        return no_update, True, no_update, no_update, no_update
+    if triggered == 'ensemble-cancel-button' and cancel_clicks:
+        JOBS.cancel(job['id'])
+    status = JOBS.get_status(job['id'])
+    if status is None:
+        return None, True, 0, '', ''
+    finished = status['state'] in jobs.FINISHED_STATES
+    value = 100 * status['done'] / status['total'] if status['total'] else 0
+    result = JOBS.get_result(job['id']) if status['state'] == 'done' else None
+    return no_update, finished, value, '{:.0f}%'.format(value) if value else '', get_ensemble_text(status, result)
+
+
+# Profile a fraction of the callbacks when it is switched on (see profiling.py)
+if profiling.PROFILE_DIR or profiling.PROFILE_ADMIN_TOKEN:
+    profiling.install(app)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,275 @@
+import numpy as np
+
+
+class Vote_Matrix():
+    """
+    Class representing the votes of a set of electoral regions as a dense
+    regions x parties matrix, so that regions can be aggregated with matrix
+    products instead of walking the region tree.
+
+    ...
+    Attributes
+    ----------
+    region_names: list
+        The names of the regions, in the same order as the rows of the matrix.
+    parties: list
+        The names of the parties, in the same order as the columns of the matrix.
+    votes: numpy.ndarray
+        Integer array of shape (n_regions, n_parties) with the number of votes
+        of every party in every region.
+    census: numpy.ndarray
+        The total number of votes registered in every region.
+    n_seats: numpy.ndarray
+        The total number of parliament seats elected in every region.
+    nota: numpy.ndarray
+        Number of 'None of the Above' votes of every region.
+    spoilt_votes: numpy.ndarray
+        Number of spoilt votes of every region.
+
+    Methods
+    -------
+    from_regions(regions, parties=None): Vote_Matrix
+        Build the matrix from a list of regions.Electoral_Region objects.
+    aggregate(membership, region_names): Vote_Matrix
+        Given a groups x regions membership matrix, return the Vote_Matrix of
+        the groups.
+    get_votes(i): dict
+        Return the votes of the i-th region as a dictionary.
+    """
+    def __init__(self, region_names, parties, votes, census, n_seats, nota, spoilt_votes):
+        self.region_names = list(region_names)
+        self.parties = list(parties)
+        self.votes = votes
+        self.census = census
+        self.n_seats = n_seats
+        self.nota = nota
+        self.spoilt_votes = spoilt_votes
+        self.region_index = {name: i for i, name in enumerate(self.region_names)}
+
+    @classmethod
+    def from_regions(cls, regions, parties=None):
+        """
+        Build the matrix from an iterable of regions.Electoral_Region objects.
+        If a list of parties is given, it determines the order of the columns;
+        parties found in the regions but not in the list are appended at the end.
+        """
+        regions = list(regions)
+        party_index = {p: i for i, p in enumerate(parties or [])}
+        for region in regions:
+            for party in region.votes:
+                if party not in party_index:
+                    party_index[party] = len(party_index)
+
+        votes = np.zeros((len(regions), len(party_index)), dtype=np.int64)
+        for i, region in enumerate(regions):
+            for party, n_votes in region.votes.items():
+                votes[i, party_index[party]] = n_votes
+
+        return cls(
+            [r.name for r in regions],
+            list(party_index),
+            votes,
+            np.array([r.census for r in regions], dtype=np.int64),
+            np.array([r.n_seats for r in regions], dtype=np.int64),
+            np.array([r.nota for r in regions], dtype=np.int64),
+            np.array([r.spoilt_votes for r in regions], dtype=np.int64),
+        )
+
+    def aggregate(self, membership, region_names):
+        """
+        Given a membership matrix of shape (n_groups, n_regions) whose entry
+        (g, r) is 1 if region r belongs to group g and 0 otherwise, return the
+        Vote_Matrix whose rows are the groups, named after region_names.
+        """
+        return Vote_Matrix(
+            region_names,
+            self.parties,
+            membership @ self.votes,
+            membership @ self.census,
+            membership @ self.n_seats,
+            membership @ self.nota,
+            membership @ self.spoilt_votes,
+        )
+
+    def get_votes(self, i):
+        """
+        Return the votes of the i-th region as a dictionary whose keys are party
+        names and values are the number of votes.
+        """
+        return {p: int(v) for p, v in zip(self.parties, self.votes[i])}
+
+
+class Sparse_Vote_Matrix():
+    """
+    Class representing the votes of a large set of small electoral regions
+    (e.g. municipalities or precincts) as a sparse regions x parties matrix in
+    CSR format: the votes of region i are data[indptr[i]:indptr[i+1]], for the
+    parties of columns indices[indptr[i]:indptr[i+1]].
+    Only the nonzero entries are stored, since most parties only run in a few
+    regions.
+
+    ...
+    Attributes
+    ----------
+    region_names: list
+        The names of the regions, in the same order as the rows of the matrix.
+    parties: list
+        The names of the parties, in the same order as the columns of the matrix.
+    indptr: numpy.ndarray
+        Array of length n_regions + 1 with the offsets of every row.
+    indices: numpy.ndarray
+        The column (party) of every stored entry.
+    data: numpy.ndarray
+        The number of votes of every stored entry.
+    census, n_seats, nota, spoilt_votes: numpy.ndarray
+        Arrays with the census, seats, 'None of the Above' and spoilt votes of
+        every region.
+    total_votes: numpy.ndarray
+        The total number of votes of every region.
+
+    Methods
+    -------
+    from_triplets(region_names, parties, rows, columns, votes, census, n_seats, nota, spoilt_votes): Sparse_Vote_Matrix
+        Build the matrix from (region, party, votes) triplets.
+    from_regions(regions, parties=None): Sparse_Vote_Matrix
+        Build the matrix from a list of regions.Electoral_Region objects.
+    get_votes(i): dict
+        Return the nonzero votes of the i-th region as a dictionary.
+    aggregate(group_index, region_names): Vote_Matrix
+        Return the dense Vote_Matrix of the groups of regions given by
+        group_index.
+    to_dense(): Vote_Matrix
+        Return the dense Vote_Matrix of the regions.
+    """
+    def __init__(self, region_names, parties, indptr, indices, data, census, n_seats, nota, spoilt_votes):
+        self.region_names = list(region_names)
+        self.parties = list(parties)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.int64)
+        self.census = np.asarray(census, dtype=np.int64)
+        self.n_seats = np.asarray(n_seats, dtype=np.int64)
+        self.nota = np.asarray(nota, dtype=np.int64)
+        self.spoilt_votes = np.asarray(spoilt_votes, dtype=np.int64)
+        self.region_index = {name: i for i, name in enumerate(self.region_names)}
+        self.total_votes = np.bincount(self._get_rows(), weights=self.data, minlength=len(self.region_names)).astype(np.int64)
+
+    @property
+    def shape(self):
+        """
+        The shape (n_regions, n_parties) of the matrix.
+        """
+        return len(self.region_names), len(self.parties)
+
+    def _get_rows(self):
+        return np.repeat(np.arange(len(self.region_names)), np.diff(self.indptr))
+
+    @classmethod
+    def from_triplets(cls, region_names, parties, rows, columns, votes, census, n_seats, nota, spoilt_votes):
+        """
+        Build the matrix from three arrays with the row (region), column (party)
+        and number of votes of every entry, e.g. the rows of a results file.
+        Repeated (row, column) entries are added up and zeros are dropped.
+        """
+        n_regions, n_parties = len(region_names), len(parties)
+        keys = np.asarray(rows, dtype=np.int64)*n_parties + np.asarray(columns, dtype=np.int64)
+        keys, inverse = np.unique(keys, return_inverse=True)
+        values = np.bincount(inverse, weights=np.asarray(votes, dtype=np.float64)).astype(np.int64)
+        nonzero = values != 0
+        keys, values = keys[nonzero], values[nonzero]
+
+        indptr = np.zeros(n_regions + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // n_parties, minlength=n_regions), out=indptr[1:])
+        return cls(region_names, parties, indptr, keys % n_parties, values, census, n_seats, nota, spoilt_votes)
+
+    @classmethod
+    def from_regions(cls, regions, parties=None):
+        """
+        Build the matrix from an iterable of regions.Electoral_Region objects.
+        If a list of parties is given, it determines the order of the columns;
+        parties found in the regions but not in the list are appended at the end.
+        """
+        regions = list(regions)
+        party_index = {p: i for i, p in enumerate(parties or [])}
+        rows, columns, votes = [], [], []
+        for i, region in enumerate(regions):
+            for party, n_votes in region.votes.items():
+                if party not in party_index:
+                    party_index[party] = len(party_index)
+                rows.append(i)
+                columns.append(party_index[party])
+                votes.append(n_votes)
+
+        return cls.from_triplets(
+            [r.name for r in regions],
+            list(party_index),
+            rows,
+            columns,
+            votes,
+            [r.census for r in regions],
+            [r.n_seats for r in regions],
+            [r.nota for r in regions],
+            [r.spoilt_votes for r in regions],
+        )
+
+    def get_votes(self, i):
+        """
+        Return the nonzero votes of the i-th region as a dictionary whose keys
+        are party names and values are the number of votes.
+        """
+        start, end = self.indptr[i], self.indptr[i+1]
+        return {self.parties[j]: v for j, v in zip(self.indices[start:end].tolist(), self.data[start:end].tolist())}
+
+    def aggregate(self, group_index, region_names):
+        """
+        Given an integer array with the group of every region, return the dense
+        Vote_Matrix whose rows are the groups, named after region_names.
+        This is the product of the sparse groups x regions membership matrix by
+        the vote matrix, computed with a single bincount over the stored entries.
+        """
+        group_index = np.asarray(group_index, dtype=np.int64)
+        n_groups, n_parties = len(region_names), len(self.parties)
+        keys = group_index[self._get_rows()]*n_parties + self.indices
+        votes = np.bincount(keys, weights=self.data, minlength=n_groups*n_parties)
+
+        def aggregate_array(x):
+            return np.bincount(group_index, weights=x, minlength=n_groups).astype(np.int64)
+
+        return Vote_Matrix(
+            region_names,
+            self.parties,
+            votes.astype(np.int64).reshape(n_groups, n_parties),
+            aggregate_array(self.census),
+            aggregate_array(self.n_seats),
+            aggregate_array(self.nota),
+            aggregate_array(self.spoilt_votes),
+        )
+
+    def to_dense(self):
+        """
+        Return the dense Vote_Matrix of the regions.
+        """
+        return self.aggregate(np.arange(len(self.region_names)), self.region_names)
+
+
+def membership_matrix(region_names, groups):
+    """
+    Given a list of region names and a dictionary whose keys are group names
+    and values are lists of region names, return the membership matrix of shape
+    (n_groups, n_regions) whose entry (g, r) is 1 if region r belongs to group g.
+    Every region must belong to exactly one group.
+    """
+    region_index = {name: i for i, name in enumerate(region_names)}
+    membership = np.zeros((len(groups), len(region_names)), dtype=np.int64)
+    for g, (group_name, members) in enumerate(groups.items()):
+        for region_name in members:
+            if region_name not in region_index:
+                raise ValueError("Region '{}' of group '{}' does not exist.".format(region_name, group_name))
+            membership[g, region_index[region_name]] = 1
+
+    n_groups = membership.sum(axis=0)
+    if (n_groups != 1).any():
+        region_name = region_names[int(np.argmax(n_groups != 1))]
+        raise ValueError("Region '{}' must belong to exactly one group.".format(region_name))
+
+    return membership
@@ -0,0 +1,215 @@
+"""
+Memory accounting of the loaded elections, e.g.
+
+    python -m app.memory Spain_2019_11 Spain_2019_04 --maps
+
+For every election it reports the bytes of its region objects, their vote
+dictionaries (or the sparse matrices that store them), the map templates of
+Election.maps (without their geojson), the geojson referenced by those
+templates, the caches of vote matrices and region indices, and the rest of its
+attributes. For every country, it reports its parsed geometries and its
+adjacency cache.
+
+Objects shared by several elections (e.g. the Country of the elections of
+Spain, or a dictionary of colors) are only counted once: for the country, or
+for the first election that references them. The geojson of the templates is
+reported apart, although it should be 0: the templates share the geometries of
+the country instead of copying them (see elections.Election.get_map).
+
+The same report is served as JSON at MEMORY_ADMIN_PATH of the Flask server if
+MEMORY_ADMIN_TOKEN is set (see install).
+"""
+import argparse
+import os
+import sys
+import types
+
+import numpy as np
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+import batch  # noqa: E402
+from telemetry import is_authorized  # noqa: E402
+
+MEMORY_ADMIN_PATH = '/admin/memory'
+MEMORY_ADMIN_TOKEN = os.environ.get('MEMORY_ADMIN_TOKEN', '')
+ELECTION_PARTS = ['regions', 'votes', 'maps', 'maps_geojson', 'caches', 'other']
+# Shared code and metadata, never attributed to the objects that reference them
+_SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, types.CodeType)
+
+
+def get_deep_size(*objects, seen=None):
+    """
+    Return the bytes of the given objects and all the objects they reference
+    (the items of containers, the attributes of instances and the buffers of
+    numpy arrays), skipping those whose id is in seen, which is updated with
+    the ids of the counted objects.
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SKIPPED_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, np.ndarray):
+            if obj.base is not None:
+                stack.append(obj.base)
+        elif isinstance(obj, (dict, types.MappingProxyType)):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif not isinstance(obj, (str, bytes, int, float, complex, bool)):
+            if hasattr(obj, '__dict__'):
+                stack.append(vars(obj))
+            for cls in type(obj).__mro__:
+                for slot in getattr(cls, '__slots__', ()):
+                    if hasattr(obj, slot):
+                        stack.append(getattr(obj, slot))
+    return size
+
+
+def get_election_memory(election, seen):
+    """
+    Return a dictionary whose keys are ELECTION_PARTS and 'total', and values
+    are the bytes of every part of an election that aren't in seen.
+    """
+    sizes = {}
+    # The votes first, so that the regions are counted without them
+    votes = []
+    for level_regions in election.regions.values():
+        for region in level_regions.values():
+            attributes = vars(region)
+            votes.append(attributes['votes'] if 'votes' in attributes else attributes.get('vote_matrix'))
+    sizes['votes'] = get_deep_size(*votes, seen=seen)
+    sizes['regions'] = get_deep_size(election.regions, seen=seen)
+
+    maps = election._maps or {}
+    geojsons = [trace['geojson'] for template in maps.values() for trace in template['data']]
+    sizes['maps_geojson'] = get_deep_size(*geojsons, seen=seen)
+    sizes['maps'] = get_deep_size(*maps.values(), seen=seen)
+    sizes['caches'] = get_deep_size(election._vote_matrices, election._sparse_vote_matrices,
+                                    election._parent_indices, seen=seen)
+    sizes['other'] = get_deep_size(vars(election), seen=seen)
+    sizes = {part: sizes[part] for part in ELECTION_PARTS}
+    sizes['total'] = sum(sizes.values())
+    return sizes
+
+
+def get_process_memory():
+    """
+    Return a dictionary with the current resident memory ('rss', if it can be
+    read from /proc) and the peak resident memory ('max_rss') of the process,
+    in bytes.
+    """
+    memory = {}
+    try:
+        with open('/proc/self/statm') as f:
+            memory['rss'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory['max_rss'] = max_rss if sys.platform == 'darwin' else max_rss * 1024
+    except ImportError:
+        pass
+    return memory
+
+
+def get_memory_report(elections):
+    """
+    Given a dictionary whose keys are election names and values are
+    elections.Election objects, return a dictionary with:
+        'countries': {country name: {'geometries': bytes, 'adjacency': bytes}}
+        'elections': {election name: {part: bytes}} (see get_election_memory)
+        'caches': {'batch_elections': bytes}, the elections of batch.py (and
+            the JSON API) that aren't in elections.
+        'process': see get_process_memory.
+        'total': the bytes of all of the above.
+    """
+    countries = {id(e.country): e.country for e in elections.values()}
+    seen = {id(e) for e in elections.values()} | set(countries)
+    report = {'countries': {}, 'elections': {}}
+    for country in countries.values():
+        report['countries'][country.name] = {
+            'geometries': get_deep_size(country._regions, seen=seen),
+            'adjacency': get_deep_size(country._adjacency, seen=seen),
+        }
+    for name, election in elections.items():
+        report['elections'][name] = get_election_memory(election, seen)
+    report['caches'] = {'batch_elections': get_deep_size(batch._ELECTIONS, seen=seen)}
+    report['process'] = get_process_memory()
+    report['total'] = (sum(sum(sizes.values()) for sizes in report['countries'].values())
+                       + sum(sizes['total'] for sizes in report['elections'].values())
+                       + sum(report['caches'].values()))
+    return report
+
+
+def format_report(report):
+    """
+    Return the report of get_memory_report as text tables, in MB.
+    """
+    def mb(size):
+        return '{:.1f}'.format(size / 2**20)
+
+    name_width = max([len(name) for name in report['elections']] + [len('Election')])
+    lines = [' '.join(['{:<{}}'.format('Election', name_width)] + ['{:>12}'.format(p) for p in ELECTION_PARTS + ['total']])]
+    for name, sizes in report['elections'].items():
+        lines.append(' '.join(['{:<{}}'.format(name, name_width)] + ['{:>12}'.format(mb(sizes[p])) for p in ELECTION_PARTS + ['total']]))
+    lines.append('')
+    for name, sizes in report['countries'].items():
+        lines.append('Country {}: geometries {} MB, adjacency {} MB'.format(name, mb(sizes['geometries']), mb(sizes['adjacency'])))
+    for name, size in report['caches'].items():
+        lines.append('Cache {}: {} MB'.format(name, mb(size)))
+    lines.append('Total: {} MB'.format(mb(report['total'])) + ''.join(
+        ', process {}: {} MB'.format(key, mb(value)) for key, value in report['process'].items()))
+    return '\n'.join(lines)
+
+
+def install(server, elections, token=MEMORY_ADMIN_TOKEN):
+    """
+    Serve the report of get_memory_report for the given elections (a
+    dictionary like main.ELECTIONS, {country: {date: Election}}, where only
+    the loaded elections of an elections.Lazy_Elections are reported) as JSON
+    at MEMORY_ADMIN_PATH, if a token is given. It must be passed in the
+    Authorization header ("Bearer <token>") or the 'token' parameter.
+    """
+    if not token:
+        return
+    from flask import jsonify
+
+    @server.route(MEMORY_ADMIN_PATH)
+    def memory_report():
+        if not is_authorized(token):
+            return jsonify({'error': 'Forbidden'}), 403
+        return jsonify(get_memory_report({
+            '{} {}'.format(country, date): election
+            for country, country_elections in elections.items()
+            for date, election in getattr(country_elections, 'loaded', country_elections).items()
+        }))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.memory', description=__doc__.split('e.g.')[0].strip())
+    parser.add_argument('elections', nargs='*', help="Names of the elections (default: all of them)")
+    parser.add_argument('--maps', action='store_true', help="Build the map templates of Election.maps before measuring")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    elections = {name: batch.get_election(name) for name in args.elections or batch.get_election_names()}
+    if args.maps:
+        for election in elections.values():
+            election.maps
+    print(format_report(get_memory_report(elections)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+import numpy as np
+import os
+import plotly.graph_objects as go
+import sys
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+import comparisons  # noqa: E402
+from telemetry import timed  # noqa: E402
+
+METRIC_NAMES = [
+    'Gallagher Index',
+    'Loosemore-Hanby Index',
+    'ENP (Votes)',
+    'ENP (Seats)',
+    'Efficiency Gap',
+    'Wasted Votes',
+    'Malapportionment',
+]
+
+# All the functions below take arrays whose rows are regions and whose columns
+# are parties, and return one value per region.
+
+
+def _shares(x):
+    x = np.asarray(x, dtype=np.float64)
+    totals = x.sum(axis=-1, keepdims=True)
+    return np.divide(x, totals, out=np.zeros_like(x), where=totals != 0)
+
+
+def gallagher_index(votes, seats):
+    """
+    Gallagher least-squares index, in percentage points.
+    (See https://en.wikipedia.org/wiki/Gallagher_index)
+    """
+    diff = 100 * (_shares(votes) - _shares(seats))
+    return np.sqrt((diff**2).sum(axis=-1) / 2)
+
+
+def loosemore_hanby_index(votes, seats):
+    """
+    Loosemore-Hanby index, in percentage points.
+    (See https://en.wikipedia.org/wiki/Loosemore%E2%80%93Hanby_index)
+    """
+    return 100 * np.abs(_shares(votes) - _shares(seats)).sum(axis=-1) / 2
+
+
+def effective_number_of_parties(x):
+    """
+    Laakso-Taagepera effective number of parties, either by votes or by seats.
+    (See https://en.wikipedia.org/wiki/Effective_number_of_parties)
+    """
+    concentration = (_shares(x)**2).sum(axis=-1)
+    return np.divide(1, concentration, out=np.full_like(concentration, np.nan), where=concentration != 0)
+
+
+def wasted_votes(votes, seats):
+    """
+    Number of wasted votes of every party in every district: all the votes of
+    the parties without seats, and the votes that the parties with s seats got
+    above s Droop quotas (total votes / (n_seats + 1)). In single-member (or
+    Winner Takes All) districts this is the usual definition: the losers' votes
+    plus the winner's votes beyond 50%.
+    """
+    votes = np.asarray(votes, dtype=np.float64)
+    seats = np.asarray(seats)
+    quota = votes.sum(axis=-1, keepdims=True) / (seats.sum(axis=-1, keepdims=True) + 1)
+    return np.where(seats == 0, votes, np.maximum(votes - seats*quota, 0))
+
+
+def efficiency_gap(wasted, votes, party_a, party_b):
+    """
+    Efficiency gap between the parties of columns party_a and party_b, i.e. the
+    difference of their wasted votes divided by the total number of votes.
+    Positive values mean that party_a wasted more votes than party_b.
+    (See https://en.wikipedia.org/wiki/Wasted_vote#Wasted_votes_in_electoral_systems)
+    """
+    total_votes = np.asarray(votes, dtype=np.float64).sum(axis=-1)
+    gap = np.asarray(wasted)[..., party_a] - np.asarray(wasted)[..., party_b]
+    return np.divide(gap, total_votes, out=np.zeros_like(total_votes), where=total_votes != 0)
+
+
+def malapportionment(census, n_seats, total_census, total_seats):
+    """
+    Census per seat of every region relative to the census per seat of the
+    whole country: 1 means that the region is fairly represented, and values
+    above 1 mean that the region is under-represented.
+    """
+    census = np.asarray(census, dtype=np.float64)
+    n_seats = np.asarray(n_seats, dtype=np.float64)
+    census_per_seat = np.divide(census, n_seats, out=np.full_like(census, np.nan), where=n_seats != 0)
+    return census_per_seat / (total_census / total_seats)
+
+
+def malapportionment_index(census, n_seats):
+    """
+    Samuels-Snyder malapportionment index of a set of regions: half the sum of
+    the absolute differences between their shares of seats and of census.
+    """
+    return np.abs(_shares(census) - _shares(n_seats)).sum(axis=-1) / 2
+
+
+class Election_Metrics():
+    """
+    Class containing the proportionality metrics of the result of applying an
+    electoral_systems.System to an election, for every region of every level
+    up to system.level.
+
+    The seats of the system are computed once at system.level and aggregated
+    to the lower levels with the election's membership matrices, so that every
+    metric is computed for all the regions of a level in one vectorized pass.
+
+    ...
+    Attributes
+    ----------
+    election: elections.Election
+        The election the system is applied to.
+    system: electoral_systems.System
+        The system whose result is analysed.
+    values: dict
+        Keys are region levels, values are dictionaries whose keys are metric
+        names (see METRIC_NAMES) and values are arrays with the value of the
+        metric for every region of the level, in the order of
+        election.regions[level].
+    national: dict
+        Keys are metric names, values are the value of the metric for the whole
+        country. For 'Malapportionment' it is the Samuels-Snyder index of the
+        regions of system.level.
+
+    Methods
+    -------
+    get_region_metric(metric, level, region_name): float
+        Return the value of a metric in a region.
+    get_map_plot(metric): plotly.graph_objects.Figure
+        Get the choropleth map of a metric at system.level.
+    get_bar_plot(metric, n=15): plotly.graph_objects.Figure
+        Get the bar chart with the regions with the highest values of a metric.
+    """
+    @timed('aggregation')
+    def __init__(self, election, system):
+        self.election = election
+        self.system = system
+
+        vote_matrix = election.get_vote_matrix(system.level)
+        seats = comparisons.compute_seat_matrix(election, system)
+        wasted = wasted_votes(vote_matrix.votes, seats)
+
+        # Efficiency gap between the two parties with most votes in the country
+        party_a, party_b = np.argsort(-vote_matrix.votes.sum(axis=0), kind='stable')[:2]
+        total_census, total_seats = vote_matrix.census.sum(), vote_matrix.n_seats.sum()
+
+        self.values = {}
+        for level in range(system.level + 1):
+            def aggregate(values):
+                return election.aggregate_rows(values, system.level, level)
+
+            level_votes = aggregate(vote_matrix.votes)
+            level_seats = aggregate(seats)
+            level_wasted = aggregate(wasted)
+            level_total_votes = level_votes.sum(axis=1).astype(np.float64)
+
+            self.values[level] = {
+                'Gallagher Index': gallagher_index(level_votes, level_seats),
+                'Loosemore-Hanby Index': loosemore_hanby_index(level_votes, level_seats),
+                'ENP (Votes)': effective_number_of_parties(level_votes),
+                'ENP (Seats)': effective_number_of_parties(level_seats),
+                'Efficiency Gap': efficiency_gap(level_wasted, level_votes, party_a, party_b),
+                'Wasted Votes': np.divide(level_wasted.sum(axis=1), level_total_votes,
+                                          out=np.zeros_like(level_total_votes), where=level_total_votes != 0),
+                'Malapportionment': malapportionment(aggregate(vote_matrix.census), aggregate(vote_matrix.n_seats),
+                                                     total_census, total_seats),
+            }
+
+        self.national = {metric: float(values[0]) for metric, values in self.values[0].items()}
+        self.national['Malapportionment'] = float(malapportionment_index(vote_matrix.census, vote_matrix.n_seats))
+
+    def get_region_metric(self, metric, level, region_name):
+        """
+        Return the value of a metric in the region of the given level and name.
+        """
+        return float(self.values[level][metric][list(self.election.regions[level]).index(region_name)])
+
+    @timed('figures')
+    def get_map_plot(self, metric):
+        """
+        Get a figure (a dictionary, see elections.Election.get_map) with the
+        choropleth map of the given metric for every region of system.level.
+        The efficiency gap is shown in absolute value.
+        """
+        z = self.values[self.system.level][metric]
+        if metric == 'Efficiency Gap':
+            z = np.abs(z)
+        z = np.nan_to_num(z).tolist()
+
+        return self.election.get_map(self.system.level, z, '{} per Region'.format(metric), zmax=max(z) if max(z) > 0 else 1)
+
+    @timed('figures')
+    def get_bar_plot(self, metric, n=15):
+        """
+        Get a figure with the bar chart of the n regions of system.level with
+        the highest values of the given metric.
+        """
+        values = dict(zip(self.election.regions[self.system.level], np.nan_to_num(self.values[self.system.level][metric]).tolist()))
+        values = dict(sorted(values.items(), key=lambda item: abs(item[1]), reverse=True)[:n])
+
+        fig = go.Figure(data=[go.Bar(
+            x=list(values.keys()),
+            y=list(values.values()),
+            marker_color='#7D7D7D',
+        )])
+        fig.update_layout(
+            title='{}\t (Country: {:.2f})'.format(metric, self.national[metric]),
+            yaxis=dict(
+                title=metric,
+                titlefont_size=16,
+                tickfont_size=14,
+            ),
+            font={'size': 16},
+            margin=dict(t=40, b=20, l=0, r=0),
+        )
+        return fig
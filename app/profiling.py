@@ -0,0 +1,261 @@
+"""
+Opt-in profiling of the Dash callbacks and the hot methods of the engine.
+
+When it is enabled, a fraction PROFILE_RATE of the executions of every
+profiled function is run under cProfile and/or a stack sampler, and the
+results are aggregated per function and written to PROFILE_DIR:
+
+    <name>.prof
+        The aggregated cProfile statistics, e.g. `python -m pstats update_figures.prof`
+        or `snakeviz update_figures.prof`.
+    <name>.collapsed
+        The sampled stacks in the collapsed format ("frame;frame;... count"),
+        e.g. `flamegraph.pl update_figures.collapsed > update_figures.svg`, or
+        open it in https://www.speedscope.app.
+
+It is enabled at startup by setting PROFILE_DIR, or at runtime through the
+admin URL PROFILE_ADMIN_PATH, which is only served if PROFILE_ADMIN_TOKEN is
+set, e.g.
+
+    curl -H "Authorization: Bearer $PROFILE_ADMIN_TOKEN" -d '{"enabled": true, "rate": 0.2}' http://localhost:8080/admin/profiling
+
+GET returns the state of the profiler, and POST changes "enabled", "rate"
+and "mode", or writes the files with {"flush": true}. The files are also
+written every PROFILE_FLUSH_SECONDS and when the process exits.
+
+install wraps the callbacks registered in a Dash app and HOT_METHODS, so the
+code that calls them doesn't change. Functions called from a profiled
+function are part of its profile, not profiled on their own.
+"""
+import atexit
+import cProfile
+import functools
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+import regions  # noqa: E402
+from telemetry import is_authorized  # noqa: E402
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+PROFILE_RATE = float(os.environ.get('PROFILE_RATE', 0.1))
+# 'cprofile', 'stacks' (sampling, much lower overhead) or 'both'
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'both')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+PROFILE_FLUSH_SECONDS = 10
+PROFILE_ADMIN_PATH = '/admin/profiling'
+PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN', '')
+MODES = ['cprofile', 'stacks', 'both']
+# Frame of cProfile between the profiled function and Profiler._profile
+_RUNCALL_CODE = cProfile.Profile.runcall.__code__
+
+HOT_METHODS = [
+    (regions.Electoral_Region, 'compute_result'),
+    (regions.Election_Result, 'get_seat_diff'),
+    (regions.Election_Result, 'get_lost_votes'),
+    (regions.Election_Result, 'plot_tooltip'),
+    (regions.Election_Result, 'get_map_plot'),
+    (regions.Election_Result, 'get_piechart_plot'),
+    (regions.Election_Result, 'get_bar_plot'),
+]
+
+
+def get_frame_label(code):
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class Profiler():
+    """
+    Profiles a fraction of the calls of the functions it wraps.
+
+    ...
+    Attributes
+    ----------
+    directory: str
+        Where the profiles are written.
+    rate: float
+        The fraction of the calls that are profiled.
+    mode: str
+        One of MODES.
+    interval: float
+        The seconds between two samples of the stacks.
+    enabled: bool
+        Whether calls are being profiled.
+
+    Methods
+    -------
+    wrap(name, function): function
+        Return the profiled version of a function.
+    flush()
+        Write the aggregated profiles to the directory.
+    get_state(): dict
+        Return the settings and the number of profiled calls of every function.
+    """
+    def __init__(self, directory=PROFILE_DIR or 'profiles', rate=PROFILE_RATE, mode=PROFILE_MODE,
+                 interval=PROFILE_INTERVAL, enabled=bool(PROFILE_DIR)):
+        if mode not in MODES:
+            raise ValueError("The profiling mode must be one of: {}.".format(', '.join(MODES)))
+        self.directory = directory
+        self.rate = rate
+        self.mode = mode
+        self.interval = interval
+        self.enabled = enabled
+        self._stats = {}
+        self._stacks = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Thread ident -> (name, frame of _profile) of the calls being sampled
+        self._sampled = {}
+        self._sampling = threading.Event()
+        self._sampler = None
+        self._last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    def wrap(self, name, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not self.enabled or getattr(self._local, 'active', False) or random.random() >= self.rate:
+                return function(*args, **kwargs)
+            return self._profile(name, function, args, kwargs)
+        wrapper.__profiled__ = True
+        return wrapper
+
+    def _profile(self, name, function, args, kwargs):
+        self._local.active = True
+        mode = self.mode
+        profile = cProfile.Profile() if mode != 'stacks' else None
+        if mode != 'cprofile':
+            self._start_sampling(name, sys._getframe())
+        try:
+            if profile is None:
+                return function(*args, **kwargs)
+            return profile.runcall(function, *args, **kwargs)
+        finally:
+            self._local.active = False
+            if mode != 'cprofile':
+                with self._lock:
+                    del self._sampled[threading.get_ident()]
+                    if not self._sampled:
+                        self._sampling.clear()
+            self._add(name, profile)
+
+    def _start_sampling(self, name, frame):
+        with self._lock:
+            self._sampled[threading.get_ident()] = (name, frame)
+            self._sampling.set()
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, name='profiling-sampler', daemon=True)
+                self._sampler.start()
+
+    def _sample(self):
+        """
+        Record the stacks of the threads running profiled calls every
+        interval seconds, from the profiled function down.
+        """
+        while True:
+            self._sampling.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, (name, root) in self._sampled.items():
+                    frame, labels = frames.get(ident), []
+                    while frame is not None and frame is not root:
+                        if frame.f_code is not _RUNCALL_CODE:
+                            labels.append(get_frame_label(frame.f_code))
+                        frame = frame.f_back
+                    stack = ';'.join([name] + labels[::-1])
+                    stacks = self._stacks.setdefault(name, {})
+                    stacks[stack] = stacks.get(stack, 0) + 1
+
+    def _add(self, name, profile):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+            if profile is not None:
+                if name in self._stats:
+                    self._stats[name].add(profile)
+                else:
+                    self._stats[name] = pstats.Stats(profile)
+            flush = time.monotonic() - self._last_flush > PROFILE_FLUSH_SECONDS
+        if flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._counts:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            for name, stats in self._stats.items():
+                stats.dump_stats(os.path.join(self.directory, self.get_file_name(name) + '.prof'))
+            for name, stacks in self._stacks.items():
+                with open(os.path.join(self.directory, self.get_file_name(name) + '.collapsed'), 'w') as f:
+                    for stack, count in sorted(stacks.items()):
+                        f.write('{} {}\n'.format(stack, count))
+
+    @staticmethod
+    def get_file_name(name):
+        return re.sub(r'[^\w.-]', '_', name)
+
+    def get_state(self):
+        return {
+            'enabled': self.enabled,
+            'rate': self.rate,
+            'mode': self.mode,
+            'directory': os.path.abspath(self.directory),
+            'profiled_calls': dict(self._counts),
+        }
+
+
+def install(app, profiler=None, hot_methods=HOT_METHODS, token=PROFILE_ADMIN_TOKEN):
+    """
+    Wrap the callbacks of a Dash app (call it after they are all registered)
+    and the hot_methods, a list of (class, method name), with a Profiler, and
+    serve the admin URL if a token is given. Return the profiler.
+    """
+    profiler = profiler or Profiler()
+    for callback in app.callback_map.values():
+        if not getattr(callback['callback'], '__profiled__', False):
+            callback['callback'] = profiler.wrap(callback['callback'].__name__, callback['callback'])
+    for cls, method_name in hot_methods:
+        method = getattr(cls, method_name)
+        if not getattr(method, '__profiled__', False):
+            setattr(cls, method_name, profiler.wrap('{}.{}'.format(cls.__name__, method_name), method))
+    if token:
+        _install_admin(app.server, profiler, token)
+    return profiler
+
+
+def _install_admin(server, profiler, token):
+    from flask import jsonify, request
+
+    @server.route(PROFILE_ADMIN_PATH, methods=['GET', 'POST'])
+    def profiling_admin():
+        if not is_authorized(token):
+            return jsonify({'error': 'Forbidden'}), 403
+        if request.method == 'POST':
+            settings = request.get_json(silent=True) or {}
+            try:
+                if 'rate' in settings:
+                    rate = float(settings['rate'])
+                    if not 0 <= rate <= 1:
+                        raise ValueError("The rate must be between 0 and 1.")
+                    profiler.rate = rate
+                if 'mode' in settings:
+                    if settings['mode'] not in MODES:
+                        raise ValueError("The profiling mode must be one of: {}.".format(', '.join(MODES)))
+                    profiler.mode = settings['mode']
+            except (TypeError, ValueError) as e:
+                return jsonify({'error': str(e)}), 400
+            if 'enabled' in settings:
+                profiler.enabled = bool(settings['enabled'])
+            if settings.get('flush'):
+                profiler.flush()
+        return jsonify(profiler.get_state())
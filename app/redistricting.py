@@ -0,0 +1,370 @@
+from collections import Counter, defaultdict
+import multiprocessing
+import numpy as np
+import os
+import sys
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+from apportionment import apportion_matrix  # noqa: E402
+from electoral_systems import SYSTEM_NAMES  # noqa: E402
+
+
+class Recom_Chain():
+    """
+    Markov chain over the partitions of the regions of a level into a fixed
+    number of connected districts. Every step is a recombination (ReCom) move:
+    two adjacent districts are merged and split again by cutting a random
+    spanning tree of the merged districts.
+    (See https://arxiv.org/abs/1911.05725)
+
+    The votes and seats of every district are kept, and only the two
+    districts modified on every step are updated, by adding and subtracting
+    the votes of the regions that moved between them, and re-apportioned.
+
+    ...
+    Attributes
+    ----------
+    vote_matrix: matrices.Vote_Matrix
+        The votes of the regions that are grouped into districts.
+    n_districts: int
+        The number of districts of every plan.
+    system: electoral_systems.System
+        The system used to compute the result of every district.
+    valid_parties: list
+        If specified, only these parties are considered when computing the
+        results (country-level threshold).
+    tolerance: float
+        Maximum relative deviation of the census of a district from the ideal
+        census (total census / n_districts).
+    assignment: numpy.ndarray
+        The district assigned to every region in the current plan.
+
+    Methods
+    -------
+    step(): bool
+        Perform one step of the chain and return whether the proposed plan was
+        accepted.
+    get_seats(): numpy.ndarray
+        Return the number of seats of every party in the current plan.
+    """
+    def __init__(self, vote_matrix, adjacency, n_districts, system, valid_parties=None, tolerance=0.5, seed=None, max_attempts=1000):
+        """
+        Parameters
+        ----------
+        vote_matrix: matrices.Vote_Matrix
+            The votes of the regions that are grouped into districts.
+        adjacency: dict
+            Keys are region names, values are sets with the names of their
+            neighbouring regions (see countries.Country.get_adjacency).
+        n_districts: int
+            The number of districts of every plan.
+        system: electoral_systems.System
+            The system used to compute the result of every district.
+        valid_parties: list
+            If specified, only these parties are considered when computing the
+            results (country-level threshold).
+        tolerance: float
+            Maximum relative deviation of the census of a district from the
+            ideal census.
+        seed: int or numpy.random.SeedSequence
+            Seed of the random number generator.
+        max_attempts: int
+            Number of random spanning trees tried to find the initial plan.
+        """
+        if not 1 <= n_districts <= len(vote_matrix.region_names):
+            raise ValueError("The number of districts must be between 1 and the number of regions.")
+        self.vote_matrix = vote_matrix
+        self.n_districts = n_districts
+        self.system = system
+        self.valid_parties = valid_parties
+        self.tolerance = tolerance
+        self._rng = np.random.default_rng(seed)
+        # Sorted, since the adjacency sets are ordered by the hashes of the
+        # names, which change between processes, and so would the plans
+        self._neighbours = [
+            sorted(vote_matrix.region_index[x] for x in adjacency[name] if x in vote_matrix.region_index)
+            for name in vote_matrix.region_names
+        ]
+        self._edges = [(u, v) for u, neighbours in enumerate(self._neighbours) for v in neighbours if u < v]
+
+        ideal_census = vote_matrix.census.sum() / n_districts
+        self._min_census = ideal_census * (1 - tolerance)
+        self._max_census = ideal_census * (1 + tolerance)
+
+        if valid_parties is not None:
+            valid_parties = set(valid_parties)
+            self._valid_mask = np.array([p in valid_parties for p in vote_matrix.parties])
+        else:
+            self._valid_mask = None
+
+        self.assignment = self._get_initial_assignment(max_attempts)
+        self._district_votes = np.zeros((n_districts, len(vote_matrix.parties)), dtype=np.int64)
+        np.add.at(self._district_votes, self.assignment, vote_matrix.votes)
+        self._district_n_seats = np.bincount(self.assignment, weights=vote_matrix.n_seats, minlength=n_districts).astype(np.int64)
+        self._district_seats = np.zeros((n_districts, len(vote_matrix.parties)), dtype=np.int64)
+        self._update_districts(np.arange(n_districts))
+
+    def _get_random_spanning_tree(self, nodes):
+        """
+        Return the root and the parent of every node of a uniformly random
+        spanning tree of the subgraph induced by nodes (Wilson's algorithm).
+        """
+        node_set = set(nodes)
+        neighbours = {u: [v for v in self._neighbours[u] if v in node_set] for u in nodes}
+        root = nodes[self._rng.integers(len(nodes))]
+        in_tree = {root}
+        parent = {}
+        for start in nodes:
+            next_node = {}
+            u = start
+            while u not in in_tree:
+                next_node[u] = neighbours[u][self._rng.integers(len(neighbours[u]))]
+                u = next_node[u]
+            u = start
+            while u not in in_tree:
+                in_tree.add(u)
+                parent[u] = next_node[u]
+                u = next_node[u]
+        return root, parent
+
+    def _split(self, nodes, k):
+        """
+        Split the connected set of nodes, that has to be divided into k
+        districts, into one district and the rest, along a random spanning tree.
+        Return the nodes of the new district or None if the tree can't be cut
+        respecting the census tolerance.
+        """
+        root, parent = self._get_random_spanning_tree(nodes)
+        children = defaultdict(list)
+        for u, p in parent.items():
+            children[p].append(u)
+
+        order, stack = [], [root]
+        while stack:
+            u = stack.pop()
+            order.append(u)
+            stack.extend(children[u])
+
+        census = self.vote_matrix.census
+        subtree_census = {}
+        for u in reversed(order):
+            subtree_census[u] = census[u] + sum(subtree_census[c] for c in children[u])
+
+        total_census = subtree_census[root]
+        cuts = [
+            u for u in nodes if u != root
+            and self._min_census <= subtree_census[u] <= self._max_census
+            and (k-1)*self._min_census <= total_census - subtree_census[u] <= (k-1)*self._max_census
+        ]
+        if not cuts:
+            return None
+
+        district, stack = [], [cuts[self._rng.integers(len(cuts))]]
+        while stack:
+            u = stack.pop()
+            district.append(u)
+            stack.extend(children[u])
+        return district
+
+    def _get_initial_assignment(self, max_attempts):
+        n_regions = len(self.vote_matrix.region_names)
+        for _ in range(max_attempts):
+            assignment = np.full(n_regions, self.n_districts-1, dtype=np.int64)
+            remaining = list(range(n_regions))
+            for d in range(self.n_districts-1):
+                district = self._split(remaining, self.n_districts-d)
+                if district is None:
+                    break
+                assignment[district] = d
+                district = set(district)
+                remaining = [u for u in remaining if u not in district]
+            else:
+                if self._min_census <= self.vote_matrix.census[remaining].sum() <= self._max_census:
+                    return assignment
+        raise ValueError("Couldn't find a plan with {} districts within the census tolerance.".format(self.n_districts))
+
+    def _update_districts(self, districts):
+        """
+        Recompute the seats of the given districts (an array) from their votes.
+        """
+        self._district_seats[districts] = apportion_matrix(self._district_votes[districts], self._district_n_seats[districts],
+                                                           self.system, self._valid_mask)
+
+    def _move_regions(self, regions, source, target):
+        """
+        Move the votes and seats of the given regions from district source to
+        district target.
+        """
+        votes = self.vote_matrix.votes[regions].sum(axis=0)
+        n_seats = self.vote_matrix.n_seats[regions].sum()
+        self._district_votes[source] -= votes
+        self._district_votes[target] += votes
+        self._district_n_seats[source] -= n_seats
+        self._district_n_seats[target] += n_seats
+
+    def step(self):
+        """
+        Perform one step of the chain and return whether the proposed plan was
+        accepted. If it wasn't, the chain stays on the current plan.
+        """
+        cut_edges = [(u, v) for u, v in self._edges if self.assignment[u] != self.assignment[v]]
+        if not cut_edges:
+            return False
+        u, v = cut_edges[self._rng.integers(len(cut_edges))]
+        d_1, d_2 = self.assignment[u], self.assignment[v]
+
+        nodes = np.flatnonzero((self.assignment == d_1) | (self.assignment == d_2)).tolist()
+        district = self._split(nodes, 2)
+        if district is None:
+            return False
+
+        previous = self.assignment[nodes]
+        self.assignment[nodes] = d_2
+        self.assignment[district] = d_1
+        moved = np.asarray(nodes)[previous != self.assignment[nodes]]
+        self._move_regions(moved[self.assignment[moved] == d_1], d_2, d_1)
+        self._move_regions(moved[self.assignment[moved] == d_2], d_1, d_2)
+        self._update_districts(np.array([d_1, d_2]))
+        return True
+
+    def get_seats(self):
+        """
+        Return the number of seats of every party (in the order of
+        vote_matrix.parties) in the current plan.
+        """
+        return self._district_seats.sum(axis=0)
+
+
+class Ensemble():
+    """
+    Class containing the results of an ensemble of redistricting plans.
+
+    ...
+    Attributes
+    ----------
+    parties: list
+        The names of the parties.
+    region_names: list
+        The names of the regions that were grouped into districts.
+    seats: numpy.ndarray
+        Array of shape (n_plans, n_parties) with the seats of every party in
+        every plan.
+    plans: numpy.ndarray
+        Array of shape (n_plans, n_regions) with the district of every region in
+        every plan, or None if the plans weren't stored.
+    acceptance_rate: float
+        Fraction of the chain steps whose proposed plan was accepted.
+
+    Methods
+    -------
+    get_seat_distribution(party): collections.Counter
+        Return a Counter whose keys are numbers of seats and values are the
+        number of plans in which the party obtained that number of seats.
+    get_seat_summary(): dict
+        Return a dictionary whose keys are party names and values are
+        dictionaries with the mean, minimum and maximum number of seats.
+    """
+    def __init__(self, parties, region_names, seats, plans, acceptance_rate):
+        self.parties = parties
+        self.region_names = region_names
+        self.seats = seats
+        self.plans = plans
+        self.acceptance_rate = acceptance_rate
+
+    def get_seat_distribution(self, party):
+        """
+        Return a Counter whose keys are numbers of seats and values are the
+        number of plans in which the party obtained that number of seats.
+        """
+        return Counter(self.seats[:, self.parties.index(party)].tolist())
+
+    def get_seat_summary(self):
+        """
+        Return a dictionary whose keys are the parties that obtained seats in
+        some plan and values are dictionaries with the mean, minimum and maximum
+        number of seats.
+        """
+        return {
+            p: {'mean': float(self.seats[:, i].mean()), 'min': int(self.seats[:, i].min()), 'max': int(self.seats[:, i].max())}
+            for i, p in enumerate(self.parties) if self.seats[:, i].any()
+        }
+
+
+def _run_chain(args, step_callback=None):
+    vote_matrix, adjacency, n_districts, system, valid_parties, n_plans, tolerance, seed, store_plans = args
+    chain = Recom_Chain(vote_matrix, adjacency, n_districts, system, valid_parties, tolerance, seed)
+    seats = np.zeros((n_plans, len(vote_matrix.parties)), dtype=np.int64)
+    plans = np.zeros((n_plans, len(vote_matrix.region_names)), dtype=np.int16) if store_plans else None
+    n_accepted = 0
+    for i in range(n_plans):
+        n_accepted += chain.step()
+        seats[i] = chain.get_seats()
+        if store_plans:
+            plans[i] = chain.assignment
+        if step_callback is not None:
+            step_callback()
+    return seats, plans, n_accepted
+
+
+def run_ensemble(election, n_districts, system, n_plans, level=None, n_chains=1, processes=None, tolerance=0.5, seed=None, store_plans=False,
+                 progress=None):
+    """
+    Generate n_plans random plans grouping the regions of the given level of
+    an election into n_districts connected districts, and compute the seats of
+    every party in every plan using the given electoral_systems.System.
+    Every district elects the sum of the seats of its regions.
+
+    The plans are split among n_chains independent Recom_Chain objects, which
+    are run on a pool of processes (a single process if processes=1).
+    If level is not specified, the highest level of the election is used.
+    If progress is given, it is called with the number of plans generated so
+    far and n_plans: after every plan if the chains run in the current
+    process, and after every chain otherwise.
+
+    Return an Ensemble object.
+    """
+    if level is None:
+        level = max(election.regions)
+    if system.name not in SYSTEM_NAMES:
+        raise ValueError("Redistricting plans can only be apportioned with the systems {}.".format(', '.join(SYSTEM_NAMES)))
+    if n_plans < 1 or n_chains < 1:
+        raise ValueError("An ensemble must have at least one plan and one chain.")
+    if not 1 <= n_districts <= len(election.regions[level]):
+        raise ValueError("The number of districts must be between 1 and the number of regions.")
+    vote_matrix = election.get_vote_matrix(level)
+    adjacency = election.country.get_adjacency(level)
+    valid_parties = election.get_valid_parties(system.threshold) if system.threshold_country else None
+
+    seeds = np.random.SeedSequence(seed).spawn(n_chains)
+    chain_plans = [n_plans // n_chains + (1 if i < n_plans % n_chains else 0) for i in range(n_chains)]
+    args = [
+        (vote_matrix, adjacency, n_districts, system, valid_parties, chain_plans[i], tolerance, seeds[i], store_plans)
+        for i in range(n_chains)
+    ]
+
+    n_done = 0
+
+    def step_callback(n=1):
+        nonlocal n_done
+        n_done += n
+        progress(n_done, n_plans)
+
+    if processes == 1 or n_chains == 1:
+        chain_results = [_run_chain(x, step_callback if progress else None) for x in args]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            chain_results = []
+            for chain_result, x in zip(pool.imap(_run_chain, args), args):
+                chain_results.append(chain_result)
+                if progress:
+                    step_callback(x[5])
+
+    return Ensemble(
+        vote_matrix.parties,
+        vote_matrix.region_names,
+        np.concatenate([x[0] for x in chain_results]),
+        np.concatenate([x[1] for x in chain_results]) if store_plans else None,
+        sum(x[2] for x in chain_results) / n_plans,
+    )
@@ -1,7 +1,6 @@
 from collections import Counter
 import copy
 import math
-import operator
 import os
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
@@ -10,11 +9,46 @@ import sys
 myPath = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, myPath)
 
+import apportionment  # noqa: E402
+import biproportional  # noqa: E402
+from electoral_systems import BIPROPORTIONAL, TWO_TIER_SYSTEMS  # noqa: E402
+import leveling  # noqa: E402
+import stv  # noqa: E402
+from telemetry import APPORTIONMENTS, timed  # noqa: E402
+
 # Mapbox token for the choropleth maps
 MAPBOX_ACCESS_TOKEN = os.environ.get('MAPBOX_ACCESS_TOKEN', None)
 MAPBOX_STYLE = "mapbox://styles/plotlymapbox/cjvprkf3t1kns1cqjxuxmwixz"
 
 
+def get_map_layout(country):
+    """
+    Return the layout of a choropleth map of the given countries.Country.
+    """
+    return {
+        'mapbox': {'style': 'light', 'accesstoken': MAPBOX_ACCESS_TOKEN, 'zoom': country.zoom, 'center': country.center},
+        'margin': {"r": 0, "t": 40, "l": 0, "b": 0},
+        'height': 900,
+        'font': {'size': 16},
+    }
+
+
+def iter_subregions(region, level):
+    """
+    Yield the subregions of the given level of a region (or the region itself,
+    if it is of that level) in the order of the region tree.
+    The tree is walked with an explicit stack, so that it scales to levels with
+    hundreds of thousands of regions.
+    """
+    stack = [region]
+    while stack:
+        region = stack.pop()
+        if region.level == level:
+            yield region
+        elif region.level < level:
+            stack.extend(reversed(list(getattr(region, 'subregions', []))))
+
+
 class Electoral_Region():
     """
     Class representing an electoral region. (See https://en.wikipedia.org/wiki/Electoral_district)
@@ -42,11 +76,11 @@ class Electoral_Region():
 
     Methods
     -------
-    compute_election_result(system, valid_parties=None)
+    compute_election_result(system, valid_parties=None, n_seats=None)
         Given an electoral_systems.System, return a collections.Counter with
         the number of seats assigned to each party for the electoral region.
 
-    compute_result(system)
+    compute_result(system, n_seats=None)
         Given an electoral_systems.System, return an Electoral_Result object
         encoding the results of using that system in the region.
 
@@ -88,28 +122,43 @@ class Electoral_Region():
         self.total_votes = sum(votes.values())
         return
 
-    def compute_election_result(self, system, valid_parties=None):
+    def compute_election_result(self, system, valid_parties=None, n_seats=None):
         """
         Given an electoral_systems.System, return a collections.Counter with
         the number of seats assigned to each party for the electoral region.
 
         If a list of valid_parties is given (as strings), only those given
         parties will be considered.
+        If n_seats is given, it is used instead of the number of seats of the
+        region (see apportionment.reapportion).
+        With 'STV', single-seat regions use instant-runoff voting instead of
+        plurality.
+        Two-tier and biproportional systems apportion several regions jointly,
+        so they raise ValueError here (see compute_result).
         """
-        if system.name == 'Winner Takes All' or self.n_seats == 1:
-            return {max(self.votes, key=self.votes.get): self.n_seats}
+        if system.name in TWO_TIER_SYSTEMS or system.name == BIPROPORTIONAL:
+            raise ValueError("'{}' can't be computed in a single region, use compute_result.".format(system.name))
+        if n_seats is None:
+            n_seats = self.n_seats
+        if n_seats == 0:
+            return {}
+        APPORTIONMENTS.inc(system.name)
+
+        if system.name == 'Winner Takes All' or (n_seats == 1 and system.name != 'STV'):
+            return {max(self.votes, key=self.votes.get): n_seats}
 
         if valid_parties:
-            valid_votes = {p: v for p, v in self.votes.items() if p in valid_parties}
+            valid_votes = {p: v for p, v in self.votes.items() if p in valid_parties and v > 0}
         else:
             if system.threshold == 'n/2s':
-                vote_threshold = self.total_votes/(2*self.n_seats)
+                vote_threshold = self.total_votes/(2*n_seats)
             else:
                 vote_threshold = self.total_votes*int(system.threshold)/100
             valid_votes = {k: v for k, v in self.votes.items() if v > vote_threshold}
-        round_votes = copy.deepcopy(valid_votes)
+        if not valid_votes:
+            # No party has votes (or they are all below the threshold)
+            return {}
         seat_counter = Counter()
-        n_seats = copy.deepcopy(self.n_seats)
 
         if 'LRM' in system.name:  # Largest Remainder Method
             if 'Hare' in system.name:
@@ -138,45 +187,53 @@ class Electoral_Region():
                     seats_given += 1
 
             if 'Imperiali' in system.name or 'HB' in system.name:
-                if seats_given > self.n_seats:
+                if seats_given > n_seats:
                     new_system = copy.deepcopy(system)
                     new_system.name = 'LRM-Droop'
-                    return self.compute_election_result(new_system)
+                    return self.compute_election_result(new_system, n_seats=n_seats)
 
-        else:
-            while n_seats != 0:
-                best_party = max(round_votes.items(), key=operator.itemgetter(1))[0]
-                seat_counter[best_party] += 1
-                if system.name == 'dHondt':
-                    round_votes[best_party] = valid_votes[best_party] / (seat_counter[best_party] + 1)
-                elif system.name == 'SL':  # Sainte-Laguë
-                    round_votes[best_party] = valid_votes[best_party] / (2*seat_counter[best_party] + 1)
-                n_seats -= 1
+        elif system.name == 'dHondt':
+            seat_counter = apportionment.divisor_method(valid_votes, n_seats, apportionment.DIVISORS['Jefferson'])
+        elif system.name == 'SL':  # Sainte-Laguë
+            seat_counter = apportionment.divisor_method(valid_votes, n_seats, apportionment.DIVISORS['Webster'])
+        elif system.name == 'STV':  # Single Transferable Vote
+            # Ballots are generated from all the votes, so that the voters of
+            # the parties below the threshold transfer to their next preference
+            seat_counter = stv.compute_stv_result(self.votes, n_seats, list(valid_votes), system.transfer_model)
 
         seat_counter = {k: v for k, v in seat_counter.items() if v != 0}
         return seat_counter
 
-    def compute_result(self, system):
+    @timed('compute_result')
+    def compute_result(self, system, n_seats=None):
         """
         Given an electoral_systems.System, return an Electoral_Result object
         encoding the results of using that system in the region.
+
+        If n_seats is given (a dictionary whose keys are the names of the
+        regions of level system.level and values are their number of seats),
+        it overrides the number of seats of those regions.
+        Two-tier systems (see electoral_systems.TWO_TIER_SYSTEMS) also assign
+        the leveling seats to the regions of level system.level, and the
+        biproportional apportionment is computed for all of them jointly.
         """
         if system.threshold_country:
             valid_parties = self.election.get_valid_parties(system.threshold)
         else:
             valid_parties = None
 
+        if system.name in TWO_TIER_SYSTEMS:
+            return Election_Result(self, system.level, leveling.compute_leveling_result(self, system, n_seats, valid_parties))
+        if system.name == BIPROPORTIONAL:
+            return Election_Result(self, system.level,
+                                   biproportional.compute_biproportional_result(self, system, n_seats, valid_parties))
+
         result = dict()
 
         # Note that system.level>=self.level. Otherwise, it doesn't make sense.
-        def get_result(region, level):
-            if level == system.level:
-                result[region.name] = region.compute_election_result(system, valid_parties)
-            else:
-                for r in region.subregions:
-                    get_result(r, level+1)
-
-        get_result(self, self.level)
+        for region in iter_subregions(self, system.level):
+            region_seats = n_seats[region.name] if n_seats else None
+            result[region.name] = region.compute_election_result(system, valid_parties, region_seats)
 
         return Election_Result(self, system.level, result)
 
@@ -185,17 +242,69 @@ class Electoral_Region():
         Given a region level, regurn a list containing all the subregions at the
         given level.
         """
-        subregions = []
+        return list(iter_subregions(self, level))
 
-        def add_subregions(region):
-            if region.level == level:
-                subregions.append(region)
-            else:
-                for r in region.subregions:
-                    add_subregions(r)
 
-        add_subregions(self, level)
-        return subregions
+class Sparse_Electoral_Region(Electoral_Region):
+    """
+    Electoral_Region whose data is a row of a matrices.Sparse_Vote_Matrix.
+    It is used for levels with many small regions (e.g. municipalities or
+    precincts): no dictionary of votes is stored per region, and the votes
+    are read from the matrix when they are needed.
+
+    ...
+    Attributes
+    ----------
+    vote_matrix: matrices.Sparse_Vote_Matrix
+        The matrix with the data of all the regions of the level.
+    index: int
+        The row of the region in vote_matrix.
+    """
+    def __init__(self, election, level: int, vote_matrix, index: int):
+        """
+        Parameters
+        ----------
+        election: elections.Election
+            The election this Electoral_Region was part of.
+        level: int
+            The level of the region.
+        vote_matrix: matrices.Sparse_Vote_Matrix
+            The matrix with the data of all the regions of the level.
+        index: int
+            The row of the region in vote_matrix.
+        """
+        self.election = election
+        self.level = level
+        self.vote_matrix = vote_matrix
+        self.index = index
+
+    @property
+    def name(self):
+        return self.vote_matrix.region_names[self.index]
+
+    @property
+    def census(self):
+        return int(self.vote_matrix.census[self.index])
+
+    @property
+    def n_seats(self):
+        return int(self.vote_matrix.n_seats[self.index])
+
+    @property
+    def votes(self):
+        return self.vote_matrix.get_votes(self.index)
+
+    @property
+    def nota(self):
+        return int(self.vote_matrix.nota[self.index])
+
+    @property
+    def spoilt_votes(self):
+        return int(self.vote_matrix.spoilt_votes[self.index])
+
+    @property
+    def total_votes(self):
+        return int(self.vote_matrix.total_votes[self.index])
 
 
 class Election_Result():
@@ -228,6 +337,10 @@ class Election_Result():
         Get the pie chart to be shown on the dashboard.
     get_bar_plot(self, metric, other=None): plotly.graph_objects.Figure
         Get the bar chart to be shown on the dashboard.
+    to_dict(self): dict
+        Get a compact JSON-serializable version of the result.
+    from_dict(region, data): Election_Result
+        Rebuild a result from the output of to_dict.
     """
     def __init__(self, region, level, result):
         """
@@ -245,6 +358,37 @@ class Election_Result():
         self.level = level
         self.result = result
 
+    def to_dict(self):
+        """
+        Get a compact JSON-serializable version of the result (e.g. to keep it
+        in a dcc.Store): {'level': level, 'parties': [party names],
+        'result': {region name: [party index, seats, party index, seats...]}}.
+        The region isn't included; it is given to from_dict.
+        """
+        parties, index, result = [], {}, {}
+        for region_name, seats in self.result.items():
+            region_seats = []
+            for party, n_seats in seats.items():
+                if party not in index:
+                    index[party] = len(parties)
+                    parties.append(party)
+                region_seats += [index[party], int(n_seats)]
+            result[region_name] = region_seats
+        return {'level': self.level, 'parties': parties, 'result': result}
+
+    @classmethod
+    def from_dict(cls, region, data):
+        """
+        Rebuild the result of to_dict, computed in the given region.
+        """
+        parties = data['parties']
+        result = {
+            region_name: {parties[seats[i]]: seats[i + 1] for i in range(0, len(seats), 2)}
+            for region_name, seats in data['result'].items()
+        }
+        return cls(region, data['level'], result)
+
+    @timed('aggregation')
     def get_seat_diff(self, other, region=None, level=None):
         """
         Get a dictionary whose keys are party names and results are the
@@ -260,21 +404,16 @@ class Election_Result():
         if not level:
             level = min(self.level, other.level)
 
-        def add_seats(seat_counter, subregion, result):
-            if subregion.level == result.level:
-                seat_counter += result.result[subregion.name]
-            else:
-                for r in subregion.subregions:
-                    add_seats(seat_counter, r, result)
-
         seats_1, seats_2 = Counter(), Counter()
-        add_seats(seats_1, region, self)
-        add_seats(seats_2, region, other)
+        for seat_counter, result in [(seats_1, self), (seats_2, other)]:
+            for subregion in iter_subregions(region, result.level):
+                seat_counter.update(result.result[subregion.name])
 
         seat_diff = {p: seats_1[p]-seats_2[p] for p in set(seats_1).union(set(seats_2))}
 
         return seat_diff
 
+    @timed('aggregation')
     def get_lost_votes(self, region=None, level=None):
         """
         Get a dictionary whose keys are party names without reprsentation in the
@@ -288,16 +427,11 @@ class Election_Result():
 
         lost_votes = Counter()
 
-        def compute_subregion_lost_votes(subregion):
-            if subregion.level == level:
-                for party, votes in subregion.votes.items():
-                    if party not in self.result[subregion.name]:
-                        lost_votes[party] += votes
-            else:
-                for r in subregion.subregions:
-                    compute_subregion_lost_votes(r)
-
-        compute_subregion_lost_votes(region)
+        for subregion in iter_subregions(region, level):
+            subregion_result = self.result[subregion.name]
+            for party, votes in subregion.votes.items():
+                if party not in subregion_result:
+                    lost_votes[party] += votes
 
         return lost_votes
 
@@ -308,14 +442,8 @@ class Election_Result():
             for vote_counter in self.result.values():
                 result += vote_counter
         else:
-            def add_vote_counter(subregion, result):
-                if subregion.level == self.level:
-                    result += self.result[subregion.name]
-                else:
-                    for r in subregion.subregions:
-                        add_vote_counter(r, result)
-
-            add_vote_counter(region, result)
+            for subregion in iter_subregions(region, self.level):
+                result += self.result[subregion.name]
 
         labels = list(result.keys())
         colors = [self.region.election.colors[x] if x in self.region.election.colors else '#7D7D7D' for x in labels]
@@ -342,6 +470,7 @@ class Election_Result():
         )
         return bar
 
+    @timed('figures')
     def plot_tooltip(self, other=None):
         """
         Get the tooltip to show when hovering on the map.
@@ -360,7 +489,7 @@ class Election_Result():
             tooltip.add_trace(self._get_piechart_trace(), 1, 1)
             tooltip.add_trace(self._get_lost_votes_trace(lost_votes, n=4), 1, 2)
             tooltip.update_xaxes(showticklabels=False)
-            plot_title += '\t ({:,} -- {:.2f}%)'.format(n_lost_votes, 100*n_lost_votes/self.region.total_votes)
+            plot_title += '\t ({:,} -- {:.2f}%)'.format(n_lost_votes, 100*n_lost_votes/self.region.total_votes if self.region.total_votes else 0)
         else:  # If other is actually another result ---> Compare piecharts
             # TODO Check that self.region == other.region
             tooltip = make_subplots(rows=1, cols=2, specs=[[{'type': 'domain'}, {'type': 'domain'}]])
@@ -379,9 +508,11 @@ class Election_Result():
 
         return tooltip
 
+    @timed('figures')
     def get_map_plot(self, other=None):
         """
-        Get a figure with the choropleth map.
+        Get a figure with the choropleth map (a dictionary, see
+        elections.Election.get_map).
         If 'other' result is specified, compute the seat difference between self
         and other for every region.
         Otherwise, compute the percentage of lost votes of every region.
@@ -396,12 +527,7 @@ class Election_Result():
                 n_region_votes = sum(region.votes.values())
                 lost_votes_percentage.append(n_region_lost_votes / n_region_votes)
 
-            map = self.region.election.maps[self.level]
-            map.update_traces(
-                z=lost_votes_percentage,
-                zmin=0, zmax=1,
-            )
-            map.update_layout(title='Percentage of Lost Votes per Region')
+            return self.region.election.get_map(self.level, lost_votes_percentage, 'Percentage of Lost Votes per Region')
 
         else:  # Means that we're computing Seat Difference
             if self.level <= other.level:
@@ -418,25 +544,9 @@ class Election_Result():
                 n_different_seats = sum([x for x in seat_diff_counter.values() if x > 0])
                 seat_diff.append(n_different_seats)
 
-            map = self.region.election.maps[level]
-            map.update_traces(
-                z=seat_diff,
-                zmin=0, zmax=max(10, max(seat_diff)),
-            )
-            map.update_layout(title='Seat difference per Region')
-
-        map.update_layout(
-            mapbox_style="light",
-            mapbox_accesstoken=MAPBOX_ACCESS_TOKEN,
-            mapbox_zoom=region.election.country.zoom,
-            mapbox_center=region.election.country.center,
-            margin={"r": 0, "t": 40, "l": 0, "b": 0},
-            height=900,
-            font={'size': 16},
-        )
-
-        return map
+            return self.region.election.get_map(level, seat_diff, 'Seat difference per Region', zmax=max(10, max(seat_diff)))
 
+    @timed('figures')
     def get_piechart_plot(self, other=None):
         """
         Get a figure plotting a pie chart with the seat distribution of the
@@ -467,6 +577,7 @@ class Election_Result():
 
         return fig
 
+    @timed('figures')
     def get_bar_plot(self, metric, other=None):
         """
         Get the bar plot figure.
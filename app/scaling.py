@@ -0,0 +1,221 @@
+"""
+Measure how the time and memory of the engine grow with the size of an
+election, using synthetic elections (see synthetic.py). One dimension (the
+number of regions, levels, parties or seats per region) is varied at a time,
+the rest keep the values of BASE_CONFIG. e.g.
+
+    python -m app.scaling regions 100 1000 10000 100000 --output scaling.json --plot scaling.html
+
+For every value, it reports the time and the peak memory (traced with
+tracemalloc) of building the election, compute_result, aggregating the votes
+and the result through the region tree, and building the figures, together
+with the exponent of the power law that best fits every curve.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from plotly.colors import qualitative
+import plotly.graph_objects as go
+import plotly.io
+from plotly.subplots import make_subplots
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+import electoral_systems  # noqa: E402
+from synthetic import COUNTRY_NAME, Synthetic_Election  # noqa: E402
+
+BASE_CONFIG = {'regions': 1000, 'depth': 2, 'parties': 20, 'seats': 5}
+DIMENSIONS = list(BASE_CONFIG)
+PHASES = ['build', 'compute_result', 'aggregation', 'figures']
+
+
+def get_election_args(config, seed=0):
+    """
+    Return the arguments of Synthetic_Election for a configuration (a
+    dictionary like BASE_CONFIG). The levels below the highest one have a
+    geometric progression of regions, e.g. 46, 2154 and 100000 regions for
+    100000 regions and 3 levels. Half the parties (at least 10) are national.
+    """
+    depth, n_leaves = config['depth'], config['regions']
+    n_regions = tuple(max(1, round(n_leaves ** (level / depth))) for level in range(1, depth + 1))
+    return {
+        'n_regions': n_regions,
+        'n_parties': config['parties'],
+        'n_national_parties': min(config['parties'], max(10, config['parties'] // 2)),
+        'seats_per_region': config['seats'],
+        'seed': seed,
+    }
+
+
+def _run_phases(config, phases):
+    """
+    Yield (phase, function) for the phases on a new synthetic election, so
+    that the caller can measure every one of them. 'build' always comes first.
+    """
+    state = {}
+    depth = config['depth']
+    system = electoral_systems.System('dHondt', depth, '3')
+    other_system = electoral_systems.System('SL', depth, '3')
+
+    def build():
+        state['election'] = Synthetic_Election(**get_election_args(config))
+        state['country_region'] = state['election'].regions[0][COUNTRY_NAME]
+
+    def compute_result():
+        state['result'] = state['country_region'].compute_result(system)
+
+    def aggregation():
+        election = state['election']
+        vote_matrix = election.get_sparse_vote_matrix(depth)
+        for level in range(depth):
+            vote_matrix.aggregate(election.get_parent_index(depth, level), list(election.regions[level]))
+        state['result'].get_lost_votes()
+        state['result'].get_seat_diff(state['other_result'])
+
+    def figures():
+        plotly.io.to_json(state['result'].get_map_plot(), validate=False)
+        state['result'].get_piechart_plot(state['other_result']).to_json()
+
+    functions = {'compute_result': compute_result, 'aggregation': aggregation, 'figures': figures}
+    yield 'build', build
+    if 'compute_result' not in phases:
+        compute_result()
+    state['other_result'] = state['country_region'].compute_result(other_system)
+    for phase in phases:
+        if phase != 'build':
+            yield phase, functions[phase]
+
+
+def measure(config, phases=PHASES, memory=True):
+    """
+    Return a dictionary whose keys are the phases and values are dictionaries
+    with their 'time' in seconds and, if memory is True, the 'memory' in bytes
+    (peak of the memory allocated during the phase). Memory is measured in a
+    second run, as tracing allocations slows the code down.
+    """
+    phases = [p for p in PHASES if p in phases or p == 'build']
+    results = {phase: {} for phase in phases}
+    for phase, function in _run_phases(config, phases):
+        start = time.perf_counter()
+        function()
+        results[phase]['time'] = time.perf_counter() - start
+
+    if memory:
+        for phase, function in _run_phases(config, phases):
+            # Tracing restarts for every phase, so that its peak only counts
+            # what the phase allocates (tracemalloc.reset_peak needs Python 3.9)
+            tracemalloc.start()
+            try:
+                function()
+                results[phase]['memory'] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    return results
+
+
+def fit_exponent(values, measurements):
+    """
+    Return the exponent k of the power law c*value^k that best fits the
+    measurements (least squares on a log-log scale), or None if there are not
+    enough positive values.
+    """
+    points = [(math.log(v), math.log(m)) for v, m in zip(values, measurements) if v > 0 and m and m > 0]
+    if len(set(x for x, _ in points)) < 2:
+        return None
+    x, y = np.array(points).T
+    return float(np.polyfit(x, y, 1)[0])
+
+
+def run_scaling(dimension, values, phases=PHASES, memory=True, base_config=BASE_CONFIG, log=None):
+    """
+    Measure the phases for every value of a dimension (one of DIMENSIONS).
+    Return a dictionary with the 'dimension', the 'values', the 'base_config',
+    the 'results' (one dictionary per value, see measure) and the fitted
+    'exponents' of the time and memory of every phase.
+    If log is a file object, a line is written to it after every value.
+    """
+    if dimension not in DIMENSIONS:
+        raise ValueError("Dimension '{}' does not exist. Choose one of: {}.".format(dimension, ', '.join(DIMENSIONS)))
+    # Warm up (imports, plotly validators...) so that the first value is not penalized
+    measure(dict(base_config, **{dimension: min(values)}), phases, memory=False)
+
+    results = []
+    for value in values:
+        config = dict(base_config, **{dimension: value})
+        results.append(measure(config, phases, memory))
+        if log:
+            print('{}={:<8} '.format(dimension, value) + '  '.join(
+                '{} {:.3f}s'.format(phase, r['time']) + (' {:.1f}MB'.format(r['memory'] / 2**20) if 'memory' in r else '')
+                for phase, r in results[-1].items()), file=log, flush=True)
+
+    exponents = {}
+    for phase in results[0]:
+        for measurement in ['time', 'memory']:
+            if measurement in results[0][phase]:
+                exponents['{} {}'.format(phase, measurement)] = fit_exponent(values, [r[phase][measurement] for r in results])
+    return {'dimension': dimension, 'values': list(values), 'base_config': base_config, 'results': results, 'exponents': exponents}
+
+
+def plot_scaling(report):
+    """
+    Return the figure with the complexity curves of a report of run_scaling:
+    the time and memory of every phase against the value of the dimension, on
+    log-log axes.
+    """
+    fig = make_subplots(rows=1, cols=2, subplot_titles=['Time (s)', 'Peak memory (MB)'])
+    values = report['values']
+    for i, phase in enumerate(report['results'][0]):
+        color = qualitative.Plotly[i % len(qualitative.Plotly)]
+        for col, measurement, scale in [(1, 'time', 1), (2, 'memory', 2**20)]:
+            if measurement not in report['results'][0][phase]:
+                continue
+            exponent = report['exponents'].get('{} {}'.format(phase, measurement))
+            fig.add_trace(go.Scatter(
+                x=values,
+                y=[r[phase][measurement] / scale for r in report['results']],
+                mode='lines+markers',
+                name='{} (~n^{:.2f})'.format(phase, exponent) if exponent is not None else phase,
+                legendgroup=phase,
+                line_color=color,
+            ), 1, col)
+    fig.update_xaxes(type='log', title=report['dimension'])
+    fig.update_yaxes(type='log')
+    fig.update_layout(title='Scaling with the number of {}'.format(report['dimension']), font={'size': 14})
+    return fig
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.scaling', description=__doc__.split('e.g.')[0].strip())
+    parser.add_argument('dimension', choices=DIMENSIONS)
+    parser.add_argument('values', nargs='+', type=int)
+    parser.add_argument('--phases', nargs='+', choices=PHASES, default=PHASES)
+    for dimension, value in BASE_CONFIG.items():
+        parser.add_argument('--' + dimension, type=int, default=value, help="Base number of {} (default: {})".format(dimension, value))
+    parser.add_argument('--no-memory', action='store_true', help="Don't measure the memory")
+    parser.add_argument('--output', default=None, help="JSON file of the report (default: standard output)")
+    parser.add_argument('--plot', default=None, help="HTML file of the complexity curves")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    base_config = {dimension: getattr(args, dimension) for dimension in BASE_CONFIG}
+    report = run_scaling(args.dimension, args.values, args.phases, not args.no_memory, base_config, log=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    if args.plot:
+        plot_scaling(report).write_html(args.plot)
+
+
+if __name__ == '__main__':
+    main()
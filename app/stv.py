@@ -0,0 +1,183 @@
+from collections import Counter
+
+
+class Transfer_Model():
+    """
+    Class describing how synthetic ranked ballots are generated from the
+    first-preference votes of a region.
+
+    Every ballot ranks up to 'depth' parties. After every preference, a
+    fraction 'exhaust' of the ballots stops ranking; the rest rank one of the
+    remaining parties with probability proportional to its votes, multiplied
+    by the affinity between the last ranked party and that party (1 if not
+    specified).
+
+    Ballots are generated directly in compressed form: every unique ranking
+    is stored once together with its (fractional) number of voters.
+
+    ...
+    Attributes
+    ----------
+    depth: int
+        The maximum number of parties ranked on a ballot.
+    exhaust: float
+        The fraction of ballots that stop ranking after every preference.
+    affinity: dict
+        Keys are party names, values are dictionaries whose keys are party names
+        and values are the relative propensity of transferring from the first
+        party to the second one.
+    min_weight: float
+        Rankings whose number of voters would be lower than min_weight are
+        truncated, so that the number of unique ballots stays small.
+
+    Methods
+    -------
+    generate_ballots(votes): dict
+        Given the first-preference votes of a region, return a dictionary whose
+        keys are rankings (tuples of party names) and values are their number of
+        voters.
+    """
+    def __init__(self, depth: int = 3, exhaust: float = 0.3, affinity: dict = None, min_weight: float = 1.0):
+        if depth < 1:
+            raise ValueError("Ballots must rank at least one party.")
+        if not 0 <= exhaust <= 1:
+            raise ValueError("The exhaust fraction must be between 0 and 1.")
+        self.depth = depth
+        self.exhaust = exhaust
+        self.affinity = affinity or {}
+        self.min_weight = min_weight
+
+    def generate_ballots(self, votes):
+        """
+        Given the first-preference votes of a region (a dictionary whose keys
+        are party names and values are numbers of votes), return a dictionary
+        whose keys are rankings (tuples of party names) and values are their
+        number of voters.
+        """
+        parties = [p for p, v in votes.items() if v > 0]
+        ballots = Counter()
+        stack = [((p,), float(votes[p])) for p in parties]
+        while stack:
+            ranking, weight = stack.pop()
+            others = [p for p in parties if p not in ranking]
+            if len(ranking) == self.depth or not others:
+                ballots[ranking] += weight
+                continue
+
+            affinity = self.affinity.get(ranking[-1], {})
+            propensity = {p: votes[p] * affinity.get(p, 1) for p in others}
+            total_propensity = sum(propensity.values())
+            stopped = weight * self.exhaust
+            if total_propensity == 0:
+                stopped = weight
+            else:
+                continued = weight - stopped
+                for p in others:
+                    next_weight = continued * propensity[p] / total_propensity
+                    if next_weight < self.min_weight:
+                        stopped += next_weight
+                    elif next_weight > 0:
+                        stack.append((ranking + (p,), next_weight))
+            ballots[ranking] += stopped
+        return dict(ballots)
+
+
+def collapse_ballots(rankings):
+    """
+    Given an iterable of ballots (sequences of party or candidate names in
+    order of preference), return a dictionary whose keys are the unique
+    rankings (as tuples) and values are the number of ballots with that ranking.
+    """
+    return dict(Counter(tuple(r) for r in rankings))
+
+
+def count_stv(ballots, n_seats, candidates, capacity=None):
+    """
+    Count compressed ballots (a dictionary whose keys are rankings and values
+    are their weights) with the Single Transferable Vote, using the Droop quota
+    and fractional (Gregory) transfers of surpluses.
+    (See https://en.wikipedia.org/wiki/Single_transferable_vote)
+
+    candidates is the list of names that can be elected; preferences for other
+    names are skipped. capacity is a dictionary with the maximum number of seats
+    of every candidate (1 by default), which allows counting parties as lists
+    of interchangeable candidates.
+
+    Ballots are kept in piles indexed by their current preference, and every
+    pile has a scale factor, so that electing a candidate only rescales its pile
+    and only the ballots of excluded or full candidates are moved.
+    Return a collections.Counter with the number of seats of every candidate.
+    """
+    rankings = list(ballots)
+    weights = [float(ballots[r]) for r in rankings]
+    position = [0] * len(rankings)
+    capacity = capacity or {c: 1 for c in candidates}
+
+    continuing = {c: None for c in candidates if capacity.get(c, 1) > 0}
+    piles = {c: [] for c in continuing}
+    tally = {c: 0.0 for c in continuing}
+    scale = {c: 1.0 for c in continuing}
+    seats = Counter()
+
+    def place(b, weight):
+        # Candidates elected without surplus (scale 0) take no more votes
+        ranking, i = rankings[b], position[b]
+        while i < len(ranking) and (ranking[i] not in continuing or scale[ranking[i]] == 0):
+            i += 1
+        position[b] = i
+        if i < len(ranking):
+            c = ranking[i]
+            piles[c].append(b)
+            weights[b] = weight / scale[c]
+            tally[c] += weight
+
+    def remove(c):
+        del continuing[c]
+        for b in piles.pop(c):
+            place(b, weights[b] * scale[c])
+        tally[c] = 0.0
+
+    for b in range(len(rankings)):
+        place(b, weights[b])
+    quota = int(sum(tally.values()) / (n_seats + 1)) + 1
+
+    n_elected = 0
+    while n_elected < n_seats and continuing:
+        remaining_capacity = sum(capacity.get(c, 1) - seats[c] for c in continuing)
+        best = max(continuing, key=tally.get)
+        # Exclude the candidate with fewest votes (the last one on ties), unless
+        # the rest couldn't fill the seats left: then they are filled by tally
+        worst = min(reversed(list(continuing)), key=tally.get)
+        worst_capacity = capacity.get(worst, 1) - seats[worst]
+        if tally[best] >= quota or remaining_capacity - worst_capacity < n_seats - n_elected:
+            seats[best] += 1
+            n_elected += 1
+            if tally[best] > 0:
+                surplus = max(tally[best] - quota, 0)
+                scale[best] *= surplus / tally[best]
+                tally[best] = surplus
+            if seats[best] == capacity.get(best, 1):
+                remove(best)
+        else:
+            remove(worst)
+
+    return Counter({c: s for c, s in seats.items() if s})
+
+
+def compute_stv_result(votes, n_seats, candidates, transfer_model=None):
+    """
+    Compute the seats of every party in a region with the Single Transferable
+    Vote, from synthetic ballots generated from its first-preference votes
+    (a dictionary whose keys are party names and values are votes) with the
+    given Transfer_Model. Only the parties in candidates can get seats; the
+    ballots of the rest are transferred to their next preference.
+    Every party fields as many candidates as Droop quotas it would get if
+    the votes of the other parties were transferred proportionally, plus one,
+    so that there are always more candidates than seats.
+    Return a collections.Counter with the number of seats of every party.
+    """
+    transfer_model = transfer_model or Transfer_Model()
+    ballots = transfer_model.generate_ballots(votes)
+    candidate_votes = sum(votes[p] for p in candidates) or 1
+    capacity = {p: min(n_seats, int(votes[p] * (n_seats + 1) / candidate_votes) + 1) for p in candidates}
+    return count_stv(ballots, n_seats, candidates, capacity)
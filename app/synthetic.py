@@ -0,0 +1,224 @@
+"""
+Synthetic elections for stress-testing the engine with many more regions and
+parties than the real elections, e.g. 100,000 precincts and 1,000 parties:
+
+    election = Synthetic_Election(n_regions=(50, 2000, 100000), n_parties=1000)
+    country_region = election.regions[0]['Synthetic']
+    result = country_region.compute_result(System('dHondt', 3, 3))
+
+See scaling.py for the harness that measures how the engine scales with them.
+"""
+import math
+import os
+import sys
+
+import numpy as np
+from plotly.colors import qualitative
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+import countries  # noqa: E402
+import electoral_systems  # noqa: E402
+from elections import Election  # noqa: E402
+from matrices import Sparse_Vote_Matrix  # noqa: E402
+from regions import Electoral_Region  # noqa: E402
+
+COUNTRY_NAME = 'Synthetic'
+
+
+def get_region_names(level, n_regions):
+    return ['{}-{}'.format(level, i) for i in range(n_regions)]
+
+
+def get_parent_index(n_regions, n_parent_regions):
+    """
+    Return the index of the parent of every one of n_regions regions, splitting
+    them in n_parent_regions blocks of consecutive regions of (almost) the same
+    size, with n_parent_regions <= n_regions.
+    """
+    return np.arange(n_regions, dtype=np.int64) * n_parent_regions // n_regions
+
+
+class Synthetic_Country(countries.Country):
+    """
+    Country whose regions are the cells of a square grid, one grid per level.
+    The grids of different levels are laid out independently, so the
+    boundaries of the regions of a level don't follow the ones of its parent
+    regions. The geojsons are only built when they are first used.
+    """
+    def __init__(self, n_regions):
+        """
+        Parameters
+        ----------
+        n_regions: tuple
+            The number of regions of every level from 1 on.
+        """
+        super(Synthetic_Country, self).__init__(COUNTRY_NAME)
+        self.center = (0, 0)
+        self.zoom = 4
+        self.n_regions = (1,) + tuple(n_regions)
+        self.regions = {level: None for level in range(len(self.n_regions))}
+
+    def get_geojson(self, level):
+        if self._regions[level] is None:
+            self._regions[level] = self._build_geojson(level)
+        return self._regions[level]
+
+    def _build_geojson(self, level):
+        n_regions = self.n_regions[level]
+        n_columns = math.ceil(math.sqrt(n_regions))
+        size = 20 / n_columns
+        features = []
+        for i, name in enumerate(get_region_names(level, n_regions) if level else [COUNTRY_NAME]):
+            lon, lat = -10 + size*(i % n_columns), 10 - size*(i // n_columns)
+            features.append({
+                'type': 'Feature',
+                'id': name,
+                'properties': {},
+                'geometry': {
+                    'type': 'Polygon',
+                    'coordinates': [[[lon, lat], [lon + size, lat], [lon + size, lat - size], [lon, lat - size], [lon, lat]]],
+                },
+            })
+        return {'type': 'FeatureCollection', 'features': features}
+
+
+class Synthetic_Election(Election):
+    """
+    Randomly generated election, with any number of levels, regions, parties
+    and seats. The regions of the highest level are regions.Sparse_Electoral_Region
+    objects backed by a matrices.Sparse_Vote_Matrix (see
+    Election.add_sparse_level), and the regions of the lower levels aggregate
+    their votes, census and seats.
+
+    The first n_national_parties parties run in every region, with vote shares
+    that decay like a power law (a few big parties and a long tail). The rest
+    are regional parties, every one of which only runs in the regions of a
+    single region of level 1. The votes of every party in every region are
+    perturbed with log-normal noise.
+    """
+    def __init__(self, n_regions=(10, 100), n_parties=10, n_national_parties=None, seats_per_region=5,
+                 mean_census=50000, seed=0, sparse=True):
+        """
+        Parameters
+        ----------
+        n_regions: tuple
+            The number of regions of every level from 1 on (at most
+            electoral_systems.MAX_LEVEL levels). Every level must have at least
+            as many regions as the previous one.
+        n_parties: int
+            The number of parties.
+        n_national_parties: int
+            The number of parties that run in every region (all of them by
+            default).
+        seats_per_region: int or tuple
+            The number of seats of every region of the highest level, or a tuple
+            (min, max) to draw them uniformly.
+        mean_census: int
+            The mean census of the regions of the highest level.
+        seed: int
+            The seed of the random generator.
+        sparse: bool
+            If False, the regions of the highest level are ordinary
+            regions.Electoral_Region objects, whose votes are dictionaries.
+        """
+        n_regions = tuple(n_regions)
+        if not 1 <= len(n_regions) <= electoral_systems.MAX_LEVEL:
+            raise ValueError("There must be between 1 and {} levels of regions.".format(electoral_systems.MAX_LEVEL))
+        if any(n < m for n, m in zip(n_regions, (1,) + n_regions)):
+            raise ValueError("Every level must have at least as many regions as the previous one.")
+        if n_national_parties is None:
+            n_national_parties = n_parties
+        if not 0 < n_national_parties <= n_parties:
+            raise ValueError("The number of national parties must be between 1 and the number of parties.")
+
+        super(Synthetic_Election, self).__init__(country=Synthetic_Country(n_regions), date='synthetic-{}'.format(seed))
+        rng = np.random.default_rng(seed)
+        depth = len(n_regions)
+        n_leaves = n_regions[-1]
+        self.parties = ['P{}'.format(i) for i in range(n_parties)]
+        self.colors = {p: qualitative.Dark24[i % len(qualitative.Dark24)] for i, p in enumerate(self.parties)}
+        self.electoral_system = electoral_systems.System(name='dHondt', level=depth, threshold=3)
+
+        # Parent of every region of the highest level in every level
+        leaf_parents = {depth: np.arange(n_leaves, dtype=np.int64)}
+        for level in range(depth - 1, 0, -1):
+            leaf_parents[level] = get_parent_index(n_regions[level], n_regions[level - 1])[leaf_parents[level + 1]]
+        leaf_parents[0] = np.zeros(n_leaves, dtype=np.int64)
+
+        census = np.maximum(rng.lognormal(math.log(mean_census), 0.5, n_leaves), 100).astype(np.int64)
+        if isinstance(seats_per_region, tuple):
+            n_seats = rng.integers(seats_per_region[0], seats_per_region[1] + 1, n_leaves)
+        else:
+            n_seats = np.full(n_leaves, seats_per_region, dtype=np.int64)
+        rows, columns, weights = self._generate_entries(rng, n_parties, n_national_parties, leaf_parents[1])
+        row_weights = np.bincount(rows, weights=weights, minlength=n_leaves)
+        voters = census * rng.uniform(0.5, 0.8, n_leaves)
+        votes = np.floor(voters[rows] * weights / row_weights[rows]).astype(np.int64)
+
+        # The lower levels are built empty and filled by add_sparse_level
+        self.regions = {0: {COUNTRY_NAME: Electoral_Region(self, COUNTRY_NAME, 0, 0, int(n_seats.sum()), {}, 0, 0)}}
+        for level in range(1, depth):
+            level_seats = np.bincount(leaf_parents[level], weights=n_seats, minlength=n_regions[level - 1])
+            self.regions[level] = {
+                name: Electoral_Region(self, name, level, 0, int(s), {}, 0, 0)
+                for name, s in zip(get_region_names(level, n_regions[level - 1]), level_seats)
+            }
+            parent_index = get_parent_index(n_regions[level - 1], n_regions[level - 2] if level > 1 else 1)
+            parents = list(self.regions[level - 1].values())
+            for parent in parents:
+                parent.subregions = []
+            for region, p in zip(self.regions[level].values(), parent_index):
+                parents[p].subregions.append(region)
+
+        vote_matrix = Sparse_Vote_Matrix.from_triplets(
+            get_region_names(depth, n_leaves), self.parties, rows, columns, votes, census, n_seats,
+            (census * 0.005).astype(np.int64), (census * 0.01).astype(np.int64),
+        )
+        parent_names = list(self.regions[depth - 1])
+        self.add_sparse_level(vote_matrix, [parent_names[p] for p in leaf_parents[depth - 1]], update_parents=True)
+        if not sparse:
+            self._densify_level(depth)
+
+    @staticmethod
+    def _generate_entries(rng, n_parties, n_national_parties, level_1_index):
+        """
+        Return the rows (regions of the highest level), columns (parties) and
+        weights of the parties that run in every region.
+        """
+        n_leaves = len(level_1_index)
+        national_weights = 1 / np.arange(1, n_national_parties + 1) ** 1.2
+        rows = [np.repeat(np.arange(n_leaves), n_national_parties)]
+        columns = [np.tile(np.arange(n_national_parties), n_leaves)]
+        weights = [np.tile(national_weights, n_leaves)]
+
+        # Regional parties are assigned to the regions of level 1 in turns
+        n_level_1 = int(level_1_index.max()) + 1
+        regional_parties = np.arange(n_national_parties, n_parties)
+        regional_weights = national_weights[0] * rng.uniform(0.02, 0.5, len(regional_parties))
+        leaves = np.argsort(level_1_index, kind='stable')
+        bounds = np.searchsorted(level_1_index[leaves], np.arange(n_level_1 + 1))
+        for g in range(min(n_level_1, len(regional_parties))):
+            parties = regional_parties[g::n_level_1]
+            group_leaves = leaves[bounds[g]:bounds[g + 1]]
+            rows.append(np.repeat(group_leaves, len(parties)))
+            columns.append(np.tile(parties, len(group_leaves)))
+            weights.append(np.tile(regional_weights[g::n_level_1], len(group_leaves)))
+
+        rows, columns, weights = np.concatenate(rows), np.concatenate(columns), np.concatenate(weights)
+        return rows, columns, weights * rng.lognormal(0, 0.3, len(weights))
+
+    def _densify_level(self, level):
+        """
+        Replace the regions of a level by ordinary Electoral_Region objects.
+        """
+        regions = {}
+        for name, region in self.regions[level].items():
+            regions[name] = Electoral_Region(self, name, level, region.census, region.n_seats, dict(region.votes),
+                                             region.nota, region.spoilt_votes)
+        for parent in self.regions[level - 1].values():
+            parent.subregions = [regions[r.name] for r in parent.subregions]
+        self.regions[level] = regions
+        self._sparse_vote_matrices = {}
+        self._vote_matrices = {}
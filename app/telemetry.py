@@ -0,0 +1,314 @@
+"""
+Instrumentation of the dashboard, exposed in the Prometheus text format at
+METRICS_PATH of the Flask server (see install):
+
+    dash_callback_calls_total{callback, status}
+        Calls of the instrumented Dash callbacks ('ok' or 'error').
+    dash_callback_duration_seconds{callback}
+        Latency of the callbacks, from the call to the serialized response.
+    dash_callback_phase_duration_seconds{callback, phase}
+        Time of every callback spent in each of PHASES.
+    apportionment_calls_total{method}
+        Regions apportioned with every method.
+    cache_requests_total{cache, result}, cache_hit_ratio{cache}
+        Hits and misses of the caches of the elections.
+
+Callbacks are instrumented with the instrument_callback decorator, and the
+functions they call are assigned to a phase with the timed decorator. Phases
+are exclusive: the time of a timed function called from another one (e.g.
+compute_result inside the construction of a comparisons.Comparison_Matrix)
+only counts towards the inner phase. The time of a callback that is not
+spent in any timed function goes to 'other', and the time between the end of
+the callback and the end of the request (mostly the JSON serialization of the
+figures by Dash) to 'serialization'.
+
+The metrics live in the memory of every process, so with several gunicorn
+workers every scrape only sees the worker that serves it.
+"""
+import functools
+import hmac
+import math
+import threading
+import time
+
+METRICS_PATH = '/metrics'
+PHASES = ['system', 'compute_result', 'aggregation', 'figures', 'serialization', 'other']
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Metrics included in render, in order of creation
+REGISTRY = []
+
+# Phases of the callback being run by the current thread
+_local = threading.local()
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    labels = list(zip(labelnames, labelvalues)) + list(extra)
+    if not labels:
+        return ''
+    escape = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+    return '{' + ','.join('{}="{}"'.format(name, str(value).translate(escape)) for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter():
+    """
+    Monotonically increasing value for every combination of labels.
+    """
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def get(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+    def samples(self):
+        """
+        Yield (name, labels, value) for every sample of the metric.
+        """
+        # Snapshot under the lock, since other threads may add labels meanwhile
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            yield self.name, _format_labels(self.labelnames, labelvalues), value
+
+
+class Histogram():
+    """
+    Distribution of the observed values for every combination of labels, as
+    cumulative counts of the values below every bucket bound.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            if labelvalues not in self._values:
+                self._values[labelvalues] = [[0] * len(self.buckets), 0, 0.0]
+            counts, _, _ = entry = self._values[labelvalues]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            entry[1] += 1
+            entry[2] += value
+
+    def get(self, *labelvalues):
+        """
+        Return the number and the sum of the observed values.
+        """
+        with self._lock:
+            _, count, total = self._values.get(labelvalues, (None, 0, 0.0))
+        return count, total
+
+    def samples(self):
+        # The entries are copied, since observe updates them in place
+        with self._lock:
+            items = sorted((labelvalues, (list(counts), count, total)) for labelvalues, (counts, count, total) in self._values.items())
+        for labelvalues, (counts, count, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield self.name + '_bucket', _format_labels(self.labelnames, labelvalues, [('le', _format_value(bound))]), cumulative
+            yield self.name + '_count', _format_labels(self.labelnames, labelvalues), count
+            yield self.name + '_sum', _format_labels(self.labelnames, labelvalues), total
+
+
+class Gauge():
+    """
+    Value computed when the metrics are rendered: function returns a
+    dictionary whose keys are tuples of label values.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames, function):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        REGISTRY.append(self)
+
+    def samples(self):
+        for labelvalues, value in sorted(self.function().items()):
+            yield self.name, _format_labels(self.labelnames, labelvalues), value
+
+
+CALLBACK_CALLS = Counter('dash_callback_calls_total', 'Calls of the Dash callbacks.', ['callback', 'status'])
+CALLBACK_SECONDS = Histogram('dash_callback_duration_seconds', 'Latency of the Dash callbacks, including serialization.',
+                             ['callback'])
+PHASE_SECONDS = Histogram('dash_callback_phase_duration_seconds', 'Time of the Dash callbacks spent in every phase.',
+                          ['callback', 'phase'])
+APPORTIONMENTS = Counter('apportionment_calls_total', 'Regions apportioned with every method.', ['method'])
+CACHE_REQUESTS = Counter('cache_requests_total', 'Requests to the caches of the elections.', ['cache', 'result'])
+
+
+def get_cache_hit_ratios():
+    totals = {}
+    for (cache, result), value in list(CACHE_REQUESTS._values.items()):
+        hits, requests = totals.get(cache, (0, 0))
+        totals[cache] = (hits + value * (result == 'hit'), requests + value)
+    return {(cache,): hits / requests for cache, (hits, requests) in totals.items()}
+
+
+CACHE_HIT_RATIO = Gauge('cache_hit_ratio', 'Fraction of the requests to the caches of the elections that are hits.',
+                        ['cache'], get_cache_hit_ratios)
+
+
+def count_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache, 'hit' if hit else 'miss')
+
+
+def render():
+    """
+    Return all the metrics of the REGISTRY in the Prometheus text format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+        for name, labels, value in metric.samples():
+            lines.append('{}{} {}'.format(name, labels, _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+class phase():
+    """
+    Context manager that assigns the time of its block to a phase of the
+    callback being run by the current thread. Outside of an instrumented
+    callback it does nothing.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.stack = getattr(_local, 'stack', None)
+        if self.stack is not None:
+            # [phase, start, time of the nested phases]
+            self.stack.append([self.name, time.perf_counter(), 0.0])
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.stack is not None:
+            name, start, nested = self.stack.pop()
+            elapsed = time.perf_counter() - start
+            if self.stack:
+                self.stack[-1][2] += elapsed
+            _local.totals[name] = _local.totals.get(name, 0.0) + elapsed - nested
+
+
+def timed(phase_name):
+    """
+    Decorator that assigns the time of a function to the given phase when it
+    is called from an instrumented callback.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, 'stack', None) is None:
+                return function(*args, **kwargs)
+            with phase(phase_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_callback(function):
+    """
+    Decorator of a Dash callback (applied below app.callback) that counts its
+    calls and records its latency and the time of its phases.
+    """
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        _local.stack, _local.totals = [], {}
+        status = 'error'
+        start = time.perf_counter()
+        try:
+            value = function(*args, **kwargs)
+            status = 'ok'
+            return value
+        finally:
+            elapsed = time.perf_counter() - start
+            totals = _local.totals
+            _local.stack, _local.totals = None, None
+            totals['other'] = max(0.0, elapsed - sum(totals.values()))
+            for phase_name, seconds in totals.items():
+                PHASE_SECONDS.observe(seconds, name, phase_name)
+            CALLBACK_CALLS.inc(name, status)
+            _finish_callback(name, start, elapsed)
+    return wrapper
+
+
+def _finish_callback(name, start, elapsed):
+    """
+    Leave the callback for install to measure the serialization, or record
+    its latency if it is not being run by a request.
+    """
+    from flask import g, has_request_context
+    if has_request_context():
+        g.telemetry_callback = (name, start + elapsed)
+    else:
+        CALLBACK_SECONDS.observe(elapsed, name)
+
+
+def install(server):
+    """
+    Serve the metrics at METRICS_PATH of a Flask server, and measure the
+    serialization and total latency of the instrumented callbacks it runs.
+    """
+    from flask import Response, g
+
+    @server.before_request
+    def start_request():
+        g.telemetry_start = time.perf_counter()
+
+    @server.after_request
+    def finish_request(response):
+        callback = g.pop('telemetry_callback', None)
+        if callback is not None and 'telemetry_start' in g:
+            name, callback_end = callback
+            end = time.perf_counter()
+            PHASE_SECONDS.observe(end - callback_end, name, 'serialization')
+            CALLBACK_SECONDS.observe(end - g.telemetry_start, name)
+        return response
+
+    @server.route(METRICS_PATH)
+    def serve_metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def is_authorized(token):
+    """
+    Return whether the current Flask request carries the given token of an
+    admin endpoint, in the Authorization header ("Bearer <token>") or in the
+    'token' parameter.
+    """
+    from flask import request
+    header = request.headers.get('Authorization', '')
+    # Not str.removeprefix, which needs Python 3.9
+    given = (header[len('Bearer '):] if header.startswith('Bearer ') else header) or request.args.get('token', '')
+    return hmac.compare_digest(given.encode(), token.encode())
@@ -0,0 +1,197 @@
+"""
+Precomputed tooltips of the map.
+
+Hovering on the map is by far the most frequent callback, so instead of
+computing the result of the hovered region on every hover event, the data of
+the tooltips of all the regions of the map is computed once from the results
+of a configuration (see get_tooltip_data), kept in a Tooltip_Cache, and every
+hover event is a lookup that renders a plain figure dictionary (see
+plot_tooltip), without building plotly objects.
+"""
+from collections import Counter, OrderedDict
+import os
+import sys
+import threading
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath)
+
+from regions import iter_subregions  # noqa: E402
+from telemetry import count_cache, timed  # noqa: E402
+
+TOOLTIP_CACHE_SIZE = 32
+N_LOST_VOTES_PARTIES = 4
+DEFAULT_COLOR = '#7D7D7D'
+
+
+class Tooltip_Cache():
+    """
+    Thread-safe LRU cache of the tooltip data of the most recently rendered
+    configurations.
+
+    ...
+    Attributes
+    ----------
+    size: int
+        The maximum number of configurations kept.
+
+    Methods
+    -------
+    get(key): dict
+        Return the tooltip data of a configuration, or None.
+    put(key, data)
+        Store the tooltip data of a configuration.
+    """
+    def __init__(self, size=TOOLTIP_CACHE_SIZE):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            count_cache('tooltips', key in self._data)
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, data):
+        with self._lock:
+            self._data[key] = data
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+
+def _get_seats(result, region):
+    seats = Counter()
+    for subregion in iter_subregions(region, result.level):
+        seats += result.result[subregion.name]
+    return dict(seats)
+
+
+@timed('aggregation')
+def get_tooltip_data(result, other=None, grouping=None):
+    """
+    Given the regions.Election_Result of a configuration (and the one of
+    system 2 if the seat difference is shown), return a dictionary whose keys
+    are the locations of the map and values are the data of their tooltips:
+        'title': The name of the region (or of its district, if the results
+            were computed on a groupings.District_Grouping).
+        'seats': Keys are parties, values are their seats in the region.
+        'other_seats': The same for other, if it is given.
+        'lost_votes': If other isn't given, the N_LOST_VOTES_PARTIES parties
+            with most lost votes in the region, as a list of (party, votes).
+        'n_lost_votes', 'total_votes': The lost votes and total votes of the
+            region, if other isn't given.
+    The tooltips of the 'System Comparison' metric have their own data (see
+    comparisons.Comparison_Matrix.get_tooltip_data).
+    The regions of the map are those of the lowest level of the results, and
+    the tooltips show the part of the results of the whole country that
+    belongs to every region.
+    """
+    if grouping is not None:
+        regions = result.region.subregions
+        level = 1
+    else:
+        level = min(result.level, other.level) if other else result.level
+        regions = list(iter_subregions(result.region, level))
+
+    data = {}
+    for region in regions:
+        region_data = {'title': region.name, 'seats': _get_seats(result, region)}
+        if other:
+            region_data['other_seats'] = _get_seats(other, region)
+        else:
+            lost_votes = result.get_lost_votes(region, level)
+            region_data['lost_votes'] = [list(x) for x in lost_votes.most_common(N_LOST_VOTES_PARTIES)]
+            region_data['n_lost_votes'] = sum(lost_votes.values())
+            region_data['total_votes'] = region.total_votes
+        data[region.name] = region_data
+
+    if grouping is not None:
+        return {name: data[grouping.get_district(name)] for name in grouping.election.regions[grouping.level]}
+    return data
+
+
+def _get_piechart_trace(seats, colors, domain):
+    return {
+        'type': 'pie',
+        'labels': list(seats),
+        'values': list(seats.values()),
+        'marker': {'colors': [colors.get(party, DEFAULT_COLOR) for party in seats]},
+        'hole': .4,
+        'hovertemplate': '%{label} %{percent}<extra></extra>',
+        'textinfo': 'value',
+        'textfont': {'size': 10},
+        'textposition': 'inside',
+        'domain': {'x': domain, 'y': [0, 1]},
+    }
+
+
+def _plot_comparison_tooltip(region_data):
+    return {
+        'data': [{
+            'type': 'heatmap',
+            'z': region_data['seat_differences'],
+            'x': region_data['labels'],
+            'y': region_data['labels'],
+            'colorscale': 'Reds',
+            'zmin': 0,
+            'showscale': False,
+            'hovertemplate': '%{y} vs %{x}: %{z} seats<extra></extra>',
+        }],
+        'layout': {
+            'title': {'text': region_data['title']},
+            'font': {'size': 10},
+            'margin': {'t': 40, 'b': 10, 'l': 0, 'r': 0},
+            'yaxis': {'autorange': 'reversed'},
+            'width': 300,
+            'height': 300,
+        },
+    }
+
+
+@timed('figures')
+def plot_tooltip(region_data, colors):
+    """
+    Return the figure (a dictionary, as accepted by dcc.Graph) of the
+    tooltip of a region, given its data (see get_tooltip_data) and the colors
+    of the parties. It shows the same as regions.Election_Result.plot_tooltip:
+    the pie charts of the seats of both systems or, with a single system, its
+    pie chart and a bar chart of the parties with most lost votes. With the
+    data of a system comparison, it shows the same heatmap as
+    comparisons.Comparison_Matrix.plot_tooltip.
+    """
+    title = region_data['title']
+    if 'seat_differences' in region_data:
+        return _plot_comparison_tooltip(region_data)
+    data = [_get_piechart_trace(region_data['seats'], colors, [0, 0.45])]
+    layout = {}
+    if 'other_seats' in region_data:
+        data.append(_get_piechart_trace(region_data['other_seats'], colors, [0.55, 1]))
+    else:
+        parties = [party for party, _ in region_data['lost_votes']]
+        data.append({
+            'type': 'bar',
+            'x': parties,
+            'y': [votes for _, votes in region_data['lost_votes']],
+            'marker': {'color': [colors.get(party, DEFAULT_COLOR) for party in parties]},
+            'xaxis': 'x',
+            'yaxis': 'y',
+        })
+        layout['xaxis'] = {'domain': [0.55, 1], 'anchor': 'y', 'showticklabels': False}
+        layout['yaxis'] = {'domain': [0, 1], 'anchor': 'x'}
+        n_lost_votes, total_votes = region_data['n_lost_votes'], region_data['total_votes']
+        # Regions without votes have no lost votes
+        title += '\t ({:,} -- {:.2f}%)'.format(n_lost_votes, 100*n_lost_votes/total_votes if total_votes else 0)
+
+    layout.update({
+        'title': {'text': title},
+        'margin': {'t': 40, 'b': 10, 'l': 0, 'r': 0},
+        'uniformtext': {'minsize': 8, 'mode': 'hide'},
+        'width': 300,
+        'height': 150,
+        'showlegend': False,
+    })
+    return {'data': data, 'layout': layout}
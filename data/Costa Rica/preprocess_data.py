@@ -1,8 +1,11 @@
-from collections import Counter
-import geopandas as gpd
 import json
-import pandas as pd
-import pickle
+import os
+import sys
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(myPath, '..'))
+
+import ingest  # noqa: E402
 
 region_seats = {
     'Alajuela': 11,
@@ -14,10 +17,26 @@ region_seats = {
     'San José': 19,
 }
 
-df = pd.read_csv('2018/Alajuela.csv')
+MAPPING = ingest.Country_Mapping(
+    country='Costa Rica',
+    columns={},
+    regions={1: list(region_seats)},
+    seats=region_seats,
+)
+
+SOURCES = [
+    ingest.Source(
+        '2018', ingest.read_region_files, [os.path.join(myPath, '2018', region + '.csv') for region in region_seats],
+        os.path.join(ingest.APP_DATA_DIR, 'Costa Rica', 'election_data.pkl'), MAPPING,
+        party_column='Partido político', votes_column='Votos', party_filter_column='%',
+        totals={'census': 'Votos recibidos', 'nota': 'Nulos y blancos'},
+    ),
+]
 
 
 def preprocess_geojsons():
+    import geopandas as gpd
+
     # Level 1
     gdf = gpd.read_file("cri_adm_2020_shp/cri_admbnda_adm1_2020.shp")
     gdf.to_crs("EPSG:4326", inplace=True)
@@ -37,62 +56,8 @@ def preprocess_geojsons():
         json.dump(map_geojson, f)
 
 
-def preprocess_electoral_data():
-    level_0_data = {
-        'region_name': 'Costa Rica',
-        'level': 0,
-        'census': 0,
-        'n_seats': 0,
-        'votes': Counter(),
-        'nota': 0,
-        'split_votes': 0,
-    }
-    level_1_data = dict()
-
-    parties = set()
-
-    for region in region_seats:
-        df = pd.read_csv('2018/' + region + '.csv')
-        df.set_index('Partido político', inplace=True)
-
-        census = int(df.loc['Votos recibidos', 'Votos'].strip().replace('.', ''))
-        nota = int(df.loc['Nulos y blancos', 'Votos'].strip().replace('.', ''))
-
-        votes = dict()
-        for idx, row in df.iterrows():
-            if type(row['%']) == str and len(row['%']) > 0:
-                votes[idx] = int(row['Votos'].strip().replace('.', ''))
-                parties.add(idx)
-
-        level_1_data[region] = {
-            'region_name': region,
-            'level': 1,
-            'census': census,
-            'n_seats': region_seats[region],
-            'votes': votes,
-            'nota': nota,
-            'split_votes': 0,
-        }
-
-        level_0_data['census'] += census
-        level_0_data['n_seats'] += region_seats[region]
-        level_0_data['votes'] += votes
-        level_0_data['nota'] += nota
-
-    result = {
-        'parties': list(parties),
-        'data': {
-            0: level_0_data,
-            1: level_1_data,
-        }
-    }
-
-    output_filename = '../../app/data/Costa Rica/election_data'
-    output_filename += '.pkl'
-    with open(output_filename, "wb") as f:
-        pickle.dump(result, f, protocol=5)
-
-
 if __name__ == "__main__":
-    preprocess_geojsons()
-    preprocess_electoral_data()
+    if '--geojsons' in sys.argv[1:]:
+        preprocess_geojsons()
+    else:
+        ingest.main(['Costa Rica'] + sys.argv[1:])
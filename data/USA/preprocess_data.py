@@ -1,11 +1,55 @@
-from collections import Counter
-import geopandas as gpd
 import json
-import pandas as pd
-import pickle
+import os
+import sys
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(myPath, '..'))
+
+import ingest  # noqa: E402
+
+# Cycles of the elections to the House of Representatives in 1976-2020-house.csv
+YEARS = list(range(1976, 2021, 2))
+
+
+def get_mapping(year):
+    return ingest.Country_Mapping(
+        country='USA',
+        columns={
+            'region': ['parent', 'district'],
+            'parent': 'state',
+            'votes': 'candidatevotes',
+            'census': 'totalvotes',
+        },
+        cases={'parent': 'title', 'party': 'capitalize'},
+        seats=1,
+        overrides={
+            # There's no data; only that there's Republican party
+            'Florida_25': {'census': 1, 'votes': {'Republican': 1}, 'nota': 0},
+        } if year == 2020 else {},
+    )
+
+
+# The CSV file is split by year in a single pass, reading it in chunks
+HOUSE = ingest.Csv_Partition(
+    os.path.join(myPath, '1976-2020-house.csv'), 'year', os.path.join(myPath, 'house'),
+    query="state != 'DISTRICT OF COLUMBIA'", encoding='ISO-8859-1',
+    usecols=['year', 'state', 'district', 'party', 'candidatevotes', 'totalvotes'],
+)
+
+SOURCES = [
+    ingest.Source(
+        str(year), ingest.read_csv, HOUSE.get_path(year),
+        os.path.join(ingest.APP_DATA_DIR, 'USA', 'election_data_{}.pkl'.format(year)), get_mapping(year),
+        partition=HOUSE,
+    )
+    for year in YEARS
+]
 
 
 def preprocess_geojsons():
+    import geopandas as gpd
+    import pandas as pd
+
     # Level 2
     districts_gdf = gpd.read_file("districts114_simplified/districts114.shp")
     districts_gdf = districts_gdf[districts_gdf['STATENAME'] != 'District Of Columbia']
@@ -39,100 +83,8 @@ def preprocess_geojsons():
         json.dump(usa_geojson, f)
 
 
-def preprocess_electoral_data():
-    votes_df = pd.read_csv('1976-2020-house.csv', encoding="ISO-8859-1")
-
-    # Select only the 2020 elections for now
-    votes_df = votes_df[(votes_df['year'] == 2020)]
-
-    columns_to_keep = ['state', 'district', 'party', 'candidatevotes', 'totalvotes']
-    votes_df = votes_df[columns_to_keep]
-
-    # Drop 'District of Columbia'
-    votes_df = votes_df[votes_df.state != 'DISTRICT OF COLUMBIA']
-
-    # Capitalize names
-    votes_df['state'] = votes_df['state'].str.title()
-    votes_df['party'] = votes_df['party'].str.capitalize()
-
-    parties = list(pd.unique(votes_df['party']))
-
-    level_0_data = {
-        'region_name': 'USA',
-        'level': 0,
-        'census': 0,
-        'n_seats': 0,
-        'votes': Counter(),
-        'nota': 0,
-        'split_votes': 0,
-    }
-
-    level_1_regions = list(pd.unique(votes_df['state']))
-    level_1_data = {}
-    for region in level_1_regions:
-        level_1_data[region] = {
-            'region_name': region,
-            'level': 1,
-            'census': 0,
-            'n_seats': 0,
-            'votes': Counter(),
-            'nota': 0,
-            'split_votes': 0,
-        }
-
-    level_2_data = {}
-    votes_df['name'] = votes_df['state'] + '_' + votes_df['district'].astype(str)
-    for district_name in pd.unique(votes_df['name']):
-        district_df = votes_df[votes_df['name'] == district_name]
-        census = district_df['totalvotes'].iloc[0]
-        votes = {}
-        for idx, row in district_df.iterrows():
-            votes[row['party']] = row['candidatevotes']
-        nota = census - sum(votes.values())
-
-        if district_name == 'Florida_25':  # There's no data; only that there's Republican party
-            census = 1
-            votes = {'Republican': 1}
-            nota = 0
-
-        level_2_data[district_name] = {
-            'region_name': district_name,
-            'level': 2,
-            'census': census,
-            'n_seats': 1,
-            'votes': votes,
-            'nota': nota,
-            'split_votes': 0,
-        }
-
-        # Add level 1 data
-        lvl1_name = district_df['state'].iloc[0]
-        level_1_data[lvl1_name]['census'] += census
-        level_1_data[lvl1_name]['n_seats'] += 1
-        level_1_data[lvl1_name]['votes'] += votes
-        level_1_data[lvl1_name]['nota'] += nota
-
-        # Add level 0 data
-        level_0_data['census'] += census
-        level_0_data['n_seats'] += 1
-        level_0_data['votes'] += votes
-        level_0_data['nota'] += nota
-
-    result = {
-        'parties': parties,
-        'data': {
-            0: level_0_data,
-            1: level_1_data,
-            2: level_2_data
-        }
-    }
-
-    output_filename = '../../app/data/USA/election_data'
-    output_filename += '.pkl'
-    with open(output_filename, "wb") as f:
-        pickle.dump(result, f, protocol=5)
-
-
 if __name__ == "__main__":
-    preprocess_geojsons()
-    # preprocess_electoral_data()
+    if '--geojsons' in sys.argv[1:]:
+        preprocess_geojsons()
+    else:
+        ingest.main(['USA'] + sys.argv[1:])
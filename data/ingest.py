@@ -0,0 +1,492 @@
+"""
+Ingestion of the electoral data under data/<Country>/ into the pickle files of
+app/data/<Country>/ that are read by elections.Election._parse_data, e.g.
+
+    python data/ingest.py Spain --processes 4
+
+Every data/<Country>/preprocess_data.py declares a Country_Mapping (which
+columns hold the region names, census, votes... and the aliases of the region
+names) and a list SOURCES of Source objects, one per election. Every source is
+read into a long table with one row per region and party, whose votes are
+aggregated to the lower levels with group-bys. The sources are processed in
+parallel, and only those whose files, mapping or reader changed since the
+last build (or whose output is missing) are rebuilt: the sha256 of every
+source is stored in MANIFEST_FILE.
+
+Sources can be partitions of a larger CSV file (see Csv_Partition), which is
+streamed in chunks and split in a single pass before the sources are built.
+"""
+import argparse
+from collections import Counter
+import glob
+import hashlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DATA_DIR = os.path.join(DATA_DIR, '..', 'app', 'data')
+MANIFEST_FILE = os.path.join(DATA_DIR, 'ingest_manifest.json')
+# Numeric fields with a single value per region
+REGION_FIELDS = ['census', 'n_seats', 'nota', 'split_votes']
+
+
+class Country_Mapping():
+    """
+    Declarative description of the tables of the elections of a country.
+
+    ...
+    Attributes
+    ----------
+    country: str
+        The name of the country (the region of level 0).
+    columns: dict
+        Keys are fields ('region', 'parent', 'party', 'votes', 'seats',
+        'census', 'n_seats', 'nota', 'split_votes') and values are the columns
+        of the table that hold them. The value of 'region' can also be a list
+        of fields or columns, whose values (after changing their case) are
+        joined with '_'.
+    aliases: dict
+        Keys are 'region' or 'parent', values are lists of (regex, name): the
+        names that match the regex (re.search) are replaced by name, in order.
+    cases: dict
+        Keys are fields, values are the str method applied to them, e.g.
+        'title' or 'capitalize'.
+    regions: dict
+        Keys are levels, values are the names of all their regions in the
+        order of the output. Other names raise a ValueError.
+    seats: int or dict
+        The number of seats of every region of the highest level, if the table
+        doesn't have them: the same for all or a dictionary by region.
+    overrides: dict
+        Keys are region names, values are dictionaries that replace the given
+        fields of the region (e.g. {'votes': {...}, 'census': 1}).
+    """
+    def __init__(self, country, columns, aliases=None, cases=None, regions=None, seats=None, overrides=None):
+        self.country = country
+        self.columns = columns
+        self.aliases = aliases or {}
+        self.cases = cases or {}
+        self.regions = regions or {}
+        self.seats = seats
+        self.overrides = overrides or {}
+
+    def normalize(self, table):
+        """
+        Return the table with a column per field, the case of the fields
+        changed and the aliases of the region names replaced. Party names are
+        kept as they are.
+        """
+        table = table.rename(columns={column: field for field, column in self.columns.items() if isinstance(column, str)})
+        for field, case in self.cases.items():
+            table[field] = getattr(table[field].str, case)()
+        if isinstance(self.columns.get('region'), list):
+            table['region'] = table[self.columns['region']].astype(str).agg('_'.join, axis=1)
+        for field in ['region', 'parent']:
+            if field in table and pd.api.types.is_string_dtype(table[field]):
+                table[field] = table[field].str.strip()
+        for field, aliases in self.aliases.items():
+            table[field] = replace_aliases(table[field], aliases)
+        return table
+
+
+class Source():
+    """
+    A table of results of an election, read with one of the read_* functions
+    of this module.
+
+    ...
+    Attributes
+    ----------
+    name: str
+        The name of the election, e.g. '2019-11-10'.
+    read: function
+        Given the paths and the options, return the table.
+    paths: list
+        The files of the table.
+    output: str
+        The pickle file that is built.
+    mapping: Country_Mapping
+        How the table is turned into the regions of the election.
+    options: dict
+        The keyword arguments of read.
+    partition: Csv_Partition
+        If given, the paths are files written by this partition, which is
+        updated before the source is built.
+    """
+    def __init__(self, name, read, paths, output, mapping, partition=None, **options):
+        self.name = name
+        self.read = read
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.output = output
+        self.mapping = mapping
+        self.partition = partition
+        self.options = options
+
+    def get_hash(self):
+        """
+        Return the sha256 of the files, the mapping, the options and the code
+        of this module.
+        """
+        sha = hashlib.sha256()
+        for path in self.paths + [os.path.abspath(__file__)]:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(2**20), b''):
+                    sha.update(chunk)
+        sha.update(repr((self.read.__name__, sorted(self.options.items()), sorted(vars(self.mapping).items()))).encode())
+        return sha.hexdigest()
+
+
+class Csv_Partition():
+    """
+    A CSV file split into one CSV file per value of a column, like the
+    results of all the years of an election in a single table. The file is
+    streamed in chunks, so it is never loaded in memory as a whole.
+
+    ...
+    Attributes
+    ----------
+    path: str
+        The CSV file.
+    column: str
+        The column whose values identify the partitions.
+    directory: str
+        Where the partitions are written, as <value>.csv.
+    query: str
+        If given, only the rows that match it are kept (see
+        pandas.DataFrame.query).
+    chunksize: int
+        The number of rows of every chunk.
+    options: dict
+        The keyword arguments of pandas.read_csv, e.g. usecols or encoding.
+    """
+    def __init__(self, path, column, directory, query=None, chunksize=100000, **options):
+        self.path = path
+        self.column = column
+        self.directory = directory
+        self.query = query
+        self.chunksize = chunksize
+        self.options = options
+
+    def get_path(self, value):
+        return os.path.join(self.directory, '{}.csv'.format(value))
+
+    def get_hash(self):
+        sha = hashlib.sha256()
+        for path in [self.path, os.path.abspath(__file__)]:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(2**20), b''):
+                    sha.update(chunk)
+        sha.update(repr((self.column, self.query, sorted(self.options.items()))).encode())
+        return sha.hexdigest()
+
+    def write(self):
+        """
+        Write the partitions, replacing the previous ones. Return the sorted
+        list of values of the column.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for path in glob.glob(os.path.join(self.directory, '*.csv')):
+            os.remove(path)
+        values = set()
+        for chunk in pd.read_csv(self.path, chunksize=self.chunksize, **self.options):
+            if self.query:
+                chunk = chunk.query(self.query)
+            for value, rows in chunk.groupby(self.column, sort=False):
+                rows.to_csv(self.get_path(value), mode='a', header=value not in values, index=False)
+                values.add(value)
+        return sorted(values)
+
+
+def replace_aliases(names, aliases):
+    """
+    Given a pandas.Series of names and a list of (regex, name), replace the
+    names that match every regex, in order. Names are only replaced once.
+    """
+    names = names.copy()
+    pending = pd.Series(True, index=names.index)
+    for pattern, name in aliases:
+        matches = pending & names.str.contains(pattern, regex=True, na=False)
+        names[matches] = name
+        pending &= ~matches
+    return names
+
+
+def read_wide_spreadsheet(paths, header, parties_row, party_start, n_regions, usecols=None):
+    """
+    Read a spreadsheet with one row per region and a pair of columns (votes,
+    seats) per party, like the results of the Spanish Ministry of the
+    Interior. The region columns are named by the row header (0-indexed), the
+    parties by the row parties_row, and the columns of the parties start at
+    the column (letter) party_start.
+    """
+    sheet = pd.read_excel(paths[0], header=None, usecols=usecols, nrows=header + 1 + n_regions)
+    region_columns = column_index(party_start) - column_index(usecols.split(':')[0] if usecols else 'A')
+    regions = sheet.iloc[header + 1:, :region_columns]
+    regions.columns = sheet.iloc[header, :region_columns].str.strip()
+    parties = np.array([p.strip() if isinstance(p, str) else p for p in sheet.iloc[parties_row, region_columns::2]], dtype=object)
+    votes = sheet.iloc[header + 1:, region_columns::2].to_numpy(dtype=np.int64)
+    seats = sheet.iloc[header + 1:, region_columns + 1::2].to_numpy(dtype=np.int64)
+
+    table = regions.loc[regions.index.repeat(len(parties))].reset_index(drop=True)
+    table['party'] = np.tile(parties, len(regions))
+    table['votes'] = votes.ravel()
+    table['seats'] = seats.ravel()
+    return table
+
+
+def read_region_files(paths, party_column, votes_column, party_filter_column, totals, thousands='.'):
+    """
+    Read one file per region (named after it) with one row per party, plus
+    the rows of the totals: a dictionary whose keys are fields (e.g. 'census')
+    and values are the labels of their rows. The party rows are those with a
+    value in party_filter_column.
+    """
+    tables = []
+    for path in paths:
+        df = pd.read_csv(path, dtype=str, encoding='utf-8-sig').set_index(party_column)
+        values = df[votes_column].str.strip().str.replace(thousands, '', regex=False)
+        is_party = df[party_filter_column].fillna('').str.len() > 0
+        table = pd.DataFrame({'party': df.index[is_party], 'votes': values[is_party].astype(np.int64).to_numpy()})
+        table['region'] = os.path.splitext(os.path.basename(path))[0]
+        for field, label in totals.items():
+            table[field] = int(values[label])
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+
+def read_csv(paths, query=None, **kwargs):
+    """
+    Read a table with one row per region and party, keeping the rows that
+    match query (see pandas.DataFrame.query).
+    """
+    table = pd.concat([pd.read_csv(path, **kwargs) for path in paths], ignore_index=True)
+    return table.query(query) if query else table
+
+
+def column_index(letters):
+    """
+    Return the 0-based index of a spreadsheet column, e.g. 'A' -> 0, 'Q' -> 16.
+    """
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def _get_region_data(name, level, row, votes):
+    return {
+        'region_name': name,
+        'level': level,
+        'census': int(row['census']),
+        'n_seats': int(row['n_seats']),
+        'votes': votes,
+        'nota': int(row['nota']),
+        'split_votes': int(row['split_votes']),
+    }
+
+
+def build_election(table, mapping):
+    """
+    Given a table (one row per region and party) and its Country_Mapping,
+    return the dictionary stored in the pickle files: {'parties': [...],
+    'data': {level: ...}}, where the data of level 0 is the data of the
+    country and the data of the other levels are dictionaries by region name.
+    The votes of the regions of the highest level keep all the parties in
+    their rows; those of the lower levels are collections.Counter objects with
+    the parties with votes.
+    """
+    table = mapping.normalize(table)
+    for field in REGION_FIELDS + ['votes', 'seats']:
+        if field in table:
+            table[field] = pd.to_numeric(table[field])
+    depth = 2 if 'parent' in table else 1
+    by_region = table.groupby('region', sort=False)
+
+    regions = by_region[(['parent'] if depth == 2 else []) + [f for f in REGION_FIELDS if f in table]].first()
+    if 'seats' in table:
+        regions['n_seats'] = by_region['seats'].sum()
+    elif isinstance(mapping.seats, dict):
+        regions['n_seats'] = regions.index.map(mapping.seats)
+    elif mapping.seats is not None:
+        regions['n_seats'] = mapping.seats
+    party_votes = by_region['votes'].sum()
+    if 'nota' not in table:
+        regions['nota'] = regions['census'] - party_votes
+    if 'split_votes' not in table:
+        regions['split_votes'] = 0
+    if regions[REGION_FIELDS].isna().any().any():
+        raise ValueError("Missing data in regions: {}.".format(', '.join(regions.index[regions[REGION_FIELDS].isna().any(axis=1)])))
+
+    votes = {region: dict(zip(group['party'], group['votes'].tolist())) for region, group in by_region}
+    for region, fields in mapping.overrides.items():
+        if region in votes:
+            votes[region] = fields.get('votes', votes[region])
+            for field, value in fields.items():
+                if field != 'votes':
+                    regions.loc[region, field] = value
+    parties = list(pd.unique(table['party']))
+
+    # The lower levels aggregate the regions, including their overrides
+    long_votes = pd.DataFrame(
+        [(region, party, v) for region, region_votes in votes.items() for party, v in region_votes.items()],
+        columns=['region', 'party', 'votes'],
+    )
+    data = {depth: {region: _get_region_data(region, depth, row, votes[region]) for region, row in regions.iterrows()}}
+    if depth == 2:
+        long_votes['parent'] = long_votes['region'].map(regions['parent'])
+        data[1] = _aggregate(regions, long_votes, 'parent', 1, mapping.regions.get(1))
+    regions['country'] = mapping.country
+    long_votes['country'] = mapping.country
+    data[0] = _aggregate(regions, long_votes, 'country', 0)[mapping.country]
+
+    if depth in mapping.regions:
+        unknown = set(data[depth]) - set(mapping.regions[depth])
+        if unknown:
+            raise ValueError("Unknown regions: {}.".format(', '.join(sorted(unknown))))
+        data[depth] = {region: data[depth][region] for region in mapping.regions[depth] if region in data[depth]}
+    return {'parties': parties, 'data': {level: data[level] for level in range(depth + 1)}}
+
+
+def _aggregate(regions, long_votes, key, level, names=None):
+    """
+    Return the data of the regions of a level, summing the regions of the
+    highest level grouped by the column key. If names are given, the regions
+    are all of them, in that order, and other names raise a ValueError.
+    """
+    totals = regions.groupby(key, sort=False)[REGION_FIELDS].sum()
+    positive = long_votes[long_votes['votes'] > 0]
+    party_votes = positive.groupby([key, 'party'], sort=False, dropna=False)['votes'].sum()
+    if names is not None:
+        unknown = set(totals.index) - set(names)
+        if unknown:
+            raise ValueError("Unknown regions of level {}: {}.".format(level, ', '.join(sorted(unknown))))
+        totals = totals.reindex(names, fill_value=0)
+    votes = {name: Counter() for name in totals.index}
+    for (name, party), v in party_votes.items():
+        votes[name][party] = int(v)
+    return {name: _get_region_data(name, level, row, votes[name]) for name, row in totals.iterrows()}
+
+
+def build_source(source):
+    """
+    Read a source and write its pickle file. Return the output path.
+    """
+    election = build_election(source.read(source.paths, **source.options), source.mapping)
+    os.makedirs(os.path.dirname(source.output), exist_ok=True)
+    with open(source.output, 'wb') as f:
+        pickle.dump(election, f, protocol=5)
+    return source.output
+
+
+def _build(task):
+    source, source_hash = task
+    return build_source(source), source_hash
+
+
+def get_manifest_key(output):
+    return os.path.relpath(os.path.abspath(output), os.path.join(DATA_DIR, '..')).replace(os.sep, '/')
+
+
+def build(sources, processes=None, force=False, manifest_file=MANIFEST_FILE, log=None):
+    """
+    Build the outputs of the sources that changed since the last build (all
+    of them if force is True) with a pool of processes, after updating the
+    partitions they are read from. Sources with missing files (the raw data
+    isn't always in the repository) are skipped. Return the list of outputs
+    that were built.
+    """
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+    changed = False
+    partitions = {id(source.partition): source.partition for source in sources if source.partition is not None}
+    for partition in partitions.values():
+        key = get_manifest_key(partition.directory)
+        if not os.path.exists(partition.path):
+            if log:
+                print('Missing file of {}: {}'.format(key, partition.path), file=log)
+            continue
+        partition_hash = partition.get_hash()
+        if force or manifest.get(key) != partition_hash or not os.path.isdir(partition.directory):
+            values = partition.write()
+            manifest[key] = partition_hash
+            changed = True
+            if log:
+                print('Partitioned: {} ({} partitions)'.format(key, len(values)), file=log)
+
+    tasks = []
+    for source in sources:
+        missing = [path for path in source.paths if not os.path.exists(path)]
+        if missing:
+            if log:
+                print('Missing files of {}: {}'.format(get_manifest_key(source.output), ', '.join(missing)), file=log)
+            continue
+        source_hash = source.get_hash()
+        if force or manifest.get(get_manifest_key(source.output)) != source_hash or not os.path.exists(source.output):
+            tasks.append((source, source_hash))
+        elif log:
+            print('Up to date: {}'.format(get_manifest_key(source.output)), file=log)
+
+    built = []
+    if tasks:
+        processes = min(processes or os.cpu_count() or 1, len(tasks))
+        if processes > 1:
+            with multiprocessing.Pool(processes) as pool:
+                results = list(pool.imap_unordered(_build, tasks))
+        else:
+            results = [_build(task) for task in tasks]
+        for output, source_hash in results:
+            manifest[get_manifest_key(output)] = source_hash
+            built.append(output)
+            if log:
+                print('Built: {}'.format(get_manifest_key(output)), file=log)
+    if tasks or changed:
+        with open(manifest_file, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+    return built
+
+
+def load_sources(country):
+    """
+    Return the SOURCES declared in data/<country>/preprocess_data.py.
+    """
+    path = os.path.join(DATA_DIR, country, 'preprocess_data.py')
+    spec = importlib.util.spec_from_file_location('preprocess_' + re.sub(r'\W', '_', country), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.SOURCES
+
+
+def get_countries():
+    return sorted(os.path.basename(os.path.dirname(path)) for path in glob.glob(os.path.join(DATA_DIR, '*', 'preprocess_data.py')))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python data/ingest.py', description=__doc__.split('e.g.')[0].strip())
+    parser.add_argument('countries', nargs='*', help="Countries to build (default: all of them)")
+    parser.add_argument('--elections', nargs='+', default=None, help="Names of the elections to build (default: all of them)")
+    parser.add_argument('--processes', type=int, default=None, help="Number of processes (default: number of CPUs)")
+    parser.add_argument('--force', action='store_true', help="Rebuild the outputs even if their sources didn't change")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sources = []
+    for country in args.countries or get_countries():
+        sources += [s for s in load_sources(country) if args.elections is None or s.name in args.elections]
+    build(sources, args.processes, args.force, log=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
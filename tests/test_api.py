@@ -0,0 +1,162 @@
+import json
+import os
+import pytest
+import sys
+import time
+
+from flask import Flask
+
+from app import api, elections, electoral_systems, groupings, jobs
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+t_election = elections.Spain_2019_11()
+t_elections = {'Spain': {'2019-11-10': t_election}}
+
+
+@pytest.fixture(params=[0, 2], ids=['inline', 'pool'])
+def client(request):
+    server = Flask(__name__)
+    server.register_blueprint(api.create_api(t_elections, processes=request.param))
+    return server.test_client()
+
+
+def test_list_elections(client):
+    response = client.get(api.API_PREFIX + '/elections')
+    assert response.get_json() == {'Spain': ['2019-11-10']}
+    assert 'batch' in client.get(api.API_PREFIX + '/').get_data(as_text=True)
+
+
+def test_apportion_stored_election(client):
+    system = {'name': 'dHondt', 'level': 2, 'threshold': '3'}
+    response = client.post(api.API_PREFIX + '/elections/Spain/2019-11-10/apportion', json={'system': system, 'by_region': True})
+    assert response.status_code == 200
+    body = response.get_json()
+    expected = t_election.regions[0]['Spain'].compute_result(electoral_systems.System('dHondt', 2, '3')).result
+    assert body['regions']['Madrid'] == expected['Madrid']
+    assert sum(body['seats'].values()) == 350
+
+    response = client.post(api.API_PREFIX + '/elections/Spain/1977/apportion', json={'system': system})
+    assert response.status_code == 400 and 'error' in response.get_json()
+    response = client.post(api.API_PREFIX + '/elections/Spain/2019-11-10/apportion', json={'system': dict(system, level=5)})
+    assert response.status_code == 400
+
+
+def test_apportion_groups(client):
+    url = api.API_PREFIX + '/elections/Spain/2019-11-10/apportion'
+    system = {'name': 'dHondt', 'level': 2, 'threshold': '3'}
+    groups = {'Galicia': ['A Coruña', 'Lugo', 'Ourense', 'Pontevedra']}
+    expected = groupings.District_Grouping(t_election, groups).compute_result(electoral_systems.System('dHondt', 2, '3')).result
+    for body_groups in [groups, 'Galicia: A Coruña, Lugo, Ourense, Pontevedra\n']:
+        body = client.post(url, json={'system': system, 'by_region': True, 'groups': body_groups}).get_json()
+        assert body['regions']['Galicia'] == expected['Galicia'] and 'Lugo' not in body['regions']
+        assert sum(body['seats'].values()) == 350
+
+    for body_groups in [{'Galicia': ['Lugo', 'Atlantis']}, 'Galicia', {'Galicia': 'Lugo'}, ['Lugo']]:
+        response = client.post(url, json={'system': system, 'groups': body_groups})
+        assert response.status_code == 400 and 'error' in response.get_json()
+
+
+def test_apportion_votes(client):
+    regions = [
+        {'name': 'North', 'n_seats': 5, 'votes': {'A': 50000, 'B': 30000, 'C': 200}},
+        {'name': 'South', 'n_seats': 3, 'votes': {'A': 1000, 'B': 2500, 'C': 1300}},
+    ]
+    response = client.post(api.API_PREFIX + '/apportion', json={'system': {'name': 'dHondt', 'threshold': '0'}, 'regions': regions,
+                                                                'by_region': True})
+    assert response.get_json() == {'seats': {'A': 3, 'B': 4, 'C': 1}, 'regions': {'North': {'A': 3, 'B': 2}, 'South': {'B': 2, 'C': 1}}}
+
+    # C is above 5% in the south but not in the whole country
+    system = {'name': 'LRM-Hare', 'threshold': '5'}
+    assert client.post(api.API_PREFIX + '/apportion', json={'system': system, 'regions': regions}).get_json()['seats']['C'] == 1
+    system['threshold_country'] = True
+    assert 'C' not in client.post(api.API_PREFIX + '/apportion', json={'system': system, 'regions': regions}).get_json()['seats']
+
+    for body in [{'system': {'name': 'Biproportional'}, 'regions': regions}, {'system': {'name': 'dHondt'}, 'regions': []},
+                 {'system': {'name': 'dHondt'}, 'regions': [{'votes': {'A': 1}}]}, {'regions': regions},
+                 {'system': {'name': 'LRM-Hare'}, 'regions': [{'n_seats': 2, 'votes': {'A': 0}}]},
+                 {'system': {'name': 'SL'}, 'regions': [{'n_seats': 2, 'votes': {}}]},
+                 {'system': {'name': 'dHondt'}, 'regions': [{'n_seats': 0, 'votes': {'A': 1}}]}]:
+        response = client.post(api.API_PREFIX + '/apportion', json=body)
+        assert response.status_code == 400 and 'error' in response.get_json()
+    assert client.post(api.API_PREFIX + '/apportion', data='votes').status_code == 400
+
+    # No party reaches the threshold
+    body = {'system': {'name': 'LRM-Hare', 'threshold': '15'}, 'regions': [{'n_seats': 3, 'votes': {p: 10 for p in 'ABCDEFGHIJ'}}]}
+    assert client.post(api.API_PREFIX + '/apportion', json=body).get_json() == {'seats': {}}
+
+
+def test_batch(client):
+    scenarios = [
+        {'country': 'Spain', 'date': '2019-11-10', 'system': {'name': name, 'level': level, 'threshold': '3'}}
+        for name in ['dHondt', 'SL', 'Biproportional'] for level in [1, 2]
+    ]
+    scenarios.insert(1, {'country': 'USA', 'date': '2020', 'system': {'name': 'dHondt'}})
+    scenarios.append({'system': {'name': 'SL'}, 'regions': [{'n_seats': 2, 'votes': {'A': 3, 'B': 2}}]})
+    # Only the names of elections can be resolved
+    scenarios.append({'election': 'get_usa_years', 'system': {'name': 'dHondt'}})
+    response = client.post(api.API_PREFIX + '/batch', json={'scenarios': scenarios})
+    assert response.mimetype == 'application/x-ndjson'
+
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line['index'] for line in lines] == list(range(len(scenarios)))
+    assert 'error' in lines[1] and 'error' in lines[-1]
+    assert all(sum(line['seats'].values()) == 350 for line in lines[:1] + lines[2:-2])
+    assert lines[-2]['seats'] == {'A': 1, 'B': 1}
+
+    assert client.post(api.API_PREFIX + '/batch', json={'scenarios': 'all'}).status_code == 400
+
+
+def test_jobs(tmp_path):
+    server = Flask(__name__)
+    server.register_blueprint(api.create_api(t_elections, processes=0, jobs=jobs.Job_Manager(str(tmp_path), 0)))
+    client = server.test_client()
+    params = {'country': 'Spain', 'date': '2019-11-10', 'system': {'name': 'dHondt', 'level': 2, 'threshold': '3'},
+              'n_districts': 6, 'n_plans': 10}
+    response = client.post(api.API_PREFIX + '/jobs', json={'kind': 'ensemble', 'params': params})
+    assert response.status_code == 202
+    job_id = response.get_json()['id']
+
+    for _ in range(6000):
+        if client.get(api.API_PREFIX + '/jobs/{}/result'.format(job_id)).status_code != 409:
+            break
+        time.sleep(0.01)
+    status = client.get(api.API_PREFIX + '/jobs/' + job_id).get_json()
+    assert status['state'] == 'done'
+    assert status['params']['election'] == 'Spain_2019_11' and 'country' not in status['params']
+    result = client.get(api.API_PREFIX + '/jobs/{}/result'.format(job_id)).get_json()
+    assert sum(seats['min'] for seats in result['summary'].values()) <= 350
+    assert client.get(api.API_PREFIX + '/jobs/{}/files/seats.csv'.format(job_id)).status_code == 200
+    assert client.get(api.API_PREFIX + '/jobs/{}/files/result.json'.format(job_id)).status_code == 404
+    assert client.delete(api.API_PREFIX + '/jobs/' + job_id).get_json()['state'] == 'done'
+
+    assert client.get(api.API_PREFIX + '/jobs/' + '0' * 32).status_code == 400
+    assert client.post(api.API_PREFIX + '/jobs', json={'kind': 'simulation'}).status_code == 400
+    response = client.post(api.API_PREFIX + '/jobs', json={'kind': 'ensemble', 'params': dict(params, date='1977')})
+    assert response.status_code == 400
+
+
+def test_batch_job(tmp_path, monkeypatch):
+    # Long batches run as jobs, with the same lines as the streamed responses
+    monkeypatch.setattr(api, 'BATCH_JOB_SCENARIOS', 2)
+    manager = jobs.Job_Manager(str(tmp_path), 0)
+    server = Flask(__name__)
+    server.register_blueprint(api.create_api(t_elections, processes=0, jobs=manager))
+    client = server.test_client()
+    system = {'name': 'dHondt', 'level': 2, 'threshold': '3'}
+    scenarios = [{'country': 'Spain', 'date': '2019-11-10', 'system': system}, {'country': 'Spain', 'date': '1977', 'system': system},
+                 {'system': system, 'regions': [{'name': 'A', 'n_seats': 3, 'votes': {'x': 10, 'y': 5}}]}]
+
+    response = client.post(api.API_PREFIX + '/batch', json={'scenarios': scenarios[:2]})
+    assert response.status_code == 200
+    expected = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    response = client.post(api.API_PREFIX + '/batch', json={'scenarios': scenarios})
+    assert response.status_code == 202
+    job_id = response.get_json()['id']
+    assert manager.wait(job_id, timeout=60)['state'] == 'done'
+    assert client.get(api.API_PREFIX + '/jobs/{}/result'.format(job_id)).get_json()['errors'] == 1
+    with open(manager.get_file(job_id, 'results.ndjson')) as f:
+        lines = [json.loads(line) for line in f]
+    assert lines[:2] == expected and lines[2] == {'index': 2, 'seats': {'x': 2, 'y': 1}}
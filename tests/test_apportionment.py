@@ -0,0 +1,71 @@
+import numpy as np
+import os
+import pytest
+import sys
+
+from app import apportionment, elections, electoral_systems, regions
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+t_election = elections.Spain_2015_12()
+t_votes = {'A': 100000, 'B': 80000, 'C': 30000, 'D': 20000}
+
+
+@pytest.mark.parametrize("method, expected", [
+    ('Jefferson', {'A': 4, 'B': 3, 'C': 1, 'D': 0}),
+    ('Webster', {'A': 3, 'B': 3, 'C': 1, 'D': 1}),
+    ('Hamilton', {'A': 3, 'B': 3, 'C': 1, 'D': 1}),
+    ('Adams', {'A': 3, 'B': 3, 'C': 1, 'D': 1}),
+])
+def test_reapportion_known_results(method, expected):
+    assert apportionment.reapportion(t_votes, 8, method) == expected
+
+
+@pytest.mark.parametrize("method", apportionment.APPORTIONMENT_METHODS)
+def test_reapportion_spain(method):
+    election = elections.Spain_2019_11()
+    n_seats = election.reapportion(2, 350, method, min_seats=2)
+    assert sum(n_seats.values()) == 350
+    assert min(n_seats.values()) >= 2
+
+    system = electoral_systems.System('dHondt', 2, 3)
+    result = election.regions[0]['Spain'].compute_result(system, n_seats=n_seats)
+    for region_name, seats in result.result.items():
+        assert sum(seats.values()) == n_seats[region_name]
+
+
+def test_reapportion_invalid_input():
+    with pytest.raises(ValueError):
+        apportionment.reapportion(t_votes, 5, min_seats=2)
+    with pytest.raises(ValueError):
+        apportionment.reapportion(t_votes, 5, method='Unknown')
+
+
+@pytest.mark.parametrize("system_name", electoral_systems.SYSTEM_NAMES)
+@pytest.mark.parametrize("threshold", ['0', '3', 'n/2s'])
+@pytest.mark.parametrize("threshold_country", [False, True])
+def test_apportion_matrix_matches_regions(system_name, threshold, threshold_country):
+    election = t_election
+    valid_parties = election.get_valid_parties(threshold) if threshold_country else None
+    for level in election.regions:
+        system = electoral_systems.System(system_name, level, threshold, threshold_country)
+        vote_matrix = election.get_vote_matrix(level)
+        mask = np.array([p in valid_parties for p in vote_matrix.parties]) if threshold_country else None
+        seats = apportionment.apportion_matrix(vote_matrix.votes, vote_matrix.n_seats, system, mask)
+        for i, region in enumerate(election.get_regions(level).values()):
+            expected = region.compute_election_result(system, valid_parties)
+            assert {p: s for p, s in zip(vote_matrix.parties, seats[i].tolist()) if s} == dict(expected)
+
+
+@pytest.mark.parametrize("system_name", [s for s in electoral_systems.SYSTEM_NAMES if s != 'Winner Takes All'])
+def test_apportion_matrix_without_valid_parties(system_name):
+    # No party reaches the threshold in the first region
+    votes = np.array([[1]*10, [5, 3, 2] + [0]*7])
+    n_seats = np.array([2, 3])
+    system = electoral_systems.System(system_name, 1, 'n/2s')
+    seats = apportionment.apportion_matrix(votes, n_seats, system)
+    assert seats[0].tolist() == [0]*10
+    for i in range(2):
+        region = regions.Electoral_Region(None, str(i), 1, 0, int(n_seats[i]), dict(enumerate(votes[i].tolist())), 0, 0)
+        assert {p: s for p, s in enumerate(seats[i].tolist()) if s} == dict(region.compute_election_result(system))
@@ -0,0 +1,66 @@
+import csv
+import io
+import os
+import pytest
+import sys
+
+from app import batch, elections, electoral_systems
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+
+def test_get_election_names():
+    election_names = batch.get_election_names()
+    assert 'Spain_2019_11' in election_names and 'Costa_Rica_2018' in election_names
+    assert 'Election' not in election_names and 'Spain_Election' not in election_names
+    # Only the USA cycles with data
+    assert [name for name in election_names if name.startswith('USA_')] == \
+        ['USA_{}'.format(year) for year in sorted(elections.get_usa_years())]
+
+
+def test_run_batch():
+    rows = list(batch.run_batch(['Spain_2019_11', 'Costa_Rica_2018'], ['dHondt', 'SL'], [1, 2], ['3'], processes=1))
+    # Costa Rica has no level 2
+    assert {(r[0], r[2]) for r in rows} == {('Spain_2019_11', 1), ('Spain_2019_11', 2), ('Costa_Rica_2018', 1)}
+
+    election = batch.get_election('Spain_2019_11')
+    assert election._maps is None  # No figures were built
+    expected = election.regions[0]['Spain'].compute_result(electoral_systems.System('SL', 2, '3')).result
+    seats = {r[6]: r[8] for r in rows if r[0] == 'Spain_2019_11' and r[1] == 'SL' and r[2] == 2 and r[8]}
+    assert seats == {p: sum(s.get(p, 0) for s in expected.values()) for p in seats}
+    assert sum(seats.values()) == 350
+
+    with pytest.raises(ValueError):
+        list(batch.run_batch(['Spain_1977'], ['dHondt'], [1], ['3'], processes=1))
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_run_batch_errors(processes):
+    # The failed tasks (an invalid threshold) don't stop the rest of the grid
+    errors = []
+    rows = list(batch.run_batch(['Spain_2019_11'], ['dHondt'], [1], ['3', '99'], processes=processes, errors=errors))
+    assert {r[3] for r in rows} == {'3'} and sum(r[8] for r in rows) == 350
+    assert [task[:5] for task, message in errors] == [('Spain_2019_11', 'dHondt', 1, '99', False)]
+    assert errors[0][1].startswith('ValueError: ')
+
+
+def test_batch_main(tmp_path):
+    output = tmp_path / 'results.csv'
+    batch.main(['--elections', 'Spain_2015_12', '--systems', 'dHondt', 'Biproportional', '--levels', '2',
+                '--thresholds', '0', '5', '--threshold-country', 'both', '--by-region', '--processes', '2',
+                '--output', str(output)])
+    with open(output) as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == batch.COLUMNS
+    assert {(r['system'], r['threshold'], r['threshold_country']) for r in rows} == {
+        (s, t, c) for s in ['dHondt', 'Biproportional'] for t in ['0', '5'] for c in ['False', 'True']
+    }
+    election = elections.Spain_2015_12()
+    for region_name, region in election.regions[2].items():
+        region_rows = [r for r in rows if r['region'] == region_name and r['system'] == 'dHondt' and r['threshold'] == '5']
+        assert sum(int(r['seats']) for r in region_rows) == 2 * region.n_seats
+
+    table = io.StringIO()
+    batch.write_table([], table, delimiter='\t')
+    assert table.getvalue() == '\t'.join(batch.COLUMNS) + '\n'
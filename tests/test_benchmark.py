@@ -0,0 +1,45 @@
+import json
+import os
+import sys
+
+from app import benchmark
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+
+def test_run_benchmarks():
+    results = benchmark.run_benchmarks(['compute_election_result/dHondt-*', 'compute_result/Costa_Rica_2018-MMP'], repeat=3)
+    assert list(results['benchmarks']) == ['compute_election_result/dHondt-1', 'compute_election_result/dHondt-2',
+                                           'compute_result/Costa_Rica_2018-MMP']
+    for result in results['benchmarks'].values():
+        assert len(result['samples']) == 3
+        assert result['min'] <= result['p50'] <= result['p95'] <= result['max']
+    assert 'commit' in results['metadata']
+    json.dumps(results)
+
+
+def test_benchmark_errors():
+    benchmark.BENCHMARKS['failing'] = lambda: (lambda: 1/0)
+    try:
+        assert benchmark.time_benchmark('failing') == {'error': 'ZeroDivisionError: division by zero'}
+    finally:
+        del benchmark.BENCHMARKS['failing']
+
+
+def test_compare(tmp_path, capsys):
+    def run(times):
+        return {'metadata': {'commit': 'abc', 'date': ''},
+                'benchmarks': {name: {'p95': t} if t else {'error': 'Error'} for name, t in times.items()}}
+
+    base = run({'a': 1.0, 'b': 1.0, 'c': 1.0, 'd': 1.0, 'e': None})
+    new = run({'a': 1.05, 'b': 1.5, 'c': 0.5, 'd': 1.0, 'e': 1.0, 'f': 1.0})
+    rows = benchmark.compare_runs(base, new, tolerance=0.1)
+    assert {row[0]: row[-1] for row in rows} == {'a': 'ok', 'b': 'regression', 'c': 'improvement', 'd': 'ok', 'e': 'error'}
+
+    for name, run_results in [('base.json', base), ('new.json', new)]:
+        with open(tmp_path / name, 'w') as f:
+            json.dump(run_results, f)
+    assert benchmark.main(['compare', str(tmp_path / 'base.json'), str(tmp_path / 'new.json')]) == 1
+    assert '1 regression(s), 1 improvement(s) out of 5 benchmarks.' in capsys.readouterr().out
+    assert benchmark.main(['compare', str(tmp_path / 'base.json'), str(tmp_path / 'base.json')]) == 0
@@ -0,0 +1,67 @@
+import numpy as np
+import os
+import pytest
+import sys
+
+from app import biproportional, comparisons, elections, electoral_systems
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+t_election = elections.Spain_2015_12()
+
+
+def test_biproportional_apportionment():
+    votes = np.array([[6000, 4000, 0], [3000, 1000, 2000], [500, 2500, 3000]])
+    region_seats = np.array([5, 3, 4])
+    party_seats = np.array([5, 4, 3])
+    seats, flaws = biproportional.biproportional_apportionment(votes, region_seats, party_seats)
+    assert seats.sum(axis=1).tolist() == region_seats.tolist()
+    assert seats.sum(axis=0).tolist() == party_seats.tolist()
+    assert seats[0, 2] == 0
+    assert flaws[-1] == 0
+
+    with pytest.raises(ValueError):
+        biproportional.biproportional_apportionment(votes, region_seats, [5, 4, 4])
+    with pytest.raises(ValueError):
+        biproportional.biproportional_apportionment(votes * [1, 1, 0], region_seats, party_seats)
+
+
+@pytest.mark.parametrize("threshold", ['0', '3', 'n/2s'])
+@pytest.mark.parametrize("threshold_country", [False, True])
+def test_biproportional_result(threshold, threshold_country):
+    system = electoral_systems.System('Biproportional', 2, threshold, threshold_country)
+    country_region = t_election.regions[0]['Spain']
+    result = country_region.compute_result(system)
+    for region_name, seats in result.result.items():
+        assert sum(seats.values()) == t_election.regions[2][region_name].n_seats
+
+    seats = comparisons.compute_seat_matrix(t_election, system)
+    vote_matrix = t_election.get_vote_matrix(2)
+    for i, region_name in enumerate(vote_matrix.region_names):
+        assert {p: s for p, s in zip(vote_matrix.parties, seats[i].tolist()) if s} == result.result[region_name]
+
+    # The totals of every party are proportional to its national votes
+    valid = seats.sum(axis=0) > 0
+    national_votes = vote_matrix.votes.sum(axis=0)
+    party_seats = biproportional._divisor_matrix(national_votes[None, valid], np.array([350]), np.ones((1, valid.sum()), bool),
+                                                 biproportional.DIVISOR)[0]
+    assert seats.sum(axis=0)[valid].tolist() == party_seats.tolist()
+
+    province = t_election.regions[2]['Madrid']
+    assert province.compute_result(system).result == {'Madrid': result.result['Madrid']}
+
+
+def test_regions_without_valid_parties():
+    # No party has half a quota in Ceuta and Melilla, which have a single seat each
+    election = elections.Spain_2019_11()
+    system = electoral_systems.System('Biproportional', 2, 'n/2s', compensatory_level=1)
+    seats, flaws = biproportional.compute_seat_matrix(election, system, with_flaws=True)
+    assert flaws['Ceuta y Melilla'] == [] and all(f[-1] == 0 for f in flaws.values() if f)
+    vote_matrix = election.get_vote_matrix(2)
+    for region_name in ['Ceuta', 'Melilla']:
+        assert seats[vote_matrix.region_index[region_name]].sum() == 0
+    assert (seats == comparisons.compute_seat_matrix(election, system)).all()
+
+    result = election.regions[0]['Spain'].compute_result(system).result
+    assert result['Ceuta'] == {} and sum(sum(s.values()) for s in result.values()) == seats.sum() == 348
@@ -0,0 +1,32 @@
+from itertools import product
+import os
+import sys
+
+from app import comparisons, elections, electoral_systems
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+t_election = elections.Spain_2019_11()
+
+
+def test_comparison_matches_seat_diff():
+    systems = [
+        electoral_systems.System('dHondt', 2, 3),
+        electoral_systems.System('SL', 2, 3),
+        electoral_systems.System('LRM-Hare', 1, 5, True),
+        electoral_systems.System('Winner Takes All', 2, 0),
+    ]
+    comparison = comparisons.Comparison_Matrix(t_election, systems)
+    assert comparison.level == 1
+    assert comparison.national.shape == (4, 4)
+
+    country_region = t_election.regions[0]['Spain']
+    results = [country_region.compute_result(s) for s in systems]
+    for a, b in product(range(len(systems)), repeat=2):
+        seat_diff = results[a].get_seat_diff(results[b])
+        assert comparison.national[a, b] == sum(x for x in seat_diff.values() if x > 0)
+        for i, region_name in enumerate(comparison.region_names):
+            region = t_election.get_region(1, region_name)
+            seat_diff = results[a].get_seat_diff(results[b], region=region, level=1)
+            assert comparison.regional[a, b, i] == sum(x for x in seat_diff.values() if x > 0)
@@ -1,5 +1,8 @@
+import json
 import pytest
 
+from flask import Flask
+
 from app import countries
 
 
@@ -9,3 +12,33 @@ def test_instantiate_all_countries(country_name):
     country_class = getattr(countries, country_name)
     country_object = country_class()
     assert 0 < country_object.zoom < 25  # Just checking that the object is porperly initialised
+
+
+@pytest.mark.parametrize("country_name", ['Costa Rica', 'Spain'])
+def test_adjacency_is_connected(country_name):
+    country_object = getattr(countries, country_name.replace(' ', '_'))()
+    level = max(country_object.regions)
+    adjacency = country_object.get_adjacency(level)
+    assert len(adjacency) == len(country_object.get_geojson(level)['features'])
+
+    visited, stack = set(), [next(iter(adjacency))]
+    while stack:
+        region_name = stack.pop()
+        if region_name not in visited:
+            visited.add(region_name)
+            stack.extend(adjacency[region_name])
+    assert visited == set(adjacency)
+
+
+def test_geojson_files():
+    server = Flask(__name__)
+    countries.install(server)
+    client = server.test_client()
+    country = countries.Costa_Rica()
+    url = country.get_geojson_url(1)
+    assert url == '/geojson/Costa%20Rica/level_1.geojson'
+    response = client.get(url)
+    assert response.status_code == 200
+    assert [f['id'] for f in json.loads(response.get_data())['features']] == [f['id'] for f in country.get_geojson(1)['features']]
+    assert client.get('/geojson/Narnia/level_0.geojson').status_code == 404
+    assert client.get('/geojson/Spain/level_9.geojson').status_code == 404
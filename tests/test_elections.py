@@ -1,8 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
 import os
 import pytest
 import sys
+import threading
 
-from app import elections
+import plotly.io
+
+from app import elections, electoral_systems
 
 myPath = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, myPath + '/../app')
@@ -36,3 +41,88 @@ def test_country_level_threshold(election_name):
         parties = election_object.get_valid_parties(threshold)
         assert 0 <= len(parties) <= max_n_parties
         max_n_parties = len(parties)
+
+
+def test_usa_cycles():
+    assert len(elections.USA_YEARS) == 23
+    assert elections.USA_1976.__name__ == 'USA_1976' and issubclass(elections.USA_2020, elections.USA_Election)
+    assert elections.get_usa_years()[0] == 2020
+
+
+class Counted_Election():
+    instances = 0
+
+    def __init__(self):
+        Counted_Election.instances += 1
+
+
+def test_lazy_elections():
+    lazy = elections.Lazy_Elections({'a': Counted_Election, 'b': Counted_Election, 'c': Counted_Election}, max_loaded=2)
+    assert list(lazy) == ['a', 'b', 'c'] and len(lazy) == 3 and 'c' in lazy
+    assert Counted_Election.instances == 0  # Nothing is loaded until it is accessed
+
+    a = lazy['a']
+    assert lazy['a'] is a and Counted_Election.instances == 1
+    lazy['b']
+    lazy['a']
+    lazy['c']  # Drops 'b', the least recently used
+    assert list(lazy.loaded) == ['a', 'c'] and Counted_Election.instances == 3
+    assert lazy['a'] is a
+    with pytest.raises(KeyError):
+        lazy['d']
+
+
+def test_lazy_elections_concurrency():
+    started, release = threading.Event(), threading.Event()
+
+    class Slow_Election(Counted_Election):
+        def __init__(self):
+            super().__init__()
+            started.set()
+            release.wait(10)
+
+    lazy = elections.Lazy_Elections({'slow': Slow_Election, 'fast': Counted_Election})
+    instances = Counted_Election.instances
+    with ThreadPoolExecutor(4) as executor:
+        slow = [executor.submit(lambda: lazy['slow']) for _ in range(3)]
+        started.wait(10)
+        # Loading an election doesn't block the others
+        assert lazy['fast'] is not None
+        release.set()
+        assert len({id(f.result()) for f in slow}) == 1
+    assert Counted_Election.instances == instances + 2
+
+
+def test_map_figures_are_independent():
+    election = elections.Spain_2019_11()
+    country_region = election.regions[0]['Spain']
+    results = [country_region.compute_result(electoral_systems.System(name, 2, '3')) for name in ['dHondt', 'SL', 'LRM-Hare']]
+    expected = [result.get_map_plot() for result in results]
+
+    # Maps of the same level built concurrently keep their own values
+    with ThreadPoolExecutor(8) as executor:
+        figures = list(executor.map(lambda i: (i, results[i % 3].get_map_plot()), range(60)))
+    for i, figure in figures:
+        assert figure['data'][0]['z'] == expected[i % 3]['data'][0]['z']
+
+    template = election.maps[2]
+    figure = election.get_map(2, range(len(election.regions[2])), 'Title', zmax=5)
+    assert figure['data'][0]['geojson'] is election.country.get_geojson(2)
+    assert figure['layout']['title'] == {'text': 'Title'} and 'title' not in template['layout']
+    assert 'z' not in template['data'][0] and figure['data'][0]['zmax'] == 5
+    with pytest.raises(TypeError):
+        template['data'][0]['z'] = []
+    assert json.loads(plotly.io.to_json(figure, validate=False))['data'][0]['locations'] == list(election.regions[2])
+
+
+def test_warm_up(monkeypatch):
+    election = elections.Costa_Rica_2018()
+    election.warm_up()
+    assert election._maps is not None and set(election._vote_matrices) == set(election.regions)
+    assert set(election._parent_indices) == {(0, 0), (1, 0), (1, 1)}
+
+    # The maps can reference the geojson files served by countries.install
+    monkeypatch.setattr(elections, 'MAP_GEOJSON_URLS', True)
+    election = elections.Costa_Rica_2018()
+    figure = election.get_map(1, [0] * len(election.regions[1]), 'Title')
+    assert figure['data'][0]['geojson'] == '/geojson/Costa%20Rica/level_1.geojson'
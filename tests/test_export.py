@@ -0,0 +1,69 @@
+import csv
+import os
+import pytest
+import sys
+
+from app import batch, export
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+t_grid = (['Spain_2019_11', 'Costa_Rica_2018'], ['dHondt', 'Biproportional'], [1, 2], ['3'])
+
+
+def test_compute_tables():
+    tables = export.compute_tables(('Spain_2019_11', 'SL', 2, '5', False, tuple(export.TABLES)))
+    assert all(len(row) == len(export.TABLES[table]) for table, rows in tables.items() for row in rows)
+    assert sum(row[-1] for row in tables['seats']) == 350
+
+    # Lost votes are the votes of the parties without seats in every region
+    seats = {(row[5], row[6]): row for row in tables['seats']}
+    for row in tables['lost_votes']:
+        assert seats[row[5], row[6]][8] == 0 and seats[row[5], row[6]][7] == row[7]
+    assert len(tables['lost_votes']) == sum(1 for row in tables['seats'] if row[8] == 0)
+
+    election = batch.get_election('Spain_2019_11')
+    assert len(tables['metrics']) == len(export.metrics.METRIC_NAMES) * sum(len(election.regions[level]) for level in range(3))
+
+    assert export.compute_tables(('Costa_Rica_2018', 'SL', 2, '5', False, ('seats',))) == {'seats': []}
+
+
+def test_iter_chunks():
+    chunks = list(export.iter_chunks(*t_grid, table_names=['seats', 'lost_votes'], chunk_size=100, processes=1))
+    assert {table for table, _ in chunks} == {'seats', 'lost_votes'}
+    assert all(0 < len(rows) <= 100 for _, rows in chunks)
+
+    rows = [row for table, rows in chunks if table == 'seats' for row in rows]
+    assert rows == list(batch.run_batch(*t_grid, by_region=True, processes=1))
+
+
+def test_export_csv(tmp_path):
+    n_rows = export.export(str(tmp_path), *t_grid, chunk_size=1000, processes=2)
+    assert set(n_rows) == {str(tmp_path / (table + '.csv')) for table in export.TABLES}
+    for table in export.TABLES:
+        with open(tmp_path / (table + '.csv')) as f:
+            rows = list(csv.DictReader(f))
+        assert list(rows[0]) == [name for name, _ in export.TABLES[table]]
+        assert len(rows) == n_rows[str(tmp_path / (table + '.csv'))]
+
+    with pytest.raises(ValueError):
+        export.export(str(tmp_path), *t_grid, format='xlsx')
+
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+def test_export_arrow(tmp_path, format):
+    pa = pytest.importorskip('pyarrow')
+    pytest.importorskip('pyarrow.ipc')
+    pytest.importorskip('pyarrow.parquet')
+
+    n_rows = export.export(str(tmp_path), *t_grid, table_names=['seats', 'metrics'], format=format, chunk_size=500, processes=1)
+    for table in ['seats', 'metrics']:
+        path = str(tmp_path / (table + export.FORMATS[format]))
+        if format == 'parquet':
+            data = pa.parquet.read_table(path)
+        else:
+            with pa.ipc.open_file(path) as reader:
+                assert reader.num_record_batches > 1
+                data = reader.read_all()
+        assert data.schema == export.get_arrow_schema(table)
+        assert data.num_rows == n_rows[path]
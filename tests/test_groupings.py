@@ -0,0 +1,49 @@
+import os
+import pytest
+import sys
+
+from app import elections, electoral_systems, groupings
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+t_election = elections.Spain_2019_11()
+galicia = ['A Coruña', 'Lugo', 'Ourense', 'Pontevedra']
+
+
+@pytest.mark.parametrize("system_name", electoral_systems.SYSTEM_NAMES)
+def test_trivial_grouping_keeps_results(system_name):
+    grouping = groupings.District_Grouping(t_election, {})
+    system = electoral_systems.System(system_name, 2, 3)
+    grouping_result = grouping.compute_result(system)
+    election_result = next(iter(t_election.regions[0].values())).compute_result(system)
+    for region_name, seats in election_result.result.items():
+        assert grouping_result.result[region_name] == seats
+
+
+def test_merged_district_aggregates_regions():
+    grouping = groupings.District_Grouping(t_election, {'Galicia': galicia})
+    district = next(r for r in grouping.get_region().subregions if r.name == 'Galicia')
+    provinces = [t_election.get_region(2, x) for x in galicia]
+    assert district.n_seats == sum(r.n_seats for r in provinces)
+    assert district.census == sum(r.census for r in provinces)
+    assert district.votes['PP'] == sum(r.votes['PP'] for r in provinces)
+    assert len(grouping.district_names) == len(t_election.regions[2]) - len(galicia) + 1
+    assert grouping.get_district('Lugo') == 'Galicia'
+
+    result = grouping.compute_result(electoral_systems.System('dHondt', 2, 3))
+    assert sum(result.result['Galicia'].values()) == district.n_seats
+
+
+def test_invalid_groupings():
+    with pytest.raises(ValueError):
+        groupings.District_Grouping(t_election, {'Galicia': galicia + ['Atlantis']})
+    with pytest.raises(ValueError):
+        groupings.District_Grouping(t_election, {'North': ['Lugo'], 'South': ['Lugo', 'Ourense']})
+
+
+def test_parse_groups():
+    text = "Galicia: A Coruña, Lugo, Ourense, Pontevedra\n\nCatalunya Nord: Girona, Barcelona\n"
+    assert groupings.parse_groups(text) == {'Galicia': galicia, 'Catalunya Nord': ['Girona', 'Barcelona']}
+    with pytest.raises(ValueError):
+        groupings.parse_groups("Galicia A Coruña")
@@ -0,0 +1,27 @@
+import gc
+import os
+import runpy
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(myPath, '..', 'app', 'gunicorn_config.py')
+
+
+def test_preload_with_several_workers(monkeypatch):
+    monkeypatch.setenv('GUNICORN_WORKERS', '1')
+    monkeypatch.delenv('GUNICORN_PRELOAD', raising=False)
+    monkeypatch.delenv('MAP_GEOJSON_URLS', raising=False)
+    assert not runpy.run_path(CONFIG_PATH)['preload_app'] and 'MAP_GEOJSON_URLS' not in os.environ
+
+    monkeypatch.setenv('GUNICORN_WORKERS', '4')
+    try:
+        config = runpy.run_path(CONFIG_PATH)
+        assert config['preload_app'] and os.environ['MAP_GEOJSON_URLS'] == '1'
+        # The collector stays off in the master, and the workers collect everything but the frozen objects
+        assert not gc.isenabled()
+        config['pre_fork'](None, None)
+        assert gc.get_freeze_count() > 0 and not gc.isenabled()
+        config['post_fork'](None, None)
+        assert gc.isenabled()
+    finally:
+        gc.unfreeze()
+        gc.enable()
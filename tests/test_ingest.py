@@ -0,0 +1,120 @@
+import os
+import pickle
+import pytest
+import sys
+
+import pandas as pd
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../data')
+
+import ingest  # noqa: E402
+
+HOUSE_CSV = """year,state,district,party,candidatevotes,totalvotes
+2018,ALABAMA,1,REPUBLICAN,10,10
+2020,ALABAMA,1,REPUBLICAN,60,100
+2020,ALABAMA,1,DEMOCRAT,30,100
+2020,ALABAMA,2,DEMOCRAT,50,80
+2020,ALABAMA,2,LIBERTARIAN,0,80
+2020,FLORIDA,25,REPUBLICAN,0,0
+2020,DISTRICT OF COLUMBIA,0,DEMOCRAT,5,5
+"""
+
+MAPPING = ingest.Country_Mapping(
+    country='USA',
+    columns={'region': ['parent', 'district'], 'parent': 'state', 'votes': 'candidatevotes', 'census': 'totalvotes'},
+    cases={'parent': 'title', 'party': 'capitalize'},
+    regions={1: ['Florida', 'Alabama', 'Alaska']},
+    seats=1,
+    overrides={'Florida_25': {'census': 1, 'votes': {'Republican': 1}, 'nota': 0}},
+)
+
+
+@pytest.fixture
+def house_source(tmp_path):
+    path = tmp_path / 'house.csv'
+    path.write_text(HOUSE_CSV)
+    return ingest.Source('2020', ingest.read_csv, str(path), str(tmp_path / 'out' / 'election_data.pkl'), MAPPING,
+                         query="year == 2020 and state != 'DISTRICT OF COLUMBIA'")
+
+
+def test_build_election(house_source):
+    election = ingest.build_election(house_source.read(house_source.paths, **house_source.options), MAPPING)
+    assert election['parties'] == ['Republican', 'Democrat', 'Libertarian']
+    data = election['data']
+    assert data[2]['Alabama_1'] == {'region_name': 'Alabama_1', 'level': 2, 'census': 100, 'n_seats': 1,
+                                    'votes': {'Republican': 60, 'Democrat': 30}, 'nota': 10, 'split_votes': 0}
+    assert data[2]['Alabama_2']['votes'] == {'Democrat': 50, 'Libertarian': 0}
+    assert data[2]['Florida_25']['census'] == 1 and data[2]['Florida_25']['votes'] == {'Republican': 1}
+
+    # Lower levels follow the order of the mapping, include regions without data and drop parties without votes
+    assert list(data[1]) == ['Florida', 'Alabama', 'Alaska']
+    assert data[1]['Alabama'] == {'region_name': 'Alabama', 'level': 1, 'census': 180, 'n_seats': 2,
+                                  'votes': {'Republican': 60, 'Democrat': 80}, 'nota': 40, 'split_votes': 0}
+    assert data[1]['Alaska']['n_seats'] == 0 and data[1]['Alaska']['votes'] == {}
+    assert data[0] == {'region_name': 'USA', 'level': 0, 'census': 181, 'n_seats': 3,
+                       'votes': {'Republican': 61, 'Democrat': 80}, 'nota': 40, 'split_votes': 0}
+    assert all(type(value) is int for region in data[2].values() for value in region['votes'].values())
+
+    mapping = ingest.Country_Mapping('USA', MAPPING.columns, cases=MAPPING.cases, regions={1: ['Alabama']}, seats=1)
+    with pytest.raises(ValueError):
+        ingest.build_election(house_source.read(house_source.paths, **house_source.options), mapping)
+
+
+def test_costa_rica():
+    source, = ingest.load_sources('Costa Rica')
+    election = ingest.build_election(source.read(source.paths, **source.options), source.mapping)
+    with open(os.path.join(myPath, '..', 'app', 'data', 'Costa Rica', 'election_data.pkl'), 'rb') as f:
+        expected = pickle.load(f)
+    assert sorted(election['parties']) == sorted(expected['parties'])
+    assert election['data'] == expected['data']
+
+
+def test_replace_aliases():
+    names = pd.Series(['Ciudad de Ceuta', 'Ciudad de Melilla', 'Madrid', 'Comunidad de Madrid'])
+    aliases = [('Ceuta|Melilla', 'Ceuta y Melilla'), ('^Madrid', 'Comunidad de Madrid'), ('Comunidad', 'Other')]
+    assert ingest.replace_aliases(names, aliases).tolist() == ['Ceuta y Melilla', 'Ceuta y Melilla', 'Comunidad de Madrid', 'Other']
+    assert ingest.column_index('A') == 0 and ingest.column_index('Q') == 16 and ingest.column_index('ET') == 149
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_incremental_build(tmp_path, house_source, processes):
+    manifest = str(tmp_path / 'manifest.json')
+    missing = ingest.Source('missing', ingest.read_csv, str(tmp_path / 'missing.csv'), str(tmp_path / 'missing.pkl'), MAPPING)
+    other = ingest.Source('2018', ingest.read_csv, house_source.paths, str(tmp_path / 'out' / 'election_data_2018.pkl'),
+                          MAPPING, query="year == 2018")
+    sources = [house_source, other, missing]
+    assert sorted(ingest.build(sources, processes, manifest_file=manifest)) == sorted([house_source.output, other.output])
+    assert ingest.build(sources, processes, manifest_file=manifest) == []
+    assert sorted(ingest.build(sources, processes, force=True, manifest_file=manifest)) == sorted([house_source.output, other.output])
+
+    # Changes in the options or the files are rebuilt
+    other.options['query'] = "year == 2018 and district == 1"
+    assert ingest.build(sources, processes, manifest_file=manifest) == [other.output]
+    with open(house_source.paths[0], 'a') as f:
+        f.write('2020,ALASKA,0,REPUBLICAN,5,5\n')
+    assert len(ingest.build(sources, processes, manifest_file=manifest)) == 2
+    with open(house_source.output, 'rb') as f:
+        assert 'Alaska_0' in pickle.load(f)['data'][2]
+
+
+def test_partitioned_build(tmp_path):
+    path = tmp_path / 'house.csv'
+    path.write_text(HOUSE_CSV)
+    partition = ingest.Csv_Partition(str(path), 'year', str(tmp_path / 'house'), query="state != 'DISTRICT OF COLUMBIA'", chunksize=2)
+    sources = [
+        ingest.Source(str(year), ingest.read_csv, partition.get_path(year), str(tmp_path / '{}.pkl'.format(year)), MAPPING,
+                      partition=partition)
+        for year in [2016, 2018, 2020]
+    ]
+    manifest = str(tmp_path / 'manifest.json')
+    assert ingest.build(sources, 1, manifest_file=manifest) == [sources[1].output, sources[2].output]  # No rows of 2016
+    assert sorted(os.listdir(tmp_path / 'house')) == ['2018.csv', '2020.csv']
+    assert len(pd.read_csv(partition.get_path(2020))) == 5
+    with open(sources[2].output, 'rb') as f:
+        assert list(pickle.load(f)['data'][2]) == ['Alabama_1', 'Alabama_2', 'Florida_25']
+
+    assert ingest.build(sources, 1, manifest_file=manifest) == []
+    with open(path, 'a') as f:
+        f.write('2016,ALASKA,0,REPUBLICAN,5,5\n')
+    assert ingest.build(sources, 1, manifest_file=manifest) == [sources[0].output]
@@ -0,0 +1,123 @@
+import csv
+import json
+import os
+import pytest
+import signal
+import sys
+import time
+
+from app import batch, electoral_systems, jobs, redistricting
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+t_system = {'name': 'dHondt', 'level': 2, 'threshold': '3'}
+
+
+def wait_for_state(manager, job_id, states, timeout=60):
+    deadline = time.monotonic() + timeout
+    while manager.get_status(job_id)['state'] not in states:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return manager.get_status(job_id)
+
+
+@pytest.mark.parametrize("processes", [0, 1], ids=['thread', 'pool'])
+def test_ensemble_job(tmp_path, processes):
+    manager = jobs.Job_Manager(str(tmp_path), processes)
+    params = {'election': 'Spain_2019_11', 'system': t_system, 'n_districts': 6, 'n_plans': 20, 'seed': 0}
+    job_id = manager.submit('ensemble', params)
+    try:
+        status = manager.wait(job_id, timeout=120)
+    finally:
+        manager.shutdown()
+    assert status['state'] == 'done' and status['done'] == status['total'] == 20
+    assert status['params'] == params and status['started'] <= status['finished']
+
+    ensemble = redistricting.run_ensemble(batch.get_election('Spain_2019_11'), 6, electoral_systems.System('dHondt', 2, '3'), 20,
+                                          seed=0)
+    result = manager.get_result(job_id)
+    assert result['summary'] == ensemble.get_seat_summary()
+    with open(manager.get_file(job_id, 'seats.csv')) as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ensemble.parties and len(rows) == 21
+    assert manager.get_file(job_id, 'status.json') is None and manager.get_file(job_id, '../seats.csv') is None
+
+    # A finished job can't be cancelled
+    assert not manager.cancel(job_id)
+
+
+def test_batch_job(tmp_path):
+    manager = jobs.Job_Manager(str(tmp_path), 0)
+    job_id = manager.submit('batch', {'elections': ['Spain_2019_11', 'Costa_Rica_2018'], 'systems': ['dHondt', 'SL'],
+                                      'levels': [1, 2], 'thresholds': ['3']})
+    status = manager.wait(job_id)
+    assert status['state'] == 'done' and status['done'] == status['total'] == 8
+    with open(manager.get_file(job_id, 'seats.csv')) as f:
+        rows = list(csv.reader(f))
+    expected = list(batch.run_batch(['Spain_2019_11', 'Costa_Rica_2018'], ['dHondt', 'SL'], [1, 2], ['3'], processes=1))
+    assert rows[0] == batch.COLUMNS and rows[1:] == [[str(x) for x in row] for row in expected]
+    assert manager.get_result(job_id)['rows'] == len(expected)
+
+
+def test_cancel_job(tmp_path):
+    manager = jobs.Job_Manager(str(tmp_path), 0)
+    params = {'election': 'Spain_2019_11', 'system': t_system, 'n_districts': 6, 'n_plans': 10**6}
+    running = manager.submit('ensemble', params)
+    queued = manager.submit('ensemble', params)
+    wait_for_state(manager, running, ['running'])
+    assert manager.get_status(queued)['state'] == 'queued'
+
+    # The queued job never starts, and the running one stops at its next step
+    assert manager.cancel(queued) and manager.get_status(queued)['state'] == 'cancelled'
+    assert manager.cancel(running)
+    status = manager.wait(running, timeout=60)
+    assert status['state'] == 'cancelled' and status['done'] < params['n_plans']
+    assert manager.get_result(running) is None and manager.wait(queued)['state'] == 'cancelled'
+
+    # Shutting down the manager cancels the queued jobs
+    running = manager.submit('ensemble', params)
+    queued = manager.submit('ensemble', params)
+    wait_for_state(manager, running, ['running'])
+    manager.shutdown()
+    assert manager.get_status(queued)['state'] == 'cancelled'
+    assert manager.cancel(running) and wait_for_state(manager, running, jobs.FINISHED_STATES)['state'] == 'cancelled'
+
+
+def test_dead_worker(tmp_path):
+    manager = jobs.Job_Manager(str(tmp_path), 1)
+    params = {'election': 'Spain_2019_11', 'system': t_system, 'n_districts': 6, 'n_plans': 10**6}
+    try:
+        job_id = manager.submit('ensemble', params)
+        pid = wait_for_state(manager, job_id, ['running'], timeout=120)['pid']
+        os.kill(pid, signal.SIGKILL)
+        status = manager.wait(job_id, timeout=60)
+        assert status['state'] == 'failed' and status['error'].startswith('BrokenProcessPool')
+
+        # The next jobs run in a new pool
+        job_id = manager.submit('ensemble', dict(params, n_plans=5))
+        assert manager.wait(job_id, timeout=120)['state'] == 'done'
+    finally:
+        manager.shutdown()
+
+    # A running job whose process doesn't exist anymore (e.g. after a restart)
+    path = os.path.join(str(tmp_path), job_id, 'status.json')
+    with open(path) as f:
+        status = json.load(f)
+    with open(path, 'w') as f:
+        json.dump(dict(status, state='running', pid=pid), f)
+    assert manager.get_status(job_id)['state'] == 'failed'
+
+
+def test_invalid_jobs(tmp_path):
+    manager = jobs.Job_Manager(str(tmp_path), 0)
+    with pytest.raises(ValueError):
+        manager.submit('simulation', {})
+    with pytest.raises(ValueError):
+        manager.submit('ensemble', {'election': 'Spain_2019_11', 'n_districts': 6})
+    assert manager.get_status('../..') is None and manager.get_status('0' * 32) is None
+
+    # Errors inside the job are reported in its status
+    job_id = manager.submit('ensemble', {'election': 'Spain_2019_11', 'system': t_system, 'n_districts': 100, 'n_plans': 10})
+    status = manager.wait(job_id)
+    assert status['state'] == 'failed' and status['error'].startswith('ValueError: The number of districts')
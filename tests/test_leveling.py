@@ -0,0 +1,81 @@
+from collections import Counter
+import os
+import pytest
+import sys
+
+from app import apportionment, comparisons, elections, electoral_systems, leveling
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+t_election = elections.Spain_2019_11()
+t_country = t_election.regions[0]['Spain']
+t_divisor = apportionment.DIVISORS['Webster']
+
+
+def get_total_seats(result):
+    total_seats = Counter()
+    for seats in result.result.values():
+        total_seats.update(seats)
+    return total_seats
+
+
+def test_get_entitlements():
+    votes = {'A': 500, 'B': 300, 'C': 200}
+    constituency_seats = Counter({'A': 5, 'B': 1})
+    exclude = leveling.get_entitlements(votes, constituency_seats, 8, ['A', 'B', 'C'], t_divisor, 'exclude')
+    assert exclude == {'A': 5, 'B': 2, 'C': 1}
+    balance = leveling.get_entitlements(votes, constituency_seats, 8, ['A', 'B', 'C'], t_divisor, 'balance')
+    assert balance['A'] == 5 and sum(balance.values()) == 10
+
+    with pytest.raises(ValueError):
+        leveling.get_entitlements(votes, constituency_seats, 8, ['A'], t_divisor, 'ignore')
+
+
+@pytest.mark.parametrize("level, compensatory_level", [(1, 0), (2, 0), (2, 1)])
+def test_leveling_seats(level, compensatory_level):
+    system = electoral_systems.System('Leveling Seats', level, 3, compensatory_level=compensatory_level)
+    result = t_country.compute_result(system)
+    assert set(result.result) == set(t_election.regions[level])
+    assert sum(get_total_seats(result).values()) == t_country.n_seats
+
+
+def test_mmp_is_proportional():
+    system = electoral_systems.System('MMP', 2, 5)
+    total_seats = get_total_seats(t_country.compute_result(system))
+    # Without overhang, the totals equal the Sainte-Laguë apportionment of the
+    # enlarged chamber among the parties above the threshold
+    valid_votes = {p: v for p, v in t_country.votes.items() if v > t_country.total_votes * 5 / 100}
+    n_seats = sum(total_seats[p] for p in valid_votes)
+    assert apportionment.divisor_method(valid_votes, n_seats, t_divisor) == {p: total_seats[p] for p in valid_votes}
+    assert sum(total_seats.values()) >= t_country.n_seats
+
+    seats = comparisons.compute_seat_matrix(t_election, system)
+    assert seats.sum() == sum(total_seats.values())
+
+
+def test_compensatory_level():
+    system = electoral_systems.System('Leveling Seats', 2, 3, compensatory_level=1)
+    country_result = t_country.compute_result(system)
+    galicia = t_election.regions[1]['Galicia']
+    assert galicia.compute_result(system).result == {r.name: country_result.result[r.name] for r in galicia.subregions}
+    province = t_election.regions[2]['Madrid']
+    assert province.compute_result(system).result == {'Madrid': country_result.result['Madrid']}
+
+    system = electoral_systems.System('MMP', 1, 3, compensatory_level=2)
+    with pytest.raises(ValueError):
+        t_country.compute_result(system)
+
+
+def test_single_seat_constituencies():
+    # Single-seat constituencies keep their constituency seat, won by plurality
+    assert leveling._n_leveling_seats(1, 0.5) == 0 and leveling._n_leveling_seats(1, 1) == 0
+    assert leveling._n_leveling_seats(4, 0.5) == 2 and leveling._n_leveling_seats(4, 1) == 1
+    result = t_country.compute_result(electoral_systems.System('MMP', 2, 5)).result
+    for name in ['Ceuta', 'Melilla']:
+        region = t_election.regions[2][name]
+        assert result[name][max(region.votes, key=region.votes.get)] >= 1
+
+    # Two-tier systems can't be computed region by region
+    with pytest.raises(ValueError):
+        t_election.regions[2]['Madrid'].compute_election_result(electoral_systems.System('MMP', 2, 5))
@@ -0,0 +1,105 @@
+import json
+import os
+import sys
+import threading
+
+import pytest
+from dash import Dash, dcc, html, Input, Output, State
+from werkzeug.serving import make_server
+
+from app import loadtest
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+
+def get_test_app():
+    """
+    Return a small Dash app with the same component ids and callback names as
+    main.py.
+    """
+    app = Dash(__name__)
+    app.layout = html.Div([
+        dcc.Dropdown(id='dropdown-metrics', options=[{'label': m, 'value': m} for m in ['Lost Votes', 'Seat Difference']],
+                     value='Lost Votes'),
+        dcc.Dropdown(id='dropdown-system-name-1', options=['dHondt', 'SL'], value='dHondt'),
+        dcc.Graph(id='map'),
+        dcc.Tooltip(id='graph-tooltip'),
+        dcc.Store(id='result-store-1'),
+    ])
+
+    @app.callback(Output('result-store-1', 'data'), Input('dropdown-system-name-1', 'value'))
+    def compute_result_1(system_name):
+        return {'system': system_name}
+
+    @app.callback(Output('map', 'figure'), Input('dropdown-metrics', 'value'), Input('result-store-1', 'data'))
+    def update_figures(metric, result):
+        assert result is not None  # Called after compute_result_1
+        return {'data': [{'type': 'choroplethmapbox', 'locations': ['A', 'B', 'C'], 'z': [1, 2, 3]}], 'layout': {'title': metric}}
+
+    @app.callback(Output('graph-tooltip', 'show'), Output('graph-tooltip', 'children'), Input('map', 'hoverData'),
+                  State('dropdown-metrics', 'value'))
+    def display_tooltip(hover_data, metric):
+        if hover_data['points'][0]['location'] == 'C':
+            raise ValueError("Region C fails")
+        return True, hover_data['points'][0]['location']
+
+    return app
+
+
+def test_build_payload():
+    dependency = {'output': '..map.figure...chart.figure..', 'inputs': [{'id': 'dropdown-metrics', 'property': 'value'}],
+                  'state': [{'id': 'threshold-switch-1', 'property': 'on'}]}
+    payload = loadtest.build_payload(dependency, {'dropdown-metrics.value': 'Lost Votes'}, ['dropdown-metrics.value'])
+    assert payload['outputs'] == [{'id': 'map', 'property': 'figure'}, {'id': 'chart', 'property': 'figure'}]
+    assert payload['inputs'] == [{'id': 'dropdown-metrics', 'property': 'value', 'value': 'Lost Votes'}]
+    assert payload['state'] == [{'id': 'threshold-switch-1', 'property': 'on', 'value': None}]
+    assert loadtest.get_callback_name(dependency['output']) == 'update_figures'
+    assert loadtest.build_payload(dict(dependency, output='map.figure'), {}, [])['outputs'] == {'id': 'map', 'property': 'figure'}
+
+    assert loadtest.get_env_grid(['A=1', 'A=2', 'B=x']) == [{'A': '1', 'B': 'x'}, {'A': '2', 'B': 'x'}]
+    assert loadtest.get_env_grid([]) == [{}]
+
+
+def test_load_stats():
+    stats = loadtest.Load_Stats()
+    for i in range(100):
+        stats.add('display_tooltip', i / 1000, error=i == 99)
+    stats.add('update_figures', 1)
+    summary = stats.get_summary(duration=2)
+    assert summary['display_tooltip']['p50'] == 49.5 and summary['display_tooltip']['errors'] == 1
+    assert summary['all']['requests'] == 101 and summary['all']['throughput'] == 50.5
+    assert summary['update_figures']['p99'] == 1000
+
+
+def test_run_load(tmp_path):
+    app = get_test_app()
+    record_file = tmp_path / 'requests.jsonl'
+    loadtest.install_recorder(app.server, str(record_file))
+    server = make_server('127.0.0.1', 0, app.server, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://127.0.0.1:{}'.format(server.server_port)
+    try:
+        summary = loadtest.run_load(url, users=2, duration=1, hovers=3)
+        assert set(summary) == {'compute_result_1', 'update_figures', 'display_tooltip', 'all'}
+        # Every change of system 1 updates the figures after computing its result
+        assert 0 < summary['compute_result_1']['requests'] <= summary['update_figures']['requests']
+        assert summary['display_tooltip']['requests'] % 3 == 0
+        assert summary['update_figures']['errors'] == summary['compute_result_1']['errors'] == 0
+        assert 0 < summary['display_tooltip']['errors'] < summary['display_tooltip']['requests']
+
+        with open(record_file) as f:
+            lines = [json.loads(line) for line in f]
+        assert len(lines) == summary['all']['requests']
+        replay_summary = loadtest.run_load(url, users=3, duration=30, replay=str(record_file))
+        assert replay_summary['all']['requests'] == len(lines)
+        assert replay_summary['all']['errors'] == summary['all']['errors']
+    finally:
+        server.shutdown()
+
+
+def test_start_server_error():
+    # The log of gunicorn is kept and included in the error
+    with pytest.raises(RuntimeError, match='missing_module'):
+        loadtest.start_server('missing_module:server', port=8093, startup_timeout=60)
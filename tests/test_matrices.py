@@ -0,0 +1,102 @@
+import numpy as np
+import os
+import pytest
+import sys
+
+from app import elections, electoral_systems, matrices, metrics
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+
+def split_into_municipalities(election, n_municipalities):
+    """
+    Split the votes of every province of the election into n_municipalities
+    regions and return their Sparse_Vote_Matrix and the names of their provinces.
+    """
+    vote_matrix = election.get_vote_matrix(2)
+    rng = np.random.default_rng(0)
+    names, parent_names, rows, columns, votes = [], [], [], [], []
+    census, nota, spoilt_votes = [], [], []
+    for i, province in enumerate(vote_matrix.region_names):
+        shares = rng.dirichlet(np.ones(n_municipalities), size=vote_matrix.votes.shape[1])
+        split_votes = np.floor(vote_matrix.votes[i][:, None] * shares).astype(np.int64)
+        split_votes[:, 0] += vote_matrix.votes[i] - split_votes.sum(axis=1)
+        for m in range(n_municipalities):
+            row = len(names)
+            names.append('{} {}'.format(province, m))
+            parent_names.append(province)
+            nonzero = np.flatnonzero(split_votes[:, m])
+            rows.extend([row] * len(nonzero))
+            columns.extend(nonzero.tolist())
+            votes.extend(split_votes[nonzero, m].tolist())
+            census.append(vote_matrix.census[i] if m == 0 else 0)
+            nota.append(vote_matrix.nota[i] if m == 0 else 0)
+            spoilt_votes.append(vote_matrix.spoilt_votes[i] if m == 0 else 0)
+
+    sparse_matrix = matrices.Sparse_Vote_Matrix.from_triplets(
+        names, vote_matrix.parties, rows, columns, votes, census, np.zeros(len(names)), nota, spoilt_votes,
+    )
+    return sparse_matrix, parent_names
+
+
+def test_sparse_vote_matrix():
+    sparse_matrix = matrices.Sparse_Vote_Matrix.from_triplets(
+        ['a', 'b', 'c'], ['X', 'Y'], [0, 0, 2, 2, 0], [0, 1, 1, 1, 0], [5, 3, 1, 2, 0], [10, 0, 5], [1, 0, 1], [0, 0, 0], [0, 0, 0],
+    )
+    assert sparse_matrix.indptr.tolist() == [0, 2, 2, 3]
+    assert sparse_matrix.get_votes(0) == {'X': 5, 'Y': 3}
+    assert sparse_matrix.get_votes(1) == {}
+    assert sparse_matrix.get_votes(2) == {'Y': 3}
+    assert sparse_matrix.total_votes.tolist() == [8, 0, 3]
+    assert sparse_matrix.to_dense().votes.tolist() == [[5, 3], [0, 0], [0, 3]]
+
+    aggregated = sparse_matrix.aggregate([1, 0, 1], ['ac', 'b'][::-1])
+    assert aggregated.region_names == ['b', 'ac']
+    assert aggregated.votes.tolist() == [[0, 0], [5, 6]]
+    assert aggregated.census.tolist() == [0, 15]
+
+
+def test_sparse_level():
+    election = elections.Spain_2019_11()
+    original_votes = {name: dict(region.votes) for name, region in election.regions[1].items()}
+    sparse_matrix, parent_names = split_into_municipalities(election, 20)
+
+    level = election.add_sparse_level(sparse_matrix, parent_names, update_parents=True)
+    assert level == 3
+    assert len(election.regions[3]) == 52 * 20
+    for name, region in election.regions[1].items():
+        assert region.votes == {p: v for p, v in original_votes[name].items() if v}
+
+    # Aggregating the municipalities gives back the provinces
+    assert (election.get_level_membership(3, 2) @ election.get_vote_matrix(3).votes == election.get_vote_matrix(2).votes).all()
+    municipality = election.regions[3]['Madrid 1']
+    dense_votes = election.get_vote_matrix(3).get_votes(municipality.index)
+    assert municipality.votes == {p: v for p, v in dense_votes.items() if v}
+    assert municipality.total_votes == sum(dense_votes.values())
+    assert municipality in election.regions[2]['Madrid'].get_subregions(3)
+
+    n_seats = election.reapportion(3, 1000, 'Hamilton')
+    result = election.regions[0]['Spain'].compute_result(electoral_systems.System('dHondt', 3, 0), n_seats=n_seats)
+    assert len(result.result) == 52 * 20
+    assert sum(sum(seats.values()) for seats in result.result.values()) == 1000
+    assert sum(result.get_lost_votes().values()) > 0
+
+    with pytest.raises(ValueError):
+        election.add_sparse_level(sparse_matrix, parent_names)
+
+
+def test_sparse_level_size_limit(monkeypatch):
+    election = elections.Spain_2019_11()
+    sparse_matrix, parent_names = split_into_municipalities(election, 20)
+    level = election.add_sparse_level(sparse_matrix, parent_names)
+    monkeypatch.setattr(elections, 'MAX_DENSE_CELLS', 52 * 20 * len(sparse_matrix.parties) - 1)
+
+    # The sparse level is never materialized as a dense matrix...
+    with pytest.raises(ValueError):
+        election.get_vote_matrix(level)
+    with pytest.raises(ValueError):
+        metrics.Election_Metrics(election, electoral_systems.System('dHondt', level, 0))
+    assert election.get_sparse_vote_matrix(level) is sparse_matrix
+    # ...but the dense levels are
+    assert election.get_vote_matrix(2).votes.shape[0] == 52
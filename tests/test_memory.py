@@ -0,0 +1,54 @@
+import os
+import sys
+
+from flask import Flask
+import numpy as np
+
+from app import elections, memory
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+
+def test_get_deep_size():
+    array = np.zeros(1000)
+    shared = {'array': array}
+    seen = set()
+    size = memory.get_deep_size([shared, shared, array[10:]], seen=seen)
+    assert 8000 < size < 8000 + 1000
+    assert memory.get_deep_size(shared, seen=seen) == 0
+    assert memory.get_deep_size(array[:5]) > 8000
+
+
+def test_memory_report():
+    election = elections.Costa_Rica_2018()
+    report = memory.get_memory_report({'Costa Rica 2018': election})
+    sizes = report['elections']['Costa Rica 2018']
+    assert set(sizes) == set(memory.ELECTION_PARTS) | {'total'}
+    assert sizes['votes'] > 0 and sizes['regions'] > 0 and sizes['maps'] == sizes['maps_geojson'] == 0
+    assert report['countries']['Costa Rica']['geometries'] > 1e6
+
+    election.maps
+    other = elections.Costa_Rica_2018()
+    other.country = election.country
+    report = memory.get_memory_report({'a': election, 'b': other})
+    # The map templates share the geojson of the country
+    assert report['elections']['a']['maps_geojson'] == 0
+    assert 0 < report['elections']['a']['maps'] < report['countries']['Costa Rica']['geometries'] / 100
+    assert report['elections']['b']['maps'] == 0
+    assert report['total'] == sum(report['countries']['Costa Rica'].values()) + sum(
+        sizes['total'] for sizes in report['elections'].values()) + report['caches']['batch_elections']
+    assert memory.format_report(report).splitlines()[1].startswith('a ')
+
+
+def test_install():
+    server = Flask(__name__)
+    memory.install(server, {'Costa Rica': {'2018': elections.Costa_Rica_2018()}}, token='secret')
+    client = server.test_client()
+    assert client.get(memory.MEMORY_ADMIN_PATH).status_code == 403
+    response = client.get(memory.MEMORY_ADMIN_PATH, headers={'Authorization': 'Bearer secret'})
+    assert list(response.get_json()['elections']) == ['Costa Rica 2018']
+
+    server = Flask(__name__)
+    memory.install(server, {}, token='')
+    assert server.test_client().get(memory.MEMORY_ADMIN_PATH).status_code == 404
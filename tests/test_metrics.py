@@ -0,0 +1,45 @@
+import numpy as np
+import os
+import pytest
+import sys
+
+from app import elections, electoral_systems, metrics
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+t_election = elections.Spain_2019_11()
+
+
+def test_metric_functions():
+    votes = np.array([[60, 40], [50, 50]])
+    seats = np.array([[1, 0], [3, 3]])
+    assert metrics.gallagher_index(votes, seats) == pytest.approx([40, 0])
+    assert metrics.loosemore_hanby_index(votes, seats) == pytest.approx([40, 0])
+    assert metrics.effective_number_of_parties(votes) == pytest.approx([1/(0.36+0.16), 2])
+    wasted = metrics.wasted_votes(votes, seats)
+    assert wasted[0] == pytest.approx([10, 40])
+    assert metrics.efficiency_gap(wasted, votes, 0, 1)[0] == pytest.approx(-0.3)
+    assert metrics.malapportionment([100, 300], [1, 1], 400, 2) == pytest.approx([0.5, 1.5])
+    assert metrics.malapportionment_index([100, 300], [1, 1]) == pytest.approx(0.25)
+
+
+@pytest.mark.parametrize("system_name", electoral_systems.SYSTEM_NAMES)
+def test_election_metrics(system_name):
+    system = electoral_systems.System(system_name, 2, 3)
+    election_metrics = metrics.Election_Metrics(t_election, system)
+    assert set(election_metrics.values) == {0, 1, 2}
+    for level, values in election_metrics.values.items():
+        for metric in metrics.METRIC_NAMES:
+            assert len(values[metric]) == len(t_election.regions[level])
+
+    result = t_election.regions[0]['Spain'].compute_result(system)
+    seats = {}
+    for region_seats in result.result.values():
+        for party, n in region_seats.items():
+            seats[party] = seats.get(party, 0) + n
+    votes = t_election.regions[0]['Spain'].votes
+    parties = list(votes)
+    expected = metrics.gallagher_index(np.array([[votes[p] for p in parties]]), np.array([[seats.get(p, 0) for p in parties]]))
+    assert election_metrics.national['Gallagher Index'] == pytest.approx(expected[0])
+    assert election_metrics.get_region_metric('Malapportionment', 0, 'Spain') == pytest.approx(1)
@@ -0,0 +1,84 @@
+import os
+import pstats
+import sys
+import time
+
+from dash import Dash, html, Input, Output
+
+from app import profiling
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+
+def slow_function(n):
+    time.sleep(0.03)
+    return inner_function(n)
+
+
+def inner_function(n):
+    time.sleep(0.03)
+    return n
+
+
+class Engine():
+    def compute(self, n):
+        return n + 1
+
+
+def test_profiler(tmp_path):
+    profiler = profiling.Profiler(str(tmp_path), rate=1, interval=0.001, enabled=True)
+    function = profiler.wrap('slow', slow_function)
+    nested = profiler.wrap('inner', inner_function)
+    assert [function(i) for i in range(3)] == [0, 1, 2]
+    assert nested(1) == 1
+    profiler.flush()
+
+    assert profiler.get_state()['profiled_calls'] == {'slow': 3, 'inner': 1}
+    stats = pstats.Stats(str(tmp_path / 'slow.prof'))
+    assert [v[0] for k, v in stats.stats.items() if k[2] == 'slow_function'] == [3]
+    with open(tmp_path / 'slow.collapsed') as f:
+        stacks = [line.rsplit(' ', 1) for line in f]
+    assert all(stack.startswith('slow;slow_function (test_profiling.py:') for stack, _ in stacks)
+    assert any('inner_function' in stack for stack, _ in stacks)
+
+    # Calls of a wrapped function inside a profiled call are part of its profile
+    profiler.wrap('slow', lambda n: nested(n))(1)
+    assert profiler.get_state()['profiled_calls'] == {'slow': 4, 'inner': 1}
+
+    profiler.rate = 0
+    function(1)
+    profiler.rate, profiler.enabled = 1, False
+    function(1)
+    assert profiler.get_state()['profiled_calls']['slow'] == 4
+
+
+def test_install(tmp_path):
+    app = Dash(__name__)
+    app.layout = html.Div([html.Div(id='input'), html.Div(id='output')])
+
+    @app.callback(Output('output', 'children'), Input('input', 'children'))
+    def test_callback(value):
+        return Engine().compute(value)
+
+    profiler = profiling.Profiler(str(tmp_path), rate=1, mode='cprofile')
+    compute = Engine.compute
+    try:
+        profiling.install(app, profiler, hot_methods=[(Engine, 'compute')], token='secret')
+        profiling.install(app, profiler, hot_methods=[(Engine, 'compute')], token='')
+        assert Engine().compute(1) == 2
+        client = app.server.test_client()
+        assert client.get(profiling.PROFILE_ADMIN_PATH).status_code == 403
+        response = client.post(profiling.PROFILE_ADMIN_PATH, json={'enabled': True}, headers={'Authorization': 'Bearer secret'})
+        assert response.get_json()['enabled'] is True
+        assert client.post(profiling.PROFILE_ADMIN_PATH + '?token=secret', json={'rate': 2}).status_code == 400
+
+        assert Engine().compute(1) == 2
+        body = {'output': 'output.children', 'outputs': {'id': 'output', 'property': 'children'},
+                'inputs': [{'id': 'input', 'property': 'children', 'value': 1}], 'changedPropIds': ['input.children']}
+        assert client.post('/_dash-update-component', json=body).get_json()['response']['output']['children'] == 2
+        response = client.post(profiling.PROFILE_ADMIN_PATH + '?token=secret', json={'flush': True})
+        assert response.get_json()['profiled_calls'] == {'Engine.compute': 1, 'test_callback': 1}
+        assert sorted(os.listdir(tmp_path)) == ['Engine.compute.prof', 'test_callback.prof']
+    finally:
+        Engine.compute = compute
@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import pytest
+import sys
+
+from app import elections, electoral_systems, redistricting
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+t_election = elections.Spain_2019_11()
+t_system = electoral_systems.System('dHondt', 2, 3)
+
+
+def is_connected(region_names, adjacency):
+    visited, stack = set(), [region_names[0]]
+    while stack:
+        region_name = stack.pop()
+        if region_name not in visited:
+            visited.add(region_name)
+            stack.extend(x for x in adjacency[region_name] if x in region_names)
+    return visited == set(region_names)
+
+
+def test_ensemble_plans_are_valid():
+    n_districts = 8
+    ensemble = redistricting.run_ensemble(t_election, n_districts, t_system, 50, seed=0, store_plans=True)
+    adjacency = t_election.country.get_adjacency(2)
+    n_seats = t_election.regions[0]['Spain'].n_seats
+
+    assert ensemble.seats.shape == (50, len(ensemble.parties))
+    assert (ensemble.seats.sum(axis=1) == n_seats).all()
+    for plan in ensemble.plans[::10]:
+        assert len(set(plan.tolist())) == n_districts
+        for d in range(n_districts):
+            assert is_connected([ensemble.region_names[i] for i in np.flatnonzero(plan == d)], adjacency)
+
+
+def test_ensemble_is_reproducible():
+    ensemble_1 = redistricting.run_ensemble(t_election, 6, t_system, 20, n_chains=2, processes=1, seed=42)
+    ensemble_2 = redistricting.run_ensemble(t_election, 6, t_system, 20, n_chains=2, processes=1, seed=42)
+    assert (ensemble_1.seats == ensemble_2.seats).all()
+    assert sum(ensemble_1.get_seat_distribution('PSOE').values()) == 20
+
+
+def test_chain_keeps_district_sums():
+    vote_matrix = t_election.get_vote_matrix(2)
+    adjacency = t_election.country.get_adjacency(2)
+    chain = redistricting.Recom_Chain(vote_matrix, adjacency, 5, t_system, seed=1)
+    for _ in range(20):
+        chain.step()
+    for d in range(5):
+        members = chain.assignment == d
+        assert (chain._district_votes[d] == vote_matrix.votes[members].sum(axis=0)).all()
+        assert chain._district_n_seats[d] == vote_matrix.n_seats[members].sum()
+
+
+def test_ensemble_arguments():
+    for n_districts, n_plans in [(4, 0), (0, 10), (len(t_election.regions[2]) + 1, 10)]:
+        with pytest.raises(ValueError):
+            redistricting.run_ensemble(t_election, n_districts, t_system, n_plans, seed=0)
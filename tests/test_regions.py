@@ -1,9 +1,10 @@
 from itertools import product
+import json
 import os
 import pytest
 import sys
 
-from app import elections, electoral_systems
+from app import elections, electoral_systems, regions
 
 myPath = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, myPath + '/../app')
@@ -43,4 +44,22 @@ def test_election_result(input):
         assert sum(result.values()) == region.n_seats
 
 
+def test_result_to_dict():
+    region = next(iter(t_elections[0].get_regions(0).values()))
+    result = region.compute_result(electoral_systems.System('dHondt', 1, 3))
+    data = json.loads(json.dumps(result.to_dict()))
+    rebuilt = regions.Election_Result.from_dict(region, data)
+    assert rebuilt.region is region and rebuilt.level == result.level
+    assert rebuilt.result == {name: dict(seats) for name, seats in result.result.items()}
+    assert rebuilt.get_lost_votes(region, 1) == result.get_lost_votes(region, 1)
+
+
+@pytest.mark.parametrize("system_name", [s for s in system_names if s != 'Winner Takes All'])
+def test_election_result_without_valid_votes(system_name):
+    # No party has votes, or none reaches the threshold
+    for votes in [{'A': 0}, {p: 10 for p in 'ABCDEFGHIJ'}]:
+        region = regions.Electoral_Region(None, 'Region', 0, 0, 3, votes, 0, 0)
+        assert region.compute_election_result(electoral_systems.System(system_name, 0, '15')) == {}
+
+
 # TODO Given two different systems, check that the +- in seat difference equals to 0.
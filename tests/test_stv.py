@@ -0,0 +1,70 @@
+import os
+import pytest
+import random
+import sys
+
+from app import elections, electoral_systems, stv
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+
+def test_count_stv_known_result():
+    # https://en.wikipedia.org/wiki/Single_transferable_vote#Example
+    ballots = stv.collapse_ballots(
+        [['Orange']]*4 + [['Pear', 'Orange']]*2 + [['Chocolate', 'Strawberry']]*8
+        + [['Chocolate', 'Bonbon']]*4 + [['Strawberry']] + [['Bonbon']]
+    )
+    assert len(ballots) == 6
+    candidates = ['Orange', 'Pear', 'Chocolate', 'Strawberry', 'Bonbon']
+    assert stv.count_stv(ballots, 3, candidates) == {'Chocolate': 1, 'Orange': 1, 'Strawberry': 1}
+
+
+def test_count_stv_instant_runoff():
+    ballots = {('A',): 40, ('B', 'C'): 25, ('C', 'B'): 35}
+    assert stv.count_stv(ballots, 1, ['A', 'B', 'C']) == {'C': 1}
+
+
+def test_count_stv_fills_all_seats():
+    # A candidate elected without surplus but with capacity left, and a lone
+    # continuing candidate below the quota
+    assert stv.count_stv({('A', 'B'): 1, ('B', 'D', 'C', 'A'): 2}, 4, ['A', 'B', 'C', 'D'],
+                         {'A': 4, 'B': 3, 'C': 4, 'D': 1}) == {'A': 2, 'B': 2}
+    ballots = {('C',): 9, ('B',): 1, ('B', 'A'): 9, ('B', 'C'): 7, ('A', 'B'): 8}
+    assert sum(stv.count_stv(ballots, 4, ['A', 'B', 'C'], {'A': 3, 'B': 1, 'C': 4}).values()) == 4
+
+    rng = random.Random(0)
+    for _ in range(500):
+        candidates = list('ABCDEF')[:rng.randint(1, 6)]
+        ballots = {tuple(rng.sample(candidates, rng.randint(1, len(candidates)))): rng.randint(0, 20) for _ in range(8)}
+        capacity = {c: rng.randint(0, 4) for c in candidates}
+        n_seats = rng.randint(1, max(1, sum(capacity.values())))
+        seats = stv.count_stv(ballots, n_seats, candidates, capacity)
+        assert sum(seats.values()) == min(n_seats, sum(capacity.values()))
+        assert all(seats[c] <= capacity[c] for c in seats)
+
+
+def test_generate_ballots():
+    votes = {'A': 600, 'B': 300, 'C': 100, 'D': 0}
+    model = stv.Transfer_Model(depth=2, exhaust=0.5, affinity={'A': {'C': 0}})
+    ballots = model.generate_ballots(votes)
+    assert sum(ballots.values()) == pytest.approx(1000)
+    assert ('A', 'C') not in ballots and not any('D' in r for r in ballots)
+    assert ballots[('A',)] == pytest.approx(300)
+    assert ballots[('A', 'B')] == pytest.approx(300)
+    assert ballots[('B', 'A')] == pytest.approx(150*600/700)
+
+    with pytest.raises(ValueError):
+        stv.Transfer_Model(exhaust=2)
+
+
+def test_stv_party_seats():
+    election = elections.Spain_2019_11()
+    system = electoral_systems.System('STV', 2, 3)
+    for region in election.get_regions(2).values():
+        seats = region.compute_election_result(system)
+        assert sum(seats.values()) == region.n_seats
+        # No party gets fewer seats than full Droop quotas of first preferences
+        quota = int(region.total_votes / (region.n_seats + 1)) + 1
+        for party, seat in seats.items():
+            assert seat >= min(region.votes[party] // quota, region.n_seats)
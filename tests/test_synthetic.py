@@ -0,0 +1,69 @@
+import json
+import os
+import pytest
+import sys
+
+from app import scaling, synthetic
+from app.electoral_systems import System
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+
+@pytest.mark.parametrize("n_regions", [(7,), (3, 20), (2, 5, 40)])
+@pytest.mark.parametrize("sparse", [True, False])
+def test_synthetic_election(n_regions, sparse):
+    election = synthetic.Synthetic_Election(n_regions, n_parties=30, n_national_parties=5, seats_per_region=(1, 6), sparse=sparse)
+    depth = len(n_regions)
+    assert [len(election.regions[level]) for level in range(depth + 1)] == [1] + list(n_regions)
+
+    # Every level aggregates the highest one
+    leaf_votes = election.get_vote_matrix(depth)
+    for level in range(depth):
+        membership = election.get_level_membership(depth, level)
+        assert (membership.sum(axis=0) == 1).all()
+        assert (membership @ leaf_votes.votes == election.get_vote_matrix(level).votes).all()
+        assert (membership @ leaf_votes.n_seats == election.get_vote_matrix(level).n_seats).all()
+        # The same without building the membership matrix
+        assert (election.aggregate_rows(leaf_votes.votes, depth, level) == election.get_vote_matrix(level).votes).all()
+        assert (election.aggregate_rows(leaf_votes.n_seats, depth, level) == election.get_vote_matrix(level).n_seats).all()
+
+    # Regional parties only run in one region of level 1
+    level_1_votes = election.get_vote_matrix(1).votes
+    assert ((level_1_votes[:, 5:] > 0).sum(axis=0) <= 1).all()
+    assert (level_1_votes[:, :5] > 0).all()
+
+    country_region = election.regions[0][synthetic.COUNTRY_NAME]
+    result = country_region.compute_result(System('SL', depth, '3'))
+    assert sum(sum(seats.values()) for seats in result.result.values()) == country_region.n_seats
+
+    geojson = election.country.get_geojson(depth)
+    assert [f['id'] for f in geojson['features']] == list(election.regions[depth])
+
+
+def test_synthetic_election_errors():
+    with pytest.raises(ValueError):
+        synthetic.Synthetic_Election((10, 5))
+    with pytest.raises(ValueError):
+        synthetic.Synthetic_Election((1, 2, 3, 4))
+    with pytest.raises(ValueError):
+        synthetic.Synthetic_Election(n_parties=5, n_national_parties=6)
+    assert synthetic.Synthetic_Election(seed=1).get_vote_matrix(2).votes.tolist() == \
+        synthetic.Synthetic_Election(seed=1).get_vote_matrix(2).votes.tolist()
+
+
+def test_scaling(tmp_path):
+    assert scaling.get_election_args(dict(scaling.BASE_CONFIG, regions=100000, depth=3))['n_regions'] == (46, 2154, 100000)
+    assert scaling.fit_exponent([10, 100, 1000], [2, 200, 20000]) == pytest.approx(2)
+
+    output, plot = tmp_path / 'scaling.json', tmp_path / 'scaling.html'
+    scaling.main(['parties', '5', '50', '--regions', '50', '--output', str(output), '--plot', str(plot)])
+    with open(output) as f:
+        report = json.load(f)
+    assert report['values'] == [5, 50]
+    assert all(set(r) == set(scaling.PHASES) and all(set(m) == {'time', 'memory'} for m in r.values()) for r in report['results'])
+    assert set(report['exponents']) == {'{} {}'.format(p, m) for p in scaling.PHASES for m in ['time', 'memory']}
+    assert plot.exists()
+
+    report = scaling.run_scaling('depth', [1, 2], phases=['compute_result'], memory=False, base_config=dict(scaling.BASE_CONFIG, regions=20))
+    assert list(report['results'][0]) == ['build', 'compute_result']
@@ -0,0 +1,132 @@
+import os
+import sys
+import threading
+import time
+
+from flask import Flask
+
+from app import elections, electoral_systems
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+# The module used by the engine (imported from app/ by elections)
+import telemetry  # noqa: E402
+
+
+def test_render():
+    counter = telemetry.Counter('test_counter_total', 'Test counter.', ['name'])
+    histogram = telemetry.Histogram('test_seconds', 'Test histogram.', ['name'], buckets=(0.1, 1))
+    try:
+        counter.inc('a "quoted"\nname', amount=2)
+        histogram.observe(0.05, 'a')
+        histogram.observe(0.5, 'a')
+        histogram.observe(5, 'a')
+        text = telemetry.render()
+    finally:
+        telemetry.REGISTRY.remove(counter)
+        telemetry.REGISTRY.remove(histogram)
+
+    assert '# TYPE test_counter_total counter\ntest_counter_total{name="a \\"quoted\\"\\nname"} 2\n' in text
+    assert ('test_seconds_bucket{name="a",le="0.1"} 1\ntest_seconds_bucket{name="a",le="1"} 2\n'
+            'test_seconds_bucket{name="a",le="+Inf"} 3\ntest_seconds_count{name="a"} 3\ntest_seconds_sum{name="a"} 5.55\n') in text
+    assert histogram.get('a') == (3, 5.55)
+
+
+def test_samples_while_observing():
+    counter = telemetry.Counter('test_concurrent_total', 'Test counter.', ['name'])
+    histogram = telemetry.Histogram('test_concurrent_seconds', 'Test histogram.', ['name'])
+    telemetry.REGISTRY.remove(counter)
+    telemetry.REGISTRY.remove(histogram)
+
+    def observe():
+        for i in range(20000):
+            counter.inc(str(i))
+            histogram.observe(0.01, str(i))
+
+    thread = threading.Thread(target=observe)
+    thread.start()
+    # New labels added by the thread never break the iteration of the samples
+    while thread.is_alive():
+        list(counter.samples())
+        samples = list(histogram.samples())
+        assert len(samples) % (len(histogram.buckets) + 2) == 0
+    thread.join()
+    assert len(list(counter.samples())) == 20000
+
+
+def test_phases():
+    @telemetry.timed('figures')
+    def build_figure():
+        time.sleep(0.01)
+        aggregate()
+
+    @telemetry.timed('aggregation')
+    def aggregate():
+        time.sleep(0.02)
+
+    @telemetry.instrument_callback
+    def test_callback(fail):
+        build_figure()
+        if fail:
+            raise ValueError()
+        return 1
+
+    aggregate()  # Outside of a callback
+    assert telemetry.PHASE_SECONDS.get('test_callback', 'aggregation') == (0, 0)
+    assert test_callback(False) == 1
+    try:
+        test_callback(True)
+    except ValueError:
+        pass
+
+    assert telemetry.CALLBACK_CALLS.get('test_callback', 'ok') == telemetry.CALLBACK_CALLS.get('test_callback', 'error') == 1
+    count, figures = telemetry.PHASE_SECONDS.get('test_callback', 'figures')
+    assert count == 2 and 0.02 <= figures < 0.04
+    count, aggregation = telemetry.PHASE_SECONDS.get('test_callback', 'aggregation')
+    assert count == 2 and 0.04 <= aggregation
+    count, total = telemetry.CALLBACK_SECONDS.get('test_callback')
+    assert count == 2 and total >= figures + aggregation
+
+
+def test_install():
+    server = Flask(__name__)
+    telemetry.install(server)
+
+    @server.route('/callback')
+    @telemetry.instrument_callback
+    def server_callback():
+        return 'x' * 10
+
+    client = server.test_client()
+    assert client.get('/callback').status_code == 200
+    assert telemetry.PHASE_SECONDS.get('server_callback', 'serialization')[0] == 1
+    assert telemetry.CALLBACK_SECONDS.get('server_callback')[0] == 1
+
+    response = client.get(telemetry.METRICS_PATH)
+    assert response.mimetype == 'text/plain'
+    assert 'dash_callback_calls_total{callback="server_callback",status="ok"} 1' in response.get_data(as_text=True)
+
+
+def test_is_authorized():
+    server = Flask(__name__)
+    for headers, query, authorized in [({'Authorization': 'Bearer secret'}, '', True), ({}, '?token=secret', True),
+                                       ({'Authorization': 'Bearer other'}, '?token=secret', False), ({}, '', False)]:
+        with server.test_request_context('/admin' + query, headers=headers):
+            assert telemetry.is_authorized('secret') == authorized
+
+
+def test_engine_counters():
+    election = elections.Costa_Rica_2018()
+    region = election.regions[0]['Costa Rica']
+    calls = telemetry.APPORTIONMENTS.get('LRM-Hare')
+    region.compute_result(electoral_systems.System('LRM-Hare', 1, 3))
+    assert telemetry.APPORTIONMENTS.get('LRM-Hare') == calls + len(election.regions[1])
+
+    misses = telemetry.CACHE_REQUESTS.get('vote_matrix', 'miss')
+    hits = telemetry.CACHE_REQUESTS.get('vote_matrix', 'hit')
+    election.get_vote_matrix(1)
+    election.get_vote_matrix(1)
+    assert telemetry.CACHE_REQUESTS.get('vote_matrix', 'miss') == misses + 1
+    assert telemetry.CACHE_REQUESTS.get('vote_matrix', 'hit') == hits + 1
+    assert 0 < telemetry.get_cache_hit_ratios()[('vote_matrix',)] < 1
@@ -0,0 +1,92 @@
+import os
+import pytest
+import sys
+
+import plotly.graph_objects as go
+
+from app import comparisons, electoral_systems, elections, groupings, tooltips
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../app')
+
+t_election = elections.Spain_2019_11()
+t_country = t_election.regions[0]['Spain']
+
+
+def get_seats(result):
+    seats = {}
+    for region_seats in result.result.values():
+        for party, n in region_seats.items():
+            seats[party] = seats.get(party, 0) + n
+    return seats
+
+
+@pytest.mark.parametrize("level_1, level_2", [(2, 1), (1, 2), (2, 2)])
+def test_seat_difference(level_1, level_2):
+    system_1 = electoral_systems.System('dHondt', level_1, 3)
+    system_2 = electoral_systems.System('SL', level_2, 5, True)
+    data = tooltips.get_tooltip_data(t_country.compute_result(system_1), t_country.compute_result(system_2))
+
+    # The same as computing the result of every region on hover
+    level = min(level_1, level_2)
+    assert set(data) == set(t_election.regions[level])
+    for name, region in t_election.regions[level].items():
+        assert data[name]['seats'] == get_seats(region.compute_result(system_1))
+        assert data[name]['other_seats'] == get_seats(region.compute_result(system_2))
+
+    figure = go.Figure(tooltips.plot_tooltip(data['Madrid' if level == 2 else 'Galicia'], t_election.colors))
+    assert [trace.type for trace in figure.data] == ['pie', 'pie']
+
+
+def test_lost_votes():
+    system = electoral_systems.System('dHondt', 2, 3)
+    data = tooltips.get_tooltip_data(t_country.compute_result(system))
+    region = t_election.regions[2]['Soria']
+    expected = region.compute_result(system).get_lost_votes()
+    assert data['Soria']['lost_votes'] == [list(x) for x in expected.most_common(4)]
+    assert data['Soria']['n_lost_votes'] == sum(expected.values())
+    assert data['Soria']['total_votes'] == region.total_votes
+
+    figure = go.Figure(tooltips.plot_tooltip(data['Soria'], t_election.colors))
+    expected_figure = region.compute_result(system).plot_tooltip()
+    assert figure.layout.title.text == expected_figure.layout.title.text
+    assert list(figure.data[0].labels) == list(expected_figure.data[0].labels)
+    assert list(figure.data[1].x) == list(expected_figure.data[1].x)
+    assert figure.layout.xaxis.domain == expected_figure.layout.xaxis.domain
+
+    # A region without votes
+    figure = tooltips.plot_tooltip(dict(data['Soria'], lost_votes=[], n_lost_votes=0, total_votes=0), t_election.colors)
+    assert figure['layout']['title']['text'] == 'Soria\t (0 -- 0.00%)'
+
+
+def test_grouping():
+    grouping = groupings.District_Grouping(t_election, {'Galicia': ['A Coruña', 'Lugo', 'Ourense', 'Pontevedra']})
+    system = electoral_systems.System('dHondt', 2, 3)
+    data = tooltips.get_tooltip_data(grouping.compute_result(system), grouping=grouping)
+    assert list(data) == list(t_election.regions[2])
+    assert data['Lugo'] is data['Pontevedra'] and data['Lugo']['title'] == 'Galicia'
+    assert data['Lugo']['seats'] == get_seats(grouping.compute_result(system, region_name='Lugo'))
+
+
+def test_system_comparison():
+    systems = [electoral_systems.System(name, 2, 3) for name in ['dHondt', 'SL', 'LRM-Hare']]
+    comparison = comparisons.Comparison_Matrix(t_election, systems)
+    data = comparison.get_tooltip_data()
+    assert list(data) == list(t_election.regions[2])
+
+    # The same as the tooltip of the comparison
+    figure = go.Figure(tooltips.plot_tooltip(data['Madrid'], t_election.colors))
+    expected_figure = comparison.plot_tooltip('Madrid')
+    assert [list(row) for row in figure.data[0].z] == [list(row) for row in expected_figure.data[0].z]
+    assert list(figure.data[0].x) == list(expected_figure.data[0].x) == ['dHondt', 'SL', 'LRM-Hare']
+    assert figure.layout.title.text == expected_figure.layout.title.text == 'Madrid'
+    assert figure.layout.height == expected_figure.layout.height and figure.data[0].showscale is False
+
+
+def test_cache():
+    cache = tooltips.Tooltip_Cache(size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)  # Drops 'b', the least recently used
+    assert cache.get('b') is None and cache.get('a') == 1 and cache.get('c') == 3